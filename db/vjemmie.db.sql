@@ -47,10 +47,68 @@ CREATE TABLE IF NOT EXISTS "tweets" (
 	PRIMARY KEY("tweetID"),
 	FOREIGN KEY("username") REFERENCES "twitter"("username")
 );
+CREATE TABLE IF NOT EXISTS "twitter_aliases" (
+	"alias"	TEXT NOT NULL UNIQUE,
+	"username"	TEXT NOT NULL,
+	PRIMARY KEY("alias"),
+	FOREIGN KEY("username") REFERENCES "twitter"("username")
+);
+CREATE INDEX IF NOT EXISTS "tweets_username" ON "tweets" ("username");
+CREATE TABLE IF NOT EXISTS "twitter_cursors" (
+	"username"	TEXT NOT NULL UNIQUE,
+	"newest"	INTEGER,
+	"oldest"	INTEGER,
+	"exhausted"	INTEGER NOT NULL DEFAULT 0,
+	PRIMARY KEY("username"),
+	FOREIGN KEY("username") REFERENCES "twitter"("username")
+);
 CREATE TABLE IF NOT EXISTS "bag" (
 	"guild_id"	INTEGER NOT NULL UNIQUE,
 	"channel_id"	INTEGER,
 	"role_id"	INTEGER,
 	PRIMARY KEY("guild_id")
 );
+CREATE TABLE IF NOT EXISTS "ladder_players" (
+	"uid"	INTEGER NOT NULL UNIQUE,
+	"mu"	REAL NOT NULL,
+	"sigma"	REAL NOT NULL,
+	"wins"	INTEGER NOT NULL DEFAULT 0,
+	"losses"	INTEGER NOT NULL DEFAULT 0,
+	"draws"	INTEGER NOT NULL DEFAULT 0,
+	PRIMARY KEY("uid")
+);
+CREATE TABLE IF NOT EXISTS "ladder_matches" (
+	"matchID"	INTEGER NOT NULL UNIQUE,
+	"playedAt"	REAL NOT NULL,
+	"winner"	INTEGER NOT NULL,
+	PRIMARY KEY("matchID" AUTOINCREMENT)
+);
+CREATE TABLE IF NOT EXISTS "ladder_match_players" (
+	"matchID"	INTEGER NOT NULL,
+	"uid"	INTEGER NOT NULL,
+	"team"	INTEGER NOT NULL,
+	"muBefore"	REAL NOT NULL,
+	"sigmaBefore"	REAL NOT NULL,
+	"muAfter"	REAL NOT NULL,
+	"sigmaAfter"	REAL NOT NULL,
+	PRIMARY KEY("matchID","uid"),
+	FOREIGN KEY("matchID") REFERENCES "ladder_matches"("matchID"),
+	FOREIGN KEY("uid") REFERENCES "ladder_players"("uid")
+);
+CREATE INDEX IF NOT EXISTS "ladder_match_players_uid" ON "ladder_match_players" ("uid");
+CREATE TABLE IF NOT EXISTS "ladder_seeds" (
+	"uid"	INTEGER NOT NULL UNIQUE,
+	"mu"	REAL NOT NULL,
+	"sigma"	REAL NOT NULL,
+	"wins"	INTEGER NOT NULL DEFAULT 0,
+	"losses"	INTEGER NOT NULL DEFAULT 0,
+	"draws"	INTEGER NOT NULL DEFAULT 0,
+	PRIMARY KEY("uid")
+);
+CREATE TABLE IF NOT EXISTS "ladder_resets" (
+	"resetID"	INTEGER NOT NULL UNIQUE,
+	"resetAt"	REAL NOT NULL,
+	"lastMatchID"	INTEGER NOT NULL,
+	PRIMARY KEY("resetID" AUTOINCREMENT)
+);
 COMMIT;
@@ -7,15 +7,18 @@ with suppress(ImportError):
     uvloop.install()
 
 from discord import Intents
-from discord.ext.commands import Bot, Command, Cog
+from discord.ext.commands import Bot, Command, Cog, GroupMixin
 
 from .db import MAIN_DB, init_db
 from .cogs import COGS, BotSetupCog
 from .tests.test_cog import TestCog
-from .utils.patching.commands import patch_command_signature
+from .utils.json import flush_blocking
+from .utils.patching.commands import (patch_command_listeners,
+                                     patch_command_signature)
 
 
 patch_command_signature(Command)
+patch_command_listeners(GroupMixin)
 
 
 def run(secrets,
@@ -54,4 +57,7 @@ def run(secrets,
     bot.add_cog(BotSetupCog(bot=bot))  # make sure BotSetupCog runs last
 
     # Run bot
-    bot.run(secrets.BOT_TOKEN if not test else secrets.DEV_BOT_TOKEN)
+    try:
+        bot.run(secrets.BOT_TOKEN if not test else secrets.DEV_BOT_TOKEN)
+    finally:
+        flush_blocking() # Write anything still scheduled to disk
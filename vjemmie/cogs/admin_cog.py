@@ -18,11 +18,11 @@ from aiofile import AIOFile
 from discord.ext import commands, tasks
 
 from ..config import OWNER_ID, TRUSTED_DIR, TRUSTED_PATH, YES_ARGS
-from ..utils.access_control import (Categories, add_trusted_member,
+from ..utils.access_control import (ACCESS, Categories, add_trusted_member,
                                     add_trusted_role, get_trusted_members,
                                     get_trusted_roles, remove_trusted_member,
                                     remove_trusted_role)
-from ..utils.checks import admins_only, load_blacklist, save_blacklist
+from ..utils.checks import admins_only
 from ..utils.exceptions import CommandError
 from ..utils.printing import eprint
 from .base_cog import BaseCog, EmbedField
@@ -266,10 +266,7 @@ class AdminCog(BaseCog):
     @admins_only()
     async def blacklist(self, ctx: commands.Context, member: commands.MemberConverter=None, command: str=None, *, output: bool=True) -> None:
         if member: # Proceed if discord.commands.MemberConverter returns a member
-            blacklist = load_blacklist() # Get most recent version of blacklist
-            if member.id not in blacklist:
-                blacklist.append(member.id)
-                save_blacklist(blacklist) # Save new version of blacklist
+            ACCESS.add_blacklist(member.id)
             if output:
                 await ctx.send(await self.make_codeblock(f"Added {member.name} to blacklist"))
         else:
@@ -282,7 +279,7 @@ class AdminCog(BaseCog):
         list_name = list_name.lower()
         out_list = None
         if list_name in ["black", "blacklist", "blvck"]:
-            out_list = load_blacklist()
+            out_list = sorted(ACCESS.get_blacklist())
         # TODO: Add other lists (commands, cogs, etc.)
         if out_list:
             out_list = [self.bot.get_user(user_id).name for user_id in out_list]
@@ -295,11 +292,10 @@ class AdminCog(BaseCog):
     @admins_only()
     async def unblacklist(self, ctx: commands.Context, member: commands.MemberConverter=None, command: str=None, *, output: bool=True) -> None:
         if member: # Proceed if discord.commands.MemberConverter returns a member
-            blacklist = load_blacklist() # Get most recent version of blacklist
-            if member.id in blacklist:
-                blacklist.remove(member.id)
-                save_blacklist(blacklist) # Save new version of blacklist
+            if ACCESS.remove_blacklist(member.id):
                 out_msg = f"Removed {member.name} from blacklist"
+            else:
+                out_msg = f"{member.name} is not blacklisted"
         else:
             await ctx.send("Do you want to clear the entire blacklist?")
             def pred(m) -> bool:
@@ -311,7 +307,7 @@ class AdminCog(BaseCog):
             else:
                 r = reply.content.lower()
                 if r in YES_ARGS:
-                    save_blacklist([]) # Clear blacklist
+                    ACCESS.clear_blacklist()
                     out_msg = "Cleared blacklist"
                 else:
                     out_msg = "Blacklist unchanged"
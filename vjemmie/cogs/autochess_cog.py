@@ -2,7 +2,8 @@ import asyncio
 from dataclasses import dataclass
 from datetime import datetime, timezone
 from functools import partial
-from typing import Dict, Tuple, Union
+from types import MappingProxyType
+from typing import Dict, Mapping, Tuple, Union
 
 import ciso8601
 import discord
@@ -10,7 +11,7 @@ from bs4 import BeautifulSoup
 from discord.ext import commands
 
 from ..config import ALL_ARGS, YES_ARGS
-from ..utils.caching import get_cached
+from ..utils.caching import cached_loader
 from ..utils.checks import admins_only
 from ..utils.converters import SteamID64Converter, UserOrMeConverter
 from ..utils.datetimeutils import format_time_difference
@@ -72,7 +73,7 @@ RANK_EMOJIS = {
 }
 USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/74.0.3729.169 Safari/537.36"
 
-@dataclass
+@dataclass(frozen=True)
 class AutochessProfile:
     steamid: Union[str, int] = None
     userid: int = 0
@@ -170,6 +171,12 @@ class AutochessProfile:
         return last_updated
 
 
+@cached_loader(USERS_FILE, "autochess")
+def load_users(users: dict) -> Mapping[str, AutochessProfile]:
+    """Profiles of added users. Key: Discord user ID"""
+    return MappingProxyType({k: AutochessProfile(**v) for k, v in users.items()})
+
+
 class AutoChessCog(BaseCog):
     """Dota Autochess commands."""
     EMOJI = "♟️"
@@ -177,12 +184,8 @@ class AutoChessCog(BaseCog):
     DIRS = ["db/autochess"]
 
     @property
-    def users(self) -> Dict[str, AutochessProfile]:
-        users = {}
-        _users_raw = get_cached(USERS_FILE, "autochess")
-        for k, v in _users_raw.items():
-            users[k] = AutochessProfile(**v)
-        return users
+    def users(self) -> Mapping[str, AutochessProfile]:
+        return load_users()
 
     async def dump_users(self, users: dict) -> None:
         await dump_json(USERS_FILE, users, default=lambda o: o.__dict__)
@@ -213,7 +216,7 @@ class AutoChessCog(BaseCog):
 
     async def _do_add_user(self, user: discord.User, steamid: str) -> None:
         profile = await self.scrape_op_gg_stats(steamid, user.id)
-        users = self.users
+        users = dict(self.users)
         users[str(user.id)] = profile
         await self.dump_users(users)
 
@@ -1,7 +1,8 @@
 from __future__ import annotations
 
 import io
-from itertools import zip_longest
+import math
+from itertools import cycle, zip_longest
 from typing import List, Tuple, Union, Optional, Callable
 from unidecode import unidecode
 from dataclasses import dataclass, field
@@ -14,8 +15,10 @@ from PIL import Image, ImageDraw, ImageFont, ImageFilter
 
 from .base_cog import BaseCog
 from ..utils.converters import NonCaseSensMemberConverter, MemberOrURLConverter
-from ..utils.commands import add_command
+from ..utils.commands import CommandDef, CommandRegistry
+from ..utils.concurrency import gather_bounded
 from ..utils.exceptions import CommandError
+from ..utils.images import EncodedImage, encode_image
 
 
 @dataclass
@@ -83,21 +86,67 @@ class AvatarCog(BaseCog):
     
     EMOJI = ":person_frowning:"
 
+    # Batch mode options
+    BATCH_MAX_USERS = 25 # Maximum number of users in a single batch image
+    BATCH_FETCH_LIMIT = 8 # Maximum number of concurrent avatar downloads
+
     def __init__(self, bot: commands.Bot) -> None:
         super().__init__(bot)
+        self.avatar_commands = CommandRegistry(self, avatar_command)
         self.add_avatar_commands()
     
     def add_avatar_commands(self) -> None:
-        for command in avatar_commands:
-            add_command(
-                self, 
-                avatar_command, 
-                name=command.name, 
+        self.avatar_commands.sync(
+            CommandDef(
+                name=command.name,
                 aliases=command.aliases,
-                help=command.help,
-                command=command
+                help=command.help or "",
+                kwargs={"command": command}
             )
-    
+            for command in avatar_commands
+        )
+
+    def get_avatar_command(self, name: str) -> Optional[AvatarCommand]:
+        """Looks up an avatar command by name or alias."""
+        d = self.avatar_commands.get(name.lower())
+        return d.kwargs["command"] if d else None
+
+    @commands.command(name="batchavatar", aliases=["vcavatar", "vcavatars"], usage="<template> [users...]")
+    async def batch_avatar(self, ctx: commands.Context, template: str, *users: NonCaseSensMemberConverter) -> None:
+        """Avatar template for several users at once.
+        
+        Uses every member in your voice channel if no users are specified.
+        """
+        command = self.get_avatar_command(template)
+        if not command:
+            raise CommandError(f"No avatar template named `{template}`!")
+
+        members = list(users) or await self.get_members_in_voice_channel(ctx)
+        if not members:
+            raise CommandError("No users to create an image for!")
+        if len(members) > self.BATCH_MAX_USERS:
+            raise CommandError(f"Cannot create an image for more than {self.BATCH_MAX_USERS} users!")
+
+        async with ctx.typing():
+            await self.make_batch_composite_image(ctx, command, members)
+
+    async def _get_avatar(self, ctx: commands.Context, user: Optional[Union[discord.Member, str]]) -> io.BytesIO:
+        """Downloads a user's avatar, or an image if `user` is an image URL.
+        Falls back on the message author's avatar if `user` is None."""
+        # Use message author's avatar if no user is specified
+        if not user:
+            avatar_url = ctx.message.author.avatar_url
+        elif isinstance(user, (discord.Member, discord.User)):
+            avatar_url = user.avatar_url
+        elif isinstance(user, str):
+            avatar_url = user
+        else:
+            raise TypeError("Argument 'user' must be type 'discord.User' or an image URL of type 'str'")
+        
+        if isinstance(avatar_url, discord.asset.Asset):
+            return io.BytesIO(await avatar_url.read())
+        return await self.download_from_url(ctx, avatar_url)
+
     async def make_composite_image(
                             self,
                             ctx: commands.Context,
@@ -118,32 +167,91 @@ class AvatarCog(BaseCog):
             A Discord user. If specified, this user's avatar is 
             downloaded in place of the message author's.
         """
-        # Use message author's avatar if no user is specified
-        if not user:
-            avatar_url = ctx.message.author.avatar_url
-        elif isinstance(user, discord.Member):
-            avatar_url = user.avatar_url
-        elif isinstance(user, str):
-            avatar_url = user
-        else:
-            raise TypeError("Argument 'user' must be type 'discord.User' or an image URL of type 'str'")
-        
-        if isinstance(avatar_url, discord.asset.Asset):
-            _avatar = io.BytesIO(await avatar_url.read())
-        else:
-            _avatar = await self.download_from_url(ctx, avatar_url)
+        _avatar = await self._get_avatar(ctx, user)
 
         result = await self.bot.loop.run_in_executor(
             None, 
             self._do_make_composite_image, 
             command,
-            _avatar
+            _avatar,
+            self.get_image_upload_limit()
         )
-        embed = await self.get_embed_from_img_upload(ctx, result, "out.png")
+        embed = await self.get_embed_from_img_upload(ctx, result.data, result.filename("out"))
+        await ctx.send(embed=embed)
+
+    async def make_batch_composite_image(
+                            self,
+                            ctx: commands.Context,
+                            command: AvatarCommand,
+                            users: List[discord.Member],
+                            ) -> None:
+        """Creates a composite image of several users' avatars and a given template.
+
+        All avatars are downloaded concurrently, after which the entire
+        image is composited in a single executor job.
+        
+        Parameters
+        ----------
+        ctx : `commands.Context`
+            Discord Context object 
+        command : `AvatarCommand`
+            Avatar command whose template is used
+        users : `List[discord.Member]`
+            Discord users whose avatars are added to the template.
+            Users fill up the template's avatar placements in order.
+            If there are more users than placements, the template is
+            repeated and the results are arranged in a grid.
+        """
+        avatars = await gather_bounded(
+            (self._get_avatar(ctx, user) for user in users), 
+            limit=self.BATCH_FETCH_LIMIT
+        )
+        names = [unidecode(user.name) for user in users]
+
+        result = await self.bot.loop.run_in_executor(
+            None,
+            self._do_make_batch_composite_image,
+            command,
+            avatars,
+            names,
+            self.get_image_upload_limit()
+        )
+        embed = await self.get_embed_from_img_upload(ctx, result.data, result.filename("out"))
         await ctx.send(embed=embed)
     
-    def _do_make_composite_image(self, command: AvatarCommand, byteavatar: io.BytesIO) -> io.BytesIO:
+    def _do_make_composite_image(self, command: AvatarCommand, byteavatar: io.BytesIO, max_bytes: int) -> EncodedImage:
         avatar = Image.open(byteavatar)
+        background = self._load_template(command)
+        background = self._render_template(background, command, [avatar], command.text)
+        return self._save_image(background, max_bytes)
+
+    def _do_make_batch_composite_image(self, 
+                                       command: AvatarCommand, 
+                                       byteavatars: List[io.BytesIO],
+                                       names: List[str],
+                                       max_bytes: int
+                                      ) -> EncodedImage:
+        avatars = [Image.open(byteavatar) for byteavatar in byteavatars]
+        template = self._load_template(command)
+
+        # Fill each copy of the template with as many avatars as it has placements
+        n = len(command.avatars)
+        images = []
+        for i in range(0, len(avatars), n):
+            chunk_avatars = avatars[i:i+n]
+            chunk_names = names[i:i+n]
+
+            # Each text defaults to the name of the user with the same index
+            texts = deepcopy(command.text)
+            for text, name in zip(texts, cycle(chunk_names)):
+                if not text.content:
+                    text.content = name
+
+            images.append(self._render_template(template.copy(), command, chunk_avatars, texts))
+
+        return self._save_image(self._make_grid(images), max_bytes)
+
+    def _load_template(self, command: AvatarCommand) -> Image.Image:
         tpath = Path(f"memes/templates/{command.template}")
         if not tpath.exists():
             raise CommandError(f"Template {command.template}")
@@ -152,19 +260,39 @@ class AvatarCog(BaseCog):
         # Convert template to RGBA
         if background.mode == "RGB":
             background.putalpha(255) # puts an alpha channel on the image
+        return background
 
-        # Add avatar to template
-        background = self._add_avatar(background, avatar, command.avatars, command.template_overlay)
+    def _render_template(self, 
+                         background: Image.Image, 
+                         command: AvatarCommand, 
+                         user_avatars: List[Image.Image],
+                         texts: List[Text]
+                        ) -> Image.Image:
+        # Add avatar(s) to template
+        background = self._add_avatar(background, user_avatars, command.avatars, command.template_overlay)
 
         # Add text
-        for txt in command.text:
+        for txt in texts:
             background = self._add_text(background, txt)
+        return background
+
+    def _make_grid(self, images: List[Image.Image]) -> Image.Image:
+        """Arranges equally sized images in a (roughly) square grid."""
+        if len(images) == 1:
+            return images[0]
+        
+        w, h = images[0].size
+        columns = math.ceil(math.sqrt(len(images)))
+        rows = math.ceil(len(images) / columns)
+
+        grid = Image.new("RGBA", (w * columns, h * rows))
+        for i, image in enumerate(images):
+            grid.paste(image, ((i % columns) * w, (i // columns) * h))
+        return grid
 
-        # Save image to file-like object
-        result = io.BytesIO()
-        background.save(result, format="PNG")
-        result.seek(0) # Seek to byte 0, so discord.File can use BytesIO.read()
-        return result        
+    def _save_image(self, image: Image.Image, max_bytes: int) -> EncodedImage:
+        # Save image to file-like object, using the best format that fits the upload limit
+        return encode_image(image, max_bytes)
 
     def _resize_paste(
                         self, 
@@ -195,11 +323,11 @@ class AvatarCog(BaseCog):
     
     def _add_avatar(self, 
                   background: Image.Image, 
-                  user_avatar: Image.Image, 
+                  user_avatars: List[Image.Image], 
                   avatars: List[Avatar],
                   template_overlay: bool) -> Image.Image:
-        # Paste user avatars
-        for av in avatars:
+        # Paste user avatars. Avatars are repeated if there are more placements than users
+        for av, user_avatar in zip(avatars, cycle(user_avatars)):
             # Template goes on top of image
             if template_overlay:
                 new = Image.new("RGBA", background.size)
@@ -18,11 +18,13 @@ from aiofile import AIOFile
 from discord import Embed
 from discord.ext import commands
 from httpcore._exceptions import ConnectError, ConnectTimeout
+from PIL import Image
 from prawcore.exceptions import Forbidden as PrawForbidden
 from youtube_dl import DownloadError
 
 from ..config import (AUTHOR_MENTION, COMMAND_INVOCATION_CHANNEL,
-                      DOWNLOAD_CHANNEL_ID, DOWNLOADS_ALLOWED, ERROR_CHANNEL_ID,
+                      DISCORD_UPLOAD_LIMIT, DOWNLOAD_CHANNEL_ID,
+                      DOWNLOADS_ALLOWED, ERROR_CHANNEL_ID,
                       GUILD_HISTORY_CHANNEL, IMAGE_CHANNEL_ID, LOG_CHANNEL_ID,
                       MAX_DL_SIZE)
 from ..utils.exceptions import (VJEMMIE_EXCEPTIONS, BotPermissionError,
@@ -31,6 +33,8 @@ from ..utils.exceptions import (VJEMMIE_EXCEPTIONS, BotPermissionError,
                                 NoContextException)
 from ..utils.experimental import get_ctx
 from ..utils.http import get
+from ..utils.images import ENCODER_CHAIN, PNG, EncodedImage, encode_image
+from ..utils.output import send_embeds, send_text, split_chunks, split_lines
 from ..utils.time import format_time
 from ..utils.users import get_user
 from ..utils.voting import NotEnoughVotes
@@ -96,6 +100,9 @@ class BaseCog(commands.Cog):
     MAX_DL_SIZE = MAX_DL_SIZE
     DOWNLOADS_ALLOWED = DOWNLOADS_ALLOWED
 
+    # Upload options
+    UPLOAD_LIMIT = DISCORD_UPLOAD_LIMIT
+
     # Embed Options
     CHAR_LIMIT = 1800
     EMBED_CHAR_LIMIT = 1000
@@ -652,93 +659,66 @@ class BaseCog(commands.Cog):
 
         channel = self.bot.get_channel(self.IMAGE_CHANNEL_ID)
 
+        # Shrink images that exceed the channel's upload size limit
+        limit = self.get_upload_limit(channel)
+        if data.getbuffer().nbytes > limit:
+            data, filename = await self.shrink_image_upload(data, filename, limit)
+
         f = discord.File(data, filename)
         msg = await channel.send(file=f)
 
         return msg # Could do return await.channel.send(), but I think this is more self documenting
 
-    async def _get_cog_commands(self, ctx: commands.Context, advanced: bool=False) -> None:
-        """Sends an embed listing all commands belonging the cog.
-
-        The method compiles a list of commands defined by the invoking cog,
-        after which the list elements are string-formatted and added to
-        an embed sent to the Discord channel `ctx.message.author.channel`.
+    def get_upload_limit(self, channel: discord.abc.Messageable) -> int:
+        """Returns the attachment size limit (in bytes) of a channel."""
+        guild = getattr(channel, "guild", None)
+        if guild:
+            return guild.filesize_limit
+        return self.UPLOAD_LIMIT
 
-        NOTE
-        ----
-        This method should only be invoked through a bot command. 
-        Argument `ctx` is required to have the `message.author.channel`
-        attribute.
+    def get_image_upload_limit(self) -> int:
+        """Returns the attachment size limit (in bytes) of the image rehosting channel."""
+        channel = self.bot.get_channel(self.IMAGE_CHANNEL_ID)
+        return self.get_upload_limit(channel) if channel else self.UPLOAD_LIMIT
 
+    async def shrink_image_upload(self, data: io.BytesIO, filename: str, limit: int) -> Tuple[io.BytesIO, str]:
+        """Re-encodes an image so it fits within an upload size limit.
+        
         Parameters
         ----------
-        ctx : `commands.Context`
-            Discord Context object
-        advanced : `bool`, optional
-            Defines whether the command listing should display calling
-            signatures or not. (the default is False, which ommits signatures)
-        """
-        # Get commands for current cog
-        # NOTE: Replace with walk_commands() to get subcommands?
-        commands_ = await self.get_invokable_commands(ctx)
-        commands_ = sorted(commands_, key=lambda cmd: cmd.name)
-
-        # Get commands as string of command names + descriptions, separated by newlines
-        out = []
-        for command in commands_:
-
-            # Skip commands that fail for current context or are hidden
-            if not await command.can_run(ctx) or command.hidden or not command.enabled:
-                continue
-
-            group = False
-
-            if isinstance(command, commands.Group):
-                cmds = list(command.commands)
-                cmds.sort(key=lambda k: k.name)
-                cmds.insert(0, command)
-                group = True
-            else:
-                cmds = [command]
-
-            for cmd in cmds:
-                # Show bot command prefix if command is not a subcommand
-                subcommand = group and type(cmd) == commands.Command
-                prefix = f"{self.bot.command_prefix}" if not subcommand else ""
-
-                # Add indent to subcommands
-                indent = f"-{self.EMBED_FILL_CHAR*2}" if type(cmd) == commands.Command and subcommand else ""
-                # Add right side padding if no indent
-                padding = "\xa0"*2 if not indent else ""
-
-                # Show command signature on advanced output
-                if advanced:
-                    cmd_name = f"{cmd.name} {cmd.signature}".ljust(35, "\xa0")
-                else:
-                    cmd_name = cmd.name.ljust(20,"\xa0")
-
-                # Add docstring prefix from check
-                doc = cmd.short_doc
-                for check in cmd.checks:
-                    if hasattr(check, "doc_prefix"):
-                        doc = f"{check.doc_prefix} {cmd.short_doc}"
-                        break
-
-                out.append(f"`{indent}{prefix}{cmd_name}{padding}:` {doc}")
-
-        out_str = "\n".join(out)
+        data : `io.BytesIO`
+            File-like image byte stream
+        filename : `str`
+            Filename + filetype.
+        limit : `int`
+            Upload size limit in bytes
 
-        if advanced and out_str:
-            # Add command signature legend string if advanced output is enabled
-            out_str = self.SIGNATURE_HELP + out_str
+        Raises
+        ------
+        `FileSizeError`
+            Raised if file is not an image or cannot be shrunk
+            enough to fit within the limit.
+        
+        Returns
+        -------
+        `Tuple[io.BytesIO, str]`
+            Re-encoded image and its new filename
+        """
+        fname, ext = os.path.splitext(filename)
+        if ext.lower() not in self.IMAGE_EXTENSIONS or ext.lower() == ".gif":
+            raise FileSizeError(f"File exceeds upload limit of {limit / 1_000_000} MB")
 
-        return out_str
+        def to_run() -> EncodedImage:
+            with Image.open(data) as image:
+                # Skip plain PNG, which is what most oversized images already are
+                chain = [stage for stage in ENCODER_CHAIN if stage != PNG]
+                return encode_image(image, limit, chain=chain)
 
-    async def send_cog_commands(self, ctx: commands.Context, advanced: bool=False) -> None:
-        out = await self._get_cog_commands(ctx, advanced)
-        if not out:
-            raise CommandError("Cog has no commands!")
-        await self.send_embed_message(ctx, f"{self.EMOJI} {self.cog_name} commands", out)
+        try:
+            encoded = await self.bot.loop.run_in_executor(None, to_run)
+        except ValueError:
+            raise FileSizeError(f"Unable to shrink image below upload limit of {limit / 1_000_000} MB")
+        return encoded.data, encoded.filename(fname)
 
     async def send_text_message(self,
                                 text: str,
@@ -767,18 +747,17 @@ class BaseCog(commands.Cog):
         else:
             raise discord.DiscordException('"ctx" or "channel_id" must be specified')
 
-        # Split string into chunks
-        chunks = await self._split_string_to_chunks(text)
+        # Split string into chunks, preferably between lines
+        chunks = split_lines(text, self.CHAR_LIMIT)
 
         # Send chunked messages
-        for chunk in chunks:
-            await channel.send(chunk)
+        await send_text(channel, chunks)
 
     async def _split_string_to_chunks(self, text: str, limit: int=None) -> List[str]:
         """Splits a string into (default: 1800) char long chunks."""
         if not limit or limit>self.CHAR_LIMIT:
             limit = self.CHAR_LIMIT
-        return [text[i:i+limit] for i in range(0, len(text), limit)]
+        return split_chunks(text, limit)
 
     async def _split_string_by_lines(self, text: str, limit: int=None, strict: bool=False) -> List[str]:
         """Splits a string into `limit`-sized chunks. DEFAULT: 1024
@@ -787,42 +766,12 @@ class BaseCog(commands.Cog):
         occurences of newline chars, whereas `BaseCog._split_string_to_chunks()` 
         splits string into n<=limit chunks, with no regard for splitting
         words or sentences based on newline chars.
+        Lines longer than `limit` are split into chunks of their own,
+        unless `strict` is True.
         """
         if not limit or limit > self.EMBED_CHAR_LIMIT:
             limit = self.EMBED_CHAR_LIMIT
-        
-        if len(text) < limit: # no need to split
-            return [text]
-        
-        chunk = "" # Lines in a chunk
-        chunk_len = 0 # Size of current chunk
-        chunks = []
-        
-        for line in text.splitlines(keepends=True):
-            line_len = len(line)
-            
-            # Handle lines whose length exceeds limit
-            if line_len > limit:
-                if strict:
-                    raise discord.DiscordException(
-                        "Unable to split string. Line length exceeds limit!"
-                    )
-                else: # Fall back on _split_string_to_chunks()
-                    return await self._split_string_to_chunks(text, limit)
-            
-            if chunk_len + line_len > limit:
-                chunks.append(chunk)
-                chunk = ""
-                chunk_len = 0
-            
-            chunk += line
-            chunk_len += line_len
-        
-        else:
-            if chunk:
-                chunks.append(chunk)
-        
-        return chunks
+        return split_lines(text, limit, strict)
 
     async def send_embed_message(self,
                                  ctx: commands.Context,
@@ -874,16 +823,17 @@ class BaseCog(commands.Cog):
         
         if len(text_fields) > 1:
             t = title if keep_title else Embed.Empty
+            last = len(text_fields) - 1
             embeds = [
                 # Include header but no footer on first message
                 await self.get_embed(ctx, title=title, description=field, footer=False, **kwargs)
-                if text_fields[0] == field else
+                if i == 0 else
                 # Include footer but no header on last message
                 await self.get_embed(ctx, title=t, description=field, footer=footer, **kwargs)
-                if text_fields[-1] == field else
+                if i == last else
                 # No footer or header on middle message(s)
                 await self.get_embed(ctx, title=t, description=field, footer=False, **kwargs)
-                for field in text_fields
+                for i, field in enumerate(text_fields)
             ]
         else:
             # Create normal embed with title and footer if text is not chunked
@@ -900,16 +850,21 @@ class BaseCog(commands.Cog):
         if return_embeds:
             return embeds
 
-        # Send each embed object to ctx.channel
+        # Send embeds to ctx.channel, up to 10 per message
         if channel:
             ctx = channel
 
-        for embed in embeds:
-            # Add message text to first message
-            if embed == embeds[0]:
-                await ctx.send(content=message_text, embed=embed)
-            else:
-                await ctx.send(embed=embed)
+        await self.send_embeds(ctx, embeds, content=message_text)
+
+    async def send_embeds(self,
+                          channel: Union[commands.Context, discord.abc.Messageable],
+                          embeds: List[discord.Embed],
+                          content: Optional[str]=None
+                          ) -> List[discord.Message]:
+        """Sends embeds to a channel in as few messages as possible.
+        `content` is displayed above the embeds of the first message.
+        See `utils.output`."""
+        return await send_embeds(channel, embeds, content)
 
     async def read_send_file(self, ctx: commands.Context, path: Union[str, Path], *, encoding: str="utf-8") -> None:
         """Reads local text file and sends contents to `ctx.channel`"""
@@ -5,7 +5,6 @@ from typing import Optional, Union, List
 
 import discord
 import spotipy
-from praw import Reddit
 from discord.ext import commands
 from github import Github
 from googleapiclient.discovery import build
@@ -15,9 +14,10 @@ from mwthesaurus import MWClient
 
 from ..db import add_db
 from ..config import YOUTUBE_API_SERVICE_NAME, YOUTUBE_API_VERSION, MAIN_DB
-from ..utils import spotify, youtube
-from ..utils.checks import admins_only, load_blacklist, save_blacklist
+from ..utils import http, spotify, youtube
+from ..utils.checks import admins_only
 from ..utils.printing import eprint
+from ..utils.reddit import RedditClient
 from . import reddit_cog, stats_cog, fun_cog
 from .base_cog import BaseCog, EmbedField
 
@@ -39,6 +39,10 @@ class BotSetupCog(BaseCog):
         self.setup_github()
         self.setup_reddit()
         self.setup_mwthesaurus()
+
+    def cog_unload(self) -> None:
+        # Close pooled connections of the bot-wide HTTP client
+        self.bot.loop.create_task(http.close_client())
         
     def setup_spotify(self) -> None:
         if not all(c for c in [
@@ -117,7 +121,7 @@ class BotSetupCog(BaseCog):
                 "3. Retrieve its ID and Secret key"
             )
             return self.remove_cog("RedditCog")
-        reddit_cog.reddit = Reddit(
+        reddit_cog.reddit = RedditClient(
             client_id=self.bot.secrets.REDDIT_ID,
             client_secret=self.bot.secrets.REDDIT_SECRET,
             user_agent=self.bot.secrets.REDDIT_USER_AGENT,
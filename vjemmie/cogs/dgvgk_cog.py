@@ -1,8 +1,11 @@
 import json
 import socket
 import time
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional
+from functools import partial
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
 
 import discord
 import trueskill
@@ -10,15 +13,19 @@ from aiofile import AIOFile
 from discord.ext import commands
 
 from ..db import get_db
-from ..ladder import (ENV_FILE, PLAYERS_FILE, Match, Player, dump_players,
-                      get_new_player, load_players, make_teams, rate)
+from ..ladder import (ENV_FILE, PLAYERS_FILE, Match, Player, find_matches,
+                      get_env_params, get_new_player, load_players,
+                      make_teams)
+from ..ladder.chart import COLORS, draw_rating_chart
+from ..ladder.replay import Replay, replay
 from ..utils.caching import get_cached
 from ..utils.checks import admins_only, dgvgk_cmd
 from ..utils.converters import NonCaseSensMemberConverter
 from ..utils.exceptions import CommandError
 from ..utils.json import dump_json
+from ..utils.messaging import ask_user_yes_no
 from ..utils.voting import SESSIONS, TopicType, vote
-from .base_cog import BaseCog
+from .base_cog import BaseCog, EmbedField
 
 TIDSTYVERI_FILE = "db/dgvgk/tidstyveri.json"
 
@@ -28,13 +35,61 @@ class DGVGKCog(BaseCog):
     EMOJI = "<:julius:695298300257239081>"
 
     DIRS = ["db/dgvgk", "db/dgvgk/ladder"]
-    FILES = [TIDSTYVERI_FILE, PLAYERS_FILE, ENV_FILE]
+    FILES = [TIDSTYVERI_FILE, ENV_FILE]
+
+    PREVIEW_MATCHES = 3 # Default number of lineups shown by !inhouse preview
+    PREVIEW_MAX_MATCHES = 10
+
+    HISTORY_PLAYERS = 5 # Default number of players shown by !inhouse history
+    HISTORY_MAX_PLAYERS = len(COLORS)
 
     def __init__(self, bot: commands.Bot) -> None:
         super().__init__(bot)
         self.tidstyver: Dict[str, float] = {}
         self.game: Optional[Match] = None
         self.db = get_db()
+        self.migrate_players_file()
+
+        # Replays are CPU-bound, so they don't share the GIL with the bot
+        self._replay_executor: Optional[ProcessPoolExecutor] = None
+
+    def cog_unload(self) -> None:
+        if self._replay_executor:
+            self._replay_executor.shutdown(wait=False)
+
+    def migrate_players_file(self) -> None:
+        """Moves ladder players from the old JSON file to the database.
+        NOTE: Blocking! Only used on startup."""
+        p = Path(PLAYERS_FILE)
+        migrated = p.with_suffix(".json.migrated")
+        if not p.exists():
+            # Files migrated before seeds were stored still need their seeds
+            if migrated.exists() and not self.db._ladder_has_seeds():
+                try:
+                    self.db._ladder_add_seeds(load_players(str(migrated)).values())
+                    self.db.conn.commit()
+                except json.JSONDecodeError:
+                    pass
+            return
+
+        try:
+            players = load_players()
+        except json.JSONDecodeError:
+            players = {}
+        # Ratings and records carry over, but matches were never recorded in the JSON file.
+        # They are also stored as seeds, which replays of the match history start from.
+        self.db._ladder_add_players(players.values())
+        self.db._ladder_add_seeds(players.values())
+        self.db.conn.commit()
+
+        # Keep the old file around, but make sure we never migrate it twice
+        p.rename(migrated)
+
+    def get_username(self, uid: int) -> str:
+        """Name of a Discord user, or their ID if the user isn't cached
+        (e.g. players who have left every guild shared with the bot)."""
+        user = self.bot.get_user(uid)
+        return user.name if user else str(uid)
 
     async def save_tidstyveri(self, tidstyveri: dict) -> None:
         try:
@@ -129,6 +184,39 @@ class DGVGKCog(BaseCog):
 
     @inhouse.command(name="teams", aliases=["start", "create"])
     async def inhouse_teams(self, ctx: commands.Context, *ignored) -> None:
+        players = await self.get_lobby(ctx, ignored)
+        game = make_teams(players, team_size=len(players)//2)
+        
+        await self.post_game_info(ctx, game)
+
+        self.game = game
+
+    @inhouse.command(name="preview", aliases=["lineups"])
+    async def inhouse_preview(self, ctx: commands.Context, n: Optional[int]=None, *ignored) -> None:
+        """Show the most balanced lineups without starting a game"""
+        n = min(n or self.PREVIEW_MATCHES, self.PREVIEW_MAX_MATCHES)
+        players = await self.get_lobby(ctx, ignored)
+        matches = find_matches(players, top_k=n)
+
+        def get_names(team: List[Player]) -> str:
+            return ", ".join(self.get_username(p.uid) for p in team)
+
+        fields = [
+            EmbedField(
+                f"Lineup {i}",
+                f"**Team 1:** {get_names(match.team1)}\n"
+                f"**Team 2:** {get_names(match.team2)}\n"
+                f"Team 1 Win Probability: {round(match.win_probability*100)}% | "
+                f"Match Quality: {round(match.quality*100)}%",
+                inline=False
+            )
+            for i, match in enumerate(matches, 1)
+        ]
+        embed = await self.get_embed(ctx, title="Lineups", fields=fields)
+        await ctx.send(embed=embed)
+
+    async def get_lobby(self, ctx: commands.Context, ignored: Tuple[str, ...]) -> Dict[int, Player]:
+        """Gets participants of an inhouse game from the author's voice channel."""
         ignored_users = [
             await NonCaseSensMemberConverter().convert(ctx, user) 
             for user in ignored
@@ -147,29 +235,20 @@ class DGVGKCog(BaseCog):
             raise CommandError("Can only create teams for an even number of players!")
         
         # Load existing players from db
-        players = {
-            int(uid): player 
-            for uid, player in load_players().items()
-            if uid in userids
-        }
+        players = await self.db.ladder_get_players(userids)
 
         # Add new players (if there are any)
         for userid in userids:
             if userid not in players:
                 players[userid] = get_new_player(int(userid))
-
-        game = make_teams(players, team_size=len(players)//2)
-        
-        await self.post_game_info(ctx, game)
-
-        self.game = game
+        return players
 
     async def post_game_info(self, ctx: commands.Context, game: Match) -> None:
         def get_team_str(team: List[Player], n: int) -> str:
             return (
                 f"Team {n}\n```\n" + 
                 "\n".join(
-                    f"* {self.bot.get_user(p.uid).name.ljust(20)}"
+                    f"* {self.get_username(p.uid).ljust(20)}"
                     for p in team
                 ) + 
                 "\n```"
@@ -178,7 +257,8 @@ class DGVGKCog(BaseCog):
         description = (
             f"{get_team_str(game.team1, 1)}\n"
             f"{get_team_str(game.team2, 2)}\n"
-            f"Team 1 Win Probability: {round(game.win_probability*100)}%"
+            f"Team 1 Win Probability: {round(game.win_probability*100)}%\n"
+            f"Match Quality: {round(game.quality*100)}%"
         )
         await self.send_embed_message(ctx, title="Teams", description=description)
     
@@ -194,13 +274,13 @@ class DGVGKCog(BaseCog):
             )
         
         t1_win = winner in ["1", "team 1", "team1", "t1"]
-        if t1_win:
-            winners, losers = self.game.team1, self.game.team2
-        else:
-            winners, losers = self.game.team2, self.game.team1
         
         try:
-            rate(winners, losers)
+            await self.db.ladder_record_match(
+                [p.uid for p in self.game.team1],
+                [p.uid for p in self.game.team2],
+                1 if t1_win else 2
+            )
         except:
             await self.log_error(ctx) # Not ideal, is it?
             raise CommandError("Something went wrong when attempting to update rating!")
@@ -220,14 +300,15 @@ class DGVGKCog(BaseCog):
     @inhouse.command(name="stats", aliases=["leaderboard", "leaderboards"])
     @admins_only()
     async def inhouse_stats(self, ctx: commands.Context) -> None:
-        players = load_players()
+        players = await self.db.ladder_get_players()
         if not players:
             raise CommandError("No players on record!")
         
         plist = sorted(players.values(), key=lambda p: p.rating.mu, reverse=True)
         
         description = "\n".join([await self.fmt_player_stats(p, i) for i, p in enumerate(plist, 1)])
-        top_player_url = self.bot.get_user(plist[0].uid).avatar_url
+        top_player = self.bot.get_user(plist[0].uid)
+        top_player_url = top_player.avatar_url if top_player else None
         
         await self.send_embed_message(ctx, 
                                       title="DGVGK Inhouse Rankings", 
@@ -235,12 +316,96 @@ class DGVGKCog(BaseCog):
                                       thumbnail_url=top_player_url)
 
     async def fmt_player_stats(self, player: Player, n: int) -> str:
-        return (f"**{n}. {self.bot.get_user(player.uid).name}**\n"
+        return (f"**{n}. {self.get_username(player.uid)}**\n"
                 f"Rating: {round(player.rating.mu*40)}\n"
                 f"Matches: {player.wins+player.losses}\n"
                 f"Wins: {player.wins}\n"
                 f"Losses: {player.losses}\n")
 
+    async def run_replay(self, **kwargs) -> Replay:
+        """Replays the match history in a worker process, starting from
+        the seeded ratings of migrated players.
+        Keyword arguments are passed to `ladder.replay.replay`."""
+        matches = await self.db.ladder_get_matches()
+        if not matches:
+            raise CommandError("No matches on record!")
+        seeds = await self.db.ladder_get_seeds()
+        kwargs.setdefault("seeds", {
+            uid: (p.rating.mu, p.rating.sigma, p.wins, p.losses, p.draws)
+            for uid, p in seeds.items()
+        })
+
+        # The worker's copy of the global environment may be outdated
+        env = trueskill.global_env()
+        for param in ["mu", "sigma", "beta", "tau", "draw_probability"]:
+            kwargs.setdefault(param, getattr(env, param))
+        if not self._replay_executor:
+            self._replay_executor = ProcessPoolExecutor(max_workers=1)
+        return await self.bot.loop.run_in_executor(
+            self._replay_executor, partial(replay, matches, **kwargs)
+        )
+
+    @inhouse.command(name="history", aliases=["chart"])
+    async def inhouse_history(self, ctx: commands.Context, *members: NonCaseSensMemberConverter) -> None:
+        """Chart of player ratings over time. Shows the top players by default."""
+        if len(members) > self.HISTORY_MAX_PLAYERS:
+            raise CommandError(f"Can show at most {self.HISTORY_MAX_PLAYERS} players!")
+
+        if members:
+            uids = [m.id for m in members]
+        else:
+            players = await self.db.ladder_get_players()
+            top = sorted(players.values(), key=lambda p: p.rating.mu, reverse=True)
+            uids = [p.uid for p in top[:self.HISTORY_PLAYERS]]
+
+        result = await self.run_replay(uids=uids)
+        series = {
+            self.get_username(uid): [(point.match, point.mu*40) for point in result.history[uid]]
+            for uid in uids
+            if uid in result.history
+        }
+        if not series:
+            raise CommandError("No matches on record for these players!")
+
+        image = await self.bot.loop.run_in_executor(None, draw_rating_chart, series)
+        await ctx.send(file=discord.File(image, "history.png"))
+
+    @inhouse.command(name="replay", aliases=["rerate"])
+    @admins_only()
+    async def inhouse_replay(self, ctx: commands.Context, mu: float=None, sigma: float=None) -> None:
+        """Recompute all ratings with a different initial rating and uncertainty.
+        Players without recorded matches keep their current rating.
+        Players migrated from the old ladder start from their migrated rating.
+        A new sigma also scales beta (σ/2) and tau (σ/100).
+        NOTE: Overwrites changes made with `!inhouse adjust`.
+        """
+        if sigma is not None and sigma <= 0:
+            raise CommandError("Sigma must be positive!")
+        # Replay with exactly the environment that is saved and used afterwards
+        params = get_env_params(mu, sigma)
+        mu, sigma = params["mu"], params["sigma"]
+
+        result = await self.run_replay(**params, uids=())
+        current = await self.db.ladder_get_players(result.players)
+        ranked = sorted(result.players.values(), key=lambda p: p.rating.mu, reverse=True)
+
+        def fmt_change(player: Player) -> str:
+            old = current.get(player.uid)
+            old_rating = f"{round(old.rating.mu*40)} → " if old else ""
+            return f"{self.get_username(player.uid)}: {old_rating}{round(player.rating.mu*40)}"
+
+        description = "\n".join(f"{i}. {fmt_change(p)}" for i, p in enumerate(ranked, 1))
+        await self.send_embed_message(ctx, title=f"Ratings with μ={mu}, σ={sigma}", description=description)
+
+        msg = f"Apply these ratings? Ratings changed with `{self.bot.command_prefix}inhouse adjust` will be overwritten."
+        if not await ask_user_yes_no(ctx, msg):
+            return await ctx.send("Ratings were not changed.")
+
+        await dump_json(ENV_FILE, params)
+        trueskill.setup(**params)
+        await self.db.ladder_add_players(result.players.values())
+        await ctx.send(f"Successfully recomputed ratings for {len(result.players)} players!")
+
     @inhouse.command(name="init")
     async def inhouse_init(self, ctx: commands.Context) -> None:
         pass
@@ -257,15 +422,10 @@ class DGVGKCog(BaseCog):
     @inhouse.command(name="reset")
     @admins_only()
     async def inhouse_reset(self, ctx: commands.Context) -> None:
-        players = load_players()
-        if not players:
+        if not await self.db.ladder_reset_players():
             await ctx.send("Nothing to be done. No players in database.")
             return
 
-        for uid in players: # We don't even need to iterate over values
-            players[uid] = get_new_player(uid)
-        dump_players(players)
-
         await ctx.send("Successfully reset stats for all players!")
 
     @inhouse.command(name="adjust")
@@ -277,11 +437,8 @@ class DGVGKCog(BaseCog):
         if new_rating >= 1000:
             new_rating = new_rating / 40
         
-        players = load_players()
-
-        orig_rating = players[player.id].rating
-        players[player.id].rating = trueskill.Rating(mu=new_rating, sigma=orig_rating.sigma)
-
-        dump_players(players)
+        orig_rating = await self.db.ladder_set_rating(player.id, new_rating)
+        if not orig_rating:
+            raise CommandError(f"**{player.name}** has no rating on record!")
 
         await ctx.send(f"Changed **{player.name}**'s rating from {orig_rating.mu*40} to {new_rating*40}!")
@@ -1,14 +1,14 @@
 import argparse
 import io
 import traceback
+from difflib import SequenceMatcher
 from functools import partial
-from typing import Optional, Union, Tuple
+from typing import List, Optional, Union, Tuple
 
 import discord
 import pytesseract
 from discord.ext import commands
 from PIL import Image, ImageEnhance, ImageStat, ImageOps
-import numpy as np
 
 from .base_cog import BaseCog
 from ..deepfryer.fryer import ImageFryer
@@ -16,14 +16,21 @@ from ..utils.checks import owners_only, pfm_cmd
 from ..utils.exceptions import (BotException, FileSizeError,
                               InvalidURLError, NonImgUrlError,
                               WordExceededLimit, CommandError)
+from ..utils.concurrency import gather_bounded
 from ..utils.http import post
+from ..utils.images import draft_resize, fit_to_byte_budget, scale_to_pixels, split_rows
 
 
 class ImageCog(BaseCog):
     """Image manipulation commands."""
 
     EMOJI = ":camera:"
-    REMOVEBG_MAXSIZE = 240_000
+    REMOVEBG_MAXSIZE = 240_000 # Pixels. Images above 0.25 MP cost more than 1 credit
+    REMOVEBG_MAXBYTES = 12_000_000 # Upload size limit of the remove.bg API
+    OCR_WIDTH = 2000 # Images are scaled to this width before OCR
+    OCR_TILE_HEIGHT = 2000 # Tall images are split into bands of this height
+    OCR_TILE_OVERLAP = 150 # Rows shared by consecutive bands, should exceed the height of a line of text
+    OCR_MAX_WORKERS = 4 # Bands OCRed in parallel
     
     @commands.command(name="deepfry")
     async def deepfry(self, ctx: commands.Context, *args, rtn=False) -> None:
@@ -121,8 +128,11 @@ class ImageCog(BaseCog):
             img = url
             
         # Deepfry
-        fryer = ImageFryer(img)
-        to_run = partial(fryer.fry, emoji, text, caption)
+        max_bytes = self.get_image_upload_limit()
+        def to_run() -> io.BytesIO:
+            # Decoding and downscaling large images is blocking too
+            fryer = ImageFryer(img)
+            return fryer.fry(emoji, text, caption, max_bytes=max_bytes)
         fried_img = await self.bot.loop.run_in_executor(None, to_run)
 
         # Return Image.Image object if nuking
@@ -204,37 +214,26 @@ class ImageCog(BaseCog):
         return img_nobg
    
     async def _resize_img(self, _img: io.BytesIO) -> io.BytesIO:
-        image = Image.open(_img)
-        width, height = image.size
+        """Resizes and re-encodes an image to fit within the remove.bg
+        pixel and upload size budgets."""
+        image = await self.bot.loop.run_in_executor(None, Image.open, _img)
 
         # Get new image dimensions
-        new_w, new_h = await self.scale_to_target(width, height, self.REMOVEBG_MAXSIZE)
+        new_w, new_h = await self.scale_to_target(*image.size, self.REMOVEBG_MAXSIZE)
 
-        # Construct new bytes object from resized image
-        imgbuffer = io.BytesIO()
-        new_img = image.resize((new_w, new_h), resample=Image.BICUBIC)
-        new_img = new_img.convert("RGB")
-        new_img.save(imgbuffer, format="JPEG")
-        imgbuffer.seek(0)
-        return imgbuffer
+        def to_run() -> io.BytesIO:
+            new_img = draft_resize(image, (new_w, new_h))
+            return fit_to_byte_budget(new_img, self.REMOVEBG_MAXBYTES)
+        
+        return await self.bot.loop.run_in_executor(None, to_run)
 
     async def scale_to_target(self, width: int, height: int, target: int) -> Tuple[int, int]:
         """Gets image dimensions as close as possible to a target size"""
-        STEP_SIZE = 0.01
-        TRIES = 200000
-        
-        # Scale up if image is smaller
-        if target > width * height:
-            STEP_SIZE = -STEP_SIZE
-        
-        for i in np.arange(0, STEP_SIZE*TRIES, STEP_SIZE):
-            new = (width // i) * (height // i)
-            if new <= target:
-                break
-        else:
-            raise BotException("Failed to resize image!") # This should NEVER happen
-
-        return int(abs(width//i)), int(abs(height//i))
+        try:
+            # Scale up if image is smaller
+            return scale_to_pixels(width, height, target, upscale=True)
+        except ValueError:
+            raise BotException("Failed to resize image!")
     
     def resize_image(self, image: Image.Image, width: int=0, height: int=0) -> Image.Image:
         if not width and not height:
@@ -255,16 +254,59 @@ class ImageCog(BaseCog):
         
         return image
 
-    def read_image_text(self, image: Union[str, bytes, Image.Image]) -> str:
+    async def read_image_text(self, image: Union[str, io.BytesIO, Image.Image]) -> str:
+        """Reads text from an image. Tall images are split into overlapping
+        bands that are OCRed in parallel."""
+        tiles = await self.bot.loop.run_in_executor(None, self.prepare_ocr_tiles, image)
+
+        async def read_tile(tile: Image.Image) -> str:
+            return await self.bot.loop.run_in_executor(None, self.read_tile_text, tile)
+
+        texts = await gather_bounded((read_tile(tile) for tile in tiles), limit=self.OCR_MAX_WORKERS)
+        return self.merge_tile_text(texts)
+
+    def prepare_ocr_tiles(self, image: Union[str, io.BytesIO, Image.Image]) -> List[Image.Image]:
         if not isinstance(image, Image.Image):
             image = Image.open(image)
-        
+
+        # Scale to OCR width. Large JPEGs are scaled down while decoding.
+        w, h = image.size
+        size = (self.OCR_WIDTH, max(1, round(h * self.OCR_WIDTH / w)))
+        image = draft_resize(image, size, mode="L")
+
         # Improves pytesseract accuracy
         image = self.optimize_image(image)
 
-        text = pytesseract.image_to_string(image, lang="eng")
-        
-        return text
+        return [
+            image.crop((0, top, image.width, bottom))
+            for top, bottom in split_rows(image.height, self.OCR_TILE_HEIGHT, self.OCR_TILE_OVERLAP)
+        ]
+
+    def read_tile_text(self, tile: Image.Image) -> str:
+        return pytesseract.image_to_string(tile, lang="eng")
+
+    def merge_tile_text(self, texts: List[str]) -> str:
+        """Joins text of overlapping bands, omitting lines that were read
+        in both the bottom of a band and the top of the next one.
+        Lines are stripped and blank lines dropped, however many bands there are."""
+        def same_line(a: str, b: str) -> bool:
+            # Lines cut by a band edge are rarely read identically
+            return SequenceMatcher(None, a, b).ratio() > 0.8
+
+        merged: List[str] = []
+        for text in texts:
+            lines = [line.strip() for line in text.splitlines() if line.strip()]
+            # Find the longest run of lines that ends the previous band and starts this one
+            max_overlap = min(len(merged), len(lines))
+            overlap = next(
+                (
+                    n for n in range(max_overlap, 0, -1)
+                    if all(same_line(a, b) for a, b in zip(merged[-n:], lines[:n]))
+                ),
+                0
+            )
+            merged.extend(lines[overlap:])
+        return "\n".join(merged)
 
     def optimize_image(self, image: Image.Image) -> Image.Image:
         image = image.convert("L")  # Convert to greyscale
@@ -275,8 +317,6 @@ class ImageCog(BaseCog):
         if ImageStat.Stat(image).mean[0] < 128:
             image = ImageOps.invert(image)
 
-        image = self.resize_image(image, width=2000)
-
         return image
 
     @commands.command(name="totext", usage="<url> or <msg attachment>")
@@ -295,7 +335,7 @@ class ImageCog(BaseCog):
         img = await self.download_from_url(ctx, url)
 
         try:
-            image_text = await self.bot.loop.run_in_executor(None, self.read_image_text, img)
+            image_text = await self.read_image_text(img)
         except pytesseract.pytesseract.TesseractNotFoundError:
             await self.warn_owner("Tesseract is not installed or is not added to PATH!")
             raise CommandError("This command has not been properly configured by the bot owner yet.")
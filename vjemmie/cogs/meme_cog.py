@@ -1,22 +1,19 @@
 import random
-from asyncio import coroutine
 from functools import partial
 from pathlib import Path
-from typing import Dict, List, Optional, Union
+from typing import Dict, List, Optional, Set, Union
 from dataclasses import dataclass
 
 import discord
-import markovify
-from aiofile import AIOFile
 from discord.ext import commands
-from markovify import NewlineText
-from praw.models import Submission
 
 from ..db import get_db
 from ..config import MAIN_DB
-from ..utils.commands import add_command
+from ..utils.commands import CommandDef, CommandRegistry
 from ..utils.checks import admins_only
 from ..utils.exceptions import CommandError
+from ..utils.gpt import GPTFile
+from ..utils.markov import MarkovStore, SentencePool, StoredModel
 from ..utils.voting import vote
 from .base_cog import BaseCog
 
@@ -53,9 +50,7 @@ async def gpt_command(
         line = await cls.random_line_from_gptfile(path)
         await ctx.send(line)
     else:
-        lines = "".join(
-            [await cls.random_line_from_gptfile(path) for n in range(n_lines)]
-        )
+        lines = "".join(await cls.random_lines_from_gptfile(path, n_lines))
         await cls.send_text_message(lines, ctx)
 
 
@@ -63,24 +58,38 @@ class MemeCog(BaseCog):
     """Text meme commands"""
 
     EMOJI = ":spaghetti:"
+    MARKOV_MAX_AGE = 7 * 86400  # Seconds before a subreddit model is trained on new posts
+    MARKOV_CORPUS_POSTS = 1000  # Top posts of all time a subreddit model is trained on
 
     def __init__(self, bot) -> None:
         super().__init__(bot)
         self.experimental = False
         self.wordlist: List[str] = []
-        self.models: Dict[str, NewlineText] = {}
+        # Models are only used for generating sentences, so don't keep the original posts
+        self.markov = MarkovStore("reddit", retain_original=False)
+        self._markov_updates: Set[str] = set()  # Subreddits with a model update in progress
+        self.sentences = SentencePool(
+            self.markov, lambda model: model.make_sentence(tries=300)
+        )
         self.daddy_verbs = self.load_daddy_verbs()
-        self.files: Dict[str, List[str]] = {}
+        self.files: Dict[str, GPTFile] = {}
 
         # Per-guild goodmorning command settings (TODO: make persistent)
         self.goodmorning_settings: Dict[int, GoodmorningSettings] = {}
 
+        self.gpt_commands = CommandRegistry(self, gpt_command, group=self.gpt)
         self.create_gpt_commands()
         self.db = get_db(MAIN_DB)
 
     @commands.Cog.listener()
     async def on_ready(self) -> None:
         await self._setup_goodmorning()
+        # Load saved models in the background, so the first !markovreddit is fast
+        self.bot.loop.create_task(self.markov.load_all())
+        self.sentences.start()
+
+    def cog_unload(self) -> None:
+        self.sentences.stop()
 
     async def _setup_goodmorning(self) -> None:
         for guild in self.bot.guilds:
@@ -91,18 +100,14 @@ class MemeCog(BaseCog):
         if not p.exists():
             return
 
-        for file_ in p.iterdir():
-            if file_.suffix != ".txt":
-                continue
-
-            add_command(
-                self,
-                gpt_command,
+        self.gpt_commands.sync(
+            CommandDef(
                 name=file_.stem,
-                group=self.gpt,
-                path=str(file_),  # command kwargs
-                n_lines=10,
+                kwargs={"path": str(file_), "n_lines": 10},  # command kwargs
             )
+            for file_ in p.iterdir()
+            if file_.suffix == ".txt"
+        )
 
     def load_daddy_verbs(self) -> List[str]:
         """NOTE: Blocking!"""
@@ -114,14 +119,17 @@ class MemeCog(BaseCog):
             self.verb_me_daddy.enabled = False  # Disable command
             return list()
 
-    async def random_line_from_gptfile(
-        self, path: str, encoding: str = "utf-8", **kwargs
-    ) -> str:
-        """Kinda primitive rn. Needs some sort of caching for bigger files."""
+    async def random_line_from_gptfile(self, path: str, encoding: str = "utf-8") -> str:
+        return (await self.random_lines_from_gptfile(path, 1, encoding))[0]
+
+    async def random_lines_from_gptfile(
+        self, path: str, n: int, encoding: str = "utf-8"
+    ) -> List[str]:
+        """Picks `n` random entries from a gpt file. The file is never read
+        into memory, see `GPTFile`."""
         if path not in self.files:
-            async with AIOFile(path, "r", encoding=encoding, **kwargs) as f:
-                self.files[path] = (await f.read()).split("====================")
-        return random.choice(self.files[path])
+            self.files[path] = GPTFile(path, encoding=encoding)
+        return await self.bot.loop.run_in_executor(None, self.files[path].sample, n)
 
     @commands.group(name="gpt")
     async def gpt(self, ctx: commands.Context) -> None:
@@ -237,38 +245,50 @@ class MemeCog(BaseCog):
         self, ctx: commands.Context, subreddit: str
     ) -> None:
         subreddit = subreddit.lower()
-        if subreddit not in self.models:
+        if not MarkovStore.is_valid_key(subreddit):
+            raise CommandError(f"`{subreddit}` is not a valid subreddit name")
+        stored = await self.markov.load(subreddit)
+        if not stored:
             async with ctx.typing():
-                reddit_cog = self.bot.get_cog("RedditCog")
-                posts = await reddit_cog._fetch_subreddit_posts(
-                    subreddit, sorting="top", time="all", post_limit=1000
-                )
-                try:
-                    await self._generate_markovchain_subreddit_model(subreddit, posts)
-                except ValueError as e:
-                    raise CommandError(e)
-
-        model = self.models[subreddit]
-
-        to_run = partial(model.make_sentence, tries=300)
-        sentence = await self.bot.loop.run_in_executor(None, to_run)
+                stored = await self._update_markovchain_subreddit_model(subreddit)
+        elif stored.age > self.MARKOV_MAX_AGE and subreddit not in self._markov_updates:
+            # Reply with the current model, and train it on new posts in the background
+            self.bot.loop.create_task(self._refresh_markovchain_subreddit_model(subreddit))
+
+        # Use pre-generated sentence if possible
+        sentence = self.sentences.pop(subreddit)
+        if not sentence:
+            to_run = partial(stored.model.make_sentence, tries=300)
+            sentence = await self.bot.loop.run_in_executor(None, to_run)
         if not sentence:
             raise CommandError(f"Unable to generate a sentence for `r/{subreddit}`")
 
         await self.send_text_message(sentence, ctx)
 
-    async def _generate_markovchain_subreddit_model(
-        self, subreddit: str, posts: List[Submission]
-    ) -> NewlineText:
+    async def _update_markovchain_subreddit_model(self, subreddit: str) -> StoredModel:
         reddit_cog = self.bot.get_cog("RedditCog")
-        # TODO: Check if RedditCog is disabled
-        text = "\n".join([post.selftext for post in posts if post.selftext])
-        if not text:
-            raise ValueError("Unable to find text submissions")
-
-        model = markovify.NewlineText(text)
-        self.models[subreddit] = model
-        return model
+        if not reddit_cog:
+            raise CommandError("Reddit commands are disabled")
+        self._markov_updates.add(subreddit)
+        try:
+            # Cached posts are used as is, only missing posts are fetched
+            posts = await reddit_cog.get_corpus_posts(subreddit, self.MARKOV_CORPUS_POSTS)
+            # Only posts the model hasn't seen before are trained on
+            texts = ((post.id, post.selftext) for post in posts)
+            try:
+                stored = await self.markov.update(subreddit, texts)
+            except ValueError:
+                raise CommandError("Unable to find text submissions")
+        finally:
+            self._markov_updates.discard(subreddit)
+        self.sentences.clear(subreddit)
+        return stored
+
+    async def _refresh_markovchain_subreddit_model(self, subreddit: str) -> None:
+        try:
+            await self._update_markovchain_subreddit_model(subreddit)
+        except Exception as e:
+            print(f"Failed to update markov model of r/{subreddit}: {e}")
 
     @commands.command(name="ricardo")
     async def ricardo(self, ctx: commands.Context, limit: int = 4176) -> None:
@@ -11,54 +11,48 @@ from collections import defaultdict, namedtuple
 from functools import partial, partialmethod
 from itertools import cycle
 from pathlib import Path
-from typing import Iterable, Optional, Tuple, Union, Dict, List
+from types import MappingProxyType
+from typing import Iterable, Iterator, Optional, Tuple, Union, Dict, List, FrozenSet, Mapping
 
 import discord
-import praw
 from discord.ext import commands, tasks
-from prawcore.exceptions import Forbidden, NotFound, Redirect
-from praw.models import Submission
 from recordclass import recordclass
 
-from ..utils.caching import get_cached
+from ..utils.caching import cached_loader
 from ..utils.checks import admins_only
-from ..utils.commands import add_command
+from ..utils.commands import CommandDef, CommandRegistry
 from ..utils.converters import BoolConverter
 from ..utils.exceptions import CommandError
 from ..utils.json import dump_json
 from ..utils.parsing import is_valid_command_name
+from ..utils.reddit import (IMAGE, TEXT, VIDEO, Forbidden, Listing,
+                            ListingKey, NotFound, Post, RedditClient,
+                            RedditSubmissions, make_key)
 from .base_cog import BaseCog, EmbedField
 
-reddit: praw.Reddit = None # Initialized by RedditCog
+reddit: RedditClient = None # Initialized by BotSetupCog
 
-RedditCommand = namedtuple("RedditCommand", ["subreddit", "aliases", "is_text"], defaults=[[], False])
+RedditCommand = namedtuple("RedditCommand", ["subreddit", "aliases", "is_text"], defaults=[(), False])
 
 
-async def _reddit_command_base(obj: commands.Cog, ctx: commands.Context, sorting: str=None, time: str=None, *, subreddit: str=None, is_text: bool=False) -> None:
-    """Method used as a base for adding custom subreddit commands."""
-    await obj.get_from_reddit(ctx, subreddit, sorting, time, is_text=is_text)
-
-
-class RedditSubmissions:
-    """Caches Reddit submissions for all guilds."""
-
-    _submissions: Dict[str, List[Submission]] = {}
+@cached_loader("db/reddit/subs.json")
+def load_subs(subs: dict) -> Mapping[str, RedditCommand]:
+    """Subreddit commands. Key: Subreddit name"""
+    return MappingProxyType({
+        subreddit: RedditCommand(sub[0], tuple(sub[1]), sub[2])
+        for subreddit, sub in (subs or {}).items()
+    })
 
-    def get(self, guild_id: int, subreddit: str, sorting: str, time: str) -> List[Submission]:
-        """Retrieves a list of Reddit Submissions."""
-        k = self._get_key(guild_id, subreddit, sorting, time)
-        return self._submissions.get(k, [])
 
-    def add(self, submissions: List[Submission], guild_id: int, subreddit: str, sorting: str, time: str) -> None:
-        k = self._get_key(guild_id, subreddit, sorting, time)
-        self._submissions[k] = submissions
+@cached_loader("db/reddit/nsfw_whitelist.json", category="reddit")
+def load_nsfw_whitelist(subreddits: list) -> FrozenSet[str]:
+    """Lowercase names of NSFW subreddits that can be posted in SFW channels."""
+    return frozenset(subreddit.lower() for subreddit in subreddits or [])
 
-    def clear(self) -> None:
-        """Clears all submissions for all guilds."""
-        self._submissions.clear()
 
-    def _get_key(self, guild_id: int, subreddit: str, sorting: str, time: str) -> str:
-        return f"{guild_id}{subreddit}{sorting}{time}"
+async def _reddit_command_base(obj: commands.Cog, ctx: commands.Context, sorting: str=None, time: str=None, *, subreddit: str=None, is_text: bool=False) -> None:
+    """Method used as a base for adding custom subreddit commands."""
+    await obj.get_from_reddit(ctx, subreddit, sorting, time, is_text=is_text)
 
 
 class RedditCog(BaseCog):
@@ -78,6 +72,7 @@ class RedditCog(BaseCog):
 
     ALL_POST_LIMIT = 250
     OTHER_POST_LIMIT = 100
+    HOT_POST_LIMIT = 100
     
     IMAGE_HOSTS = ["imgur.com", "i.redd.it"]
     TIME_FILTERS = ["all", "year", "month", "week", "day"]
@@ -93,59 +88,64 @@ class RedditCog(BaseCog):
         "day": 25,
     }
 
-    submissions = RedditSubmissions()
-
     def __init__(self, bot: commands.Bot) -> None:
         super().__init__(bot)
 
-        # Load subreddits
+        # Listings shared by all guilds, persisted between restarts
+        self.submissions = RedditSubmissions(
+            self._fetch_listing, "db/reddit/submissions.json", "db/reddit/seen.json"
+        )
+        self.submissions.load()
+
+        # Load subreddits. Changes to subreddit commands are saved in batches
+        self.sub_commands = CommandRegistry(self, _reddit_command_base, save=self.dump_subs)
         self.subs = self.load_subs()
-        for sub in self.subs.values():
-            self._add_sub(sub)
+        self.sub_commands.sync(self._make_sub_def(sub) for sub in self.subs.values())
         
         # Iterators for changing reddit sorting.
         self.time_cycle = cycle(self.TIME_FILTERS) # Command: !rtime
         self.sorting_cycle = cycle(self.SORTING_FILTERS) # Command: !rsort
         
-        # Initiate loop that clears reddit submission cache daily
-        self.submission_refresh_loop.start()
+        # Initiate loop that saves reddit submission cache
+        self.submission_save_loop.start()
     
     @property
-    def NSFW_WHITELIST(self):
-        return get_cached("db/reddit/nsfw_whitelist.json", category="reddit")
+    def NSFW_WHITELIST(self) -> FrozenSet[str]:
+        return load_nsfw_whitelist()
     
-    @tasks.loop(seconds=86400.0)
-    async def submission_refresh_loop(self) -> None:
-        """Wipes reddit submission cache once daily"""
-        self.submissions.clear()    
+    @tasks.loop(seconds=300.0)
+    async def submission_save_loop(self) -> None:
+        """Refreshes popular listings that are about to expire, and saves 
+        reddit submission cache to disk if it has changed.
+        Listings expire individually, see `utils.reddit.LISTING_TTL`."""
+        self.submissions.refresh_popular()
+        await self.submissions.save()
     
     def cog_unload(self) -> None:
-        self.submission_refresh_loop.cancel()        
+        self.submission_save_loop.cancel()
+        self.submissions.save_blocking()
+        self.bot.loop.create_task(self.sub_commands.flush())
 
-    def load_subs(self) -> dict:
-        subs = get_cached("db/reddit/subs.json")
-        return {subreddit: RedditCommand(sub[0], sub[1], sub[2]) for subreddit, sub in subs.items()} if subs else {}
+    def load_subs(self) -> Dict[str, RedditCommand]:
+        # RedditCommands are immutable, so only the dict itself is copied
+        return dict(load_subs())
 
     async def dump_subs(self) -> None:
         if not self.subs:
             return
         await dump_json("db/reddit/subs.json", self.subs)
     
-    def _add_sub(self, subreddit_command: RedditCommand) -> None:
-        """Creates a bot command from a `RedditCommand` object and adds it
-        to the bot's commands.
-        """
+    def _make_sub_def(self, subreddit_command: RedditCommand) -> CommandDef:
+        """Creates a command definition from a `RedditCommand` object."""
         # *_ catches additional fields if they are added in the future, and prevents errors
         subreddit, aliases, is_text, *_ = subreddit_command
-        add_command(self, 
-                    _reddit_command_base,
-                    name=subreddit,
-                    aliases=aliases,
-                    help=f"Gets a random post from r/{subreddit}",
-                    hidden=True,
-                    subreddit=subreddit,
-                    is_text=is_text
-                   )
+        return CommandDef(
+            name=subreddit,
+            aliases=list(aliases),
+            help=f"Gets a random post from r/{subreddit}",
+            hidden=True,
+            kwargs={"subreddit": subreddit, "is_text": is_text}
+        )
     
     @commands.group(name="reddit", usage="<subcommand>")
     async def reddit(self, ctx: commands.Context, opt: str=None, *args) -> None:
@@ -191,8 +191,8 @@ class RedditCog(BaseCog):
             al = aliases.split(" ") if aliases else []
             if not is_valid_command_name(subreddit) or not all(is_valid_command_name(a) for a in al):
                 raise CommandError("Command name can only include letters a-z and numbers 0-9.")
-            new_command = RedditCommand(subreddit=subreddit, aliases=al, is_text=is_text)
-            self._add_sub(new_command)
+            new_command = RedditCommand(subreddit=subreddit, aliases=tuple(al), is_text=is_text)
+            self.sub_commands.add(self._make_sub_def(new_command))
         except discord.DiscordException:
             cmd = self.subs.get(subreddit)
             if not cmd:
@@ -201,8 +201,7 @@ class RedditCog(BaseCog):
             s = "s" if "," in commands_ else ""
             raise CommandError(f"Subreddit **r/{subreddit}** already exists with command{s} **{commands_}**")
         else:
-            self.subs[subreddit] = new_command
-            await self.dump_subs() # After adding sub, save list of subs to disk
+            self.subs[subreddit] = new_command # Saved to disk by self.sub_commands
             commands_ = self._get_commands(new_command)
             s = "s" if "," in commands_ else "" # Duplicate code yikes
             await ctx.send(f"Added subreddit **r/{subreddit}** with command{s} **{commands_}**")
@@ -226,10 +225,8 @@ class RedditCog(BaseCog):
         
         # Remove sub from instance subreddit dict
         self.subs.pop(subreddit)
-        # Remove associated command
-        self.bot.remove_command(cmd.subreddit)
-        # Save changes
-        await self.dump_subs()
+        # Remove associated command. Changes are saved by self.sub_commands
+        self.sub_commands.remove(cmd.subreddit)
         # Get commands associated with removed subreddit
         commands_ = self._get_commands(cmd)
         await ctx.send(f"Removed subreddit **r/{subreddit}** with command(s) **{commands_}**")
@@ -379,29 +376,29 @@ class RedditCog(BaseCog):
         if not subreddit in self.subs:
             raise CommandError(f"Subreddit {subreddit} is not added as a bot command!")
 
-        # Add new alias
-        self.subs[subreddit].aliases.append(alias)
-        # Save changes & reload subreddit commands
-        await self.dump_subs()
-        await self._reload_sub_commands()
+        # Add new alias & reload only this subreddit's command
+        sub = self.subs[subreddit]
+        sub = sub._replace(aliases=sub.aliases + (alias,))
+        try:
+            self.sub_commands.update(self._make_sub_def(sub))
+        except discord.DiscordException:
+            raise CommandError(f"Alias **!{alias}** is already in use by another command")
+        self.subs[subreddit] = sub
         await ctx.send(f"Added alias **!{alias}** for subreddit **r/{subreddit}**")
-    
-    async def _reload_sub_commands(self):
-        """Reloads all subreddit commands.
-        """
-        # Need some sort of dict / set data type here for fast hash table lookups
-        
-        # Get bot subreddits
-        subs = self.load_subs()
-        # Get all bot commands
-        commands = self.bot.commands
 
-        for subreddit, sub_values in subs.items():
-            for cmd in commands:
-                if subreddit == cmd.name:
-                    self.bot.remove_command(cmd.name)
-                    self._add_sub(sub_values) 
-                    break
+    @reddit.command(name="reload")
+    @admins_only()
+    async def reload_sub_commands(self, ctx: commands.Context) -> None:
+        """Reload subreddit commands from disk"""
+        await self.sub_commands.flush() # Don't overwrite pending changes
+        self.subs = self.load_subs()
+        added, removed, changed = self.sub_commands.sync(
+            self._make_sub_def(sub) for sub in self.subs.values()
+        )
+        await ctx.send(
+            f"Reloaded subreddit commands: {len(added)} added, "
+            f"{len(removed)} removed, {len(changed)} changed."
+        )
 
     @reddit.command(name="remove_alias")
     @admins_only()
@@ -426,9 +423,10 @@ class RedditCog(BaseCog):
         if alias not in self.subs[subreddit].aliases:
             raise CommandError(f"No such alias **!{alias}** for subreddit **r/{subreddit}**")
         
-        self.subs[subreddit].aliases.remove(alias)
-        await self.dump_subs()
-        await self._reload_sub_commands()
+        sub = self.subs[subreddit]
+        sub = sub._replace(aliases=tuple(a for a in sub.aliases if a != alias))
+        self.sub_commands.update(self._make_sub_def(sub))
+        self.subs[subreddit] = sub
         await ctx.send(f"Removed alias **!{alias}** for subreddit **r/{subreddit}**")
 
     @commands.command(name="meme", usage="<url> or 'help'")
@@ -464,7 +462,8 @@ class RedditCog(BaseCog):
     @reddit.command(name="wipe", aliases=["clear"])
     @admins_only()
     async def wipe_reddit_cache(self, ctx: commands.Context) -> None:
-        self.init_submissions_cache()
+        self.submissions.clear()
+        await self.submissions.save(force=True)
         await ctx.send("Wiped Reddit submissions cache successfully!")
 
     async def _check_filtering(self, filtering_type: str, filter_: Optional[str], default_filter: str, valid_filters: Iterable) -> str:
@@ -508,43 +507,14 @@ class RedditCog(BaseCog):
     def _is_image_content(self, url: str) -> bool:
         return False if not url else any(url.endswith(end) for end in self.IMAGE_EXTENSIONS)
 
-    def _can_send_sub_or_post(self, ctx: commands.Context, sub: Union[praw.models.Submission, praw.models.Subreddit]) -> bool:
-        """Determines if subreddit or reddit submission is appropriate for a channel."""
+    def _can_send_nsfw(self, ctx: commands.Context, subreddit: str) -> bool:
+        """Determines if NSFW posts of a subreddit are appropriate for a channel."""
         # Always allow if channel is marked NSFW
         if ctx.channel.nsfw:
             return True
-        
-        if isinstance(sub, praw.models.Submission):
-            subreddit = sub.subreddit.display_name.lower()
-            over_18 = sub.over_18
-        elif isinstance(sub, praw.models.Subreddit):
-            subreddit = sub.display_name.lower()
-            over_18 = sub.over18
-        else:
-            raise TypeError("Argument 'sub' must be a praw Submission or Subreddit")
+        return subreddit.lower() in self.NSFW_WHITELIST
 
-        return not over_18 or subreddit in self.NSFW_WHITELIST
-
-    async def _get_random_reddit_post(self, posts: List[Submission], is_text: bool) -> Optional[Submission]:
-        """Attempts to select a random reddit post that has not
-        yet been posted in the current bot session from list of posts.
-        """
-        while True:
-            if not posts:
-                return None
-
-            # Pop a random submission from the list
-            post = posts.pop(random.randint(0, len(posts)-1)) 
-
-            if is_text and not self._is_image_content(post.url) and not post.media:
-                return post
-            elif post.media:
-                if post.media.get("reddit_video"):
-                    return post
-            elif not is_text and self._is_image_content(post.url):
-                return post
-
-    async def _format_reddit_post(self, post: praw.models.Submission, subreddit: str, is_text: bool) -> Tuple[str, Optional[str]]:
+    async def _format_reddit_post(self, post: Post, subreddit: str, is_text: bool) -> Tuple[str, Optional[str]]:
         """Attempts to get a Reddit post unique to the current bot session.
         
         Subsequently formats the post according to its attributes and whether
@@ -598,52 +568,65 @@ class RedditCog(BaseCog):
         # Add post to cog instance's posts
         return _out, image_url
 
-    def _get_subreddit_posts(self,
-                             ctx,
-                             subreddit: str,
-                             sorting: str = None,
-                             time: str = None,
-                             post_limit: int = None,
-                             allow_nsfw: bool = False
-                            ) -> List[Submission]:
-        # Get subreddit
-        sub = reddit.subreddit(subreddit)
-
-        # Check if NSFW subreddit
-        if not self._can_send_sub_or_post(ctx, sub):
-            raise CommandError("Cannot post NSFW content in a non-NSFW channel!")
-
-        # Get posts generator
-        if sorting == "hot":
-            posts = sub.hot()
-        else:
-            posts = sub.top(time_filter=time, limit=post_limit)      
-        return list(posts) # Consume all items in the generator and return as list
-
-    async def _fetch_subreddit_posts(self, subreddit: str, sorting: str, time: str, post_limit: Optional[int]) -> List[Submission]:
-        def to_run() -> List[Submission]:
-            sub = reddit.subreddit(subreddit)
-            if sorting == "hot":
-                posts = sub.hot()
-            else:
-                posts = sub.top(time_filter=time, limit=post_limit)      
-            return list(posts)
+    async def _fetch_subreddit_posts(self,
+                                     subreddit: str,
+                                     sorting: str,
+                                     time: str,
+                                     post_limit: Optional[int],
+                                     after: Optional[str] = None
+                                    ) -> List[Post]:
         try:
-            posts = await self.bot.loop.run_in_executor(None, to_run)
-        except (Forbidden, Redirect, NotFound) as e:
+            return await reddit.listing(subreddit, sorting, time, limit=post_limit or RedditClient.PAGE_SIZE, after=after)
+        except (Forbidden, NotFound) as e:
             if isinstance(e, Forbidden):
                 reason = "Subreddit might be quarantined."
             else:
                 reason = "Verify that the subreddit exists and is spelled correctly."
             raise CommandError(f"Cannot retrieve `r/{subreddit}` submissions! {reason}")
-        return posts
+
+    async def _fetch_listing(self, key: ListingKey) -> List[Post]:
+        subreddit, sorting, time = key
+        if sorting == "hot":
+            return await self._fetch_subreddit_posts(subreddit, sorting, time, self.HOT_POST_LIMIT)
+        return await self._fetch_subreddit_posts(subreddit, sorting, time, self.POST_LIMITS.get(time, 25))
+
+    async def get_corpus_posts(self, subreddit: str, n_posts: int) -> Iterator[Post]:
+        """Returns posts of a subreddit to build a text corpus from.
+
+        Yields every cached post of the subreddit, and makes sure the top 
+        `n_posts` posts of all time are among them. Only posts that are
+        not already cached are fetched.
+        
+        Parameters
+        ----------
+        subreddit : `str`
+            Name of subreddit
+        n_posts : `int`
+            Number of top posts of all time to include
+        
+        Returns
+        -------
+        `Iterator[Post]`
+            Lazy iterator over posts. May contain duplicates.
+        """
+        # Shared with !reddit get, and only fetched if missing or expired
+        key = make_key(subreddit, *self.TOP_ALL)
+        listing = await self.submissions.get(key)
+        if len(listing.posts) >= self.ALL_POST_LIMIT:
+            # Continue the cached listing where it ends. The added posts are
+            # cached with the listing, so they are only fetched once.
+            async def fetch_more(listing: Listing, limit: int) -> List[Post]:
+                return await self._fetch_subreddit_posts(
+                    subreddit, *self.TOP_ALL, limit, after=listing.posts[-1].id
+                )
+            await self.submissions.extend(key, n_posts, fetch_more)
+        return self.submissions.iter_posts(subreddit)
 
     async def get_from_reddit(self,
                               ctx: commands.Context,
                               subreddit: str,
                               sorting: str = None,
                               time: str = None,
-                              post_limit: int = None,
                               is_text: bool = False,
                               allow_nsfw: bool = False
                             ) -> None:
@@ -651,27 +634,36 @@ class RedditCog(BaseCog):
         sorting = await self.check_sorting(ctx, sorting) # "top"/"hot"
         time = await self.check_time(ctx, time) # "all", "year", "month", "week", "day"
 
-        # Get post limit
-        if post_limit is None:
-            post_limit = self.POST_LIMITS.get(time, 25)
-        
         # Get Reddit posts from a given subreddit
-        # Check if cached submissions exist first
-        posts = self.submissions.get(ctx.guild.id, subreddit, sorting, time)
-        if not posts:
+        # Listings are shared by all guilds, and only fetched if missing or expired
+        key = make_key(subreddit, sorting, time)
+        self.submissions.record_request(key)
+        listing = self.submissions.listings.get(key)
+        if not listing or listing.expired:
             async with ctx.message.channel.typing():
-                # Fetch new posts and cache them
-                posts = await self._fetch_subreddit_posts(subreddit, sorting, time, post_limit)
-                self.submissions.add(posts, ctx.guild.id, subreddit, sorting, time)
-
-        # Select a random post from list of posts
-        post = await self._get_random_reddit_post(posts, is_text)
+                await self.submissions.get(key)
+
+        # Select a random post that has not been shown in this guild yet
+        # Videos are allowed for both text and image subreddits
+        # NSFW posts are only picked in NSFW channels, or from whitelisted subreddits
+        kinds = (TEXT, VIDEO) if is_text else (IMAGE, VIDEO)
+        allow_nsfw = allow_nsfw or self._can_send_nsfw(ctx, subreddit)
+        guild_id = ctx.guild.id
+        post = self.submissions.pop_unseen(guild_id, key, kinds, allow_nsfw)
+        if post is None and self.submissions.reset_seen(guild_id, key, kinds):
+            # Every matching post has been shown, start over with posts of these kinds
+            post = self.submissions.pop_unseen(guild_id, key, kinds, allow_nsfw)
         if post is None:
-            raise CommandError(f"Failed to find a post within the given parameters for the subreddit **r/{subreddit}**")
+            reason = "" if allow_nsfw else " NSFW posts are only shown in NSFW channels."
+            raise CommandError(f"Failed to find a post within the given parameters for the subreddit **r/{subreddit}**.{reason}")
+
+        # Refresh listing in the background if it's popular and running low or about to expire
+        if self.submissions.should_refresh(key, guild_id):
+            self.submissions.refresh_ahead(key)
 
         # FIXME: Shitty band-aid fix to support videos
-        if post.media:
-            return await ctx.send(post.media["reddit_video"]["fallback_url"])
+        if post.video_url:
+            return await ctx.send(post.video_url)
 
         # Obtain (title, image URL) or (selftext, None) if is_text==True
         out_text, image_url = await self._format_reddit_post(post, subreddit, is_text)
@@ -703,4 +695,4 @@ class RedditCog(BaseCog):
         """
         subreddit, aliases, *_ = cmd
         pfix = self.bot.command_prefix
-        return pfix + f", {pfix}".join(aliases+[subreddit]) if aliases else pfix + subreddit
+        return pfix + f", {pfix}".join([*aliases, subreddit]) if aliases else pfix + subreddit
@@ -394,10 +394,10 @@ class SoundCog(BaseCog):
                 dym = "Did you mean:"  
             else:
                 dym = ""
-            await ctx.send(f"No sound with name **`{sound_name}`**. {dym}")
             if dym:
-                for embed in embeds:
-                    await ctx.send(embed=embed)
+                await self.send_embeds(ctx, embeds, content=f"No sound with name **`{sound_name}`**. {dym}")
+            else:
+                await ctx.send(f"No sound with name **`{sound_name}`**.")
             return
         else:
             source = await YTDLSource.create_local_source(ctx, subdir, sound_name)
@@ -645,8 +645,7 @@ class SoundCog(BaseCog):
 
         # Post search results to ctx.channel
         if embeds:
-            for embed in embeds:
-                await ctx.send(embed=embed)
+            await self.send_embeds(ctx, embeds)
         else:
             await ctx.send("No results")
     
@@ -21,6 +21,7 @@ from ..utils.checks import owners_only
 from ..utils.converters import UserOrMeConverter
 from ..utils.datetimeutils import format_time_difference
 from ..utils.exceptions import CommandError
+from ..utils.images import ENCODE_TIMES
 from .base_cog import BaseCog
 
 GUILD_STATS_PATH = f"{STATS_DIR}/guilds.pkl"
@@ -272,6 +273,35 @@ class StatsCog(BaseCog):
         else:
             await ctx.send("No active audio players")
 
+    @commands.command(name="encodestats")
+    @owners_only()
+    async def encode_stats(self, ctx: commands.Context) -> None:
+        """Display image encoding times per encoder stage."""
+        if not ENCODE_TIMES:
+            raise CommandError("No images have been encoded yet!")
+
+        out = []
+        for stage, times in ENCODE_TIMES.items():
+            avg = sum(times) / len(times)
+            out.append(f"**{stage}**: {avg*1000:.1f} ms avg, {max(times)*1000:.1f} ms max ({len(times)} encodes)")
+        await self.send_embed_message(ctx, "Image encoding", "\n".join(out), footer=False)
+
+    @commands.command(name="markovpools")
+    @owners_only()
+    async def markov_pools(self, ctx: commands.Context) -> None:
+        """Display markov sentence pool statistics."""
+        for cog_name in ["TwitterCog", "MemeCog"]:
+            cog = self.bot.get_cog(cog_name)
+            if not cog:
+                continue
+            pool = cog.sentences
+            out = [
+                f"**{key}**: {len(pool.pools[key])}/{pool.size} ready, "
+                f"{stats.hits} hits, {stats.underruns} underruns, {stats.failed} failed"
+                for key, stats in pool.stats.items()
+            ]
+            await self.send_embed_message(ctx, cog_name, "\n".join(out) or "No models in use", footer=False)
+
     @commands.command(name="changelog")
     @commands.cooldown(rate=1, per=10, type=commands.BucketType.guild)
     async def changelog(self,
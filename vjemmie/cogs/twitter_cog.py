@@ -1,29 +1,34 @@
 import asyncio
 import json
 import random
+import re
 import time
+from array import array
 from collections import namedtuple
 from functools import partial
-from typing import Dict, Iterable, List, Tuple
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
 
 import discord
-import lxml
+import httpx
 import markovify
 from aiofile import AIOFile
 from discord.ext import commands
-from requests_html import HTML, HTMLSession
 
-from ..utils.caching import get_cached
+from ..config import MAIN_DB
+from ..db import get_db
+from ..utils.commands import CommandDef, CommandRegistry
 from ..utils.exceptions import CommandError
 from ..utils.experimental import get_ctx
-from ..utils.json import dump_json
+from ..utils.markov import MarkovStore, SentencePool
+from ..utils.twitter import FetchResult, TimelineCursor, TimelineFetcher
 from .base_cog import BaseCog
 
-session = HTMLSession()
-USERS_FILE = "db/twitter/users.json"
+USERS_FILE = "db/twitter/users.json" # Old JSON store, migrated to the database on startup
+STATUS_ID = re.compile(r"/status/(\d+)")
 
-TwitterUser = namedtuple("TwitterUser", "user modified tweets aliases", defaults=[[]])
-Tweet = namedtuple("Tweet", "text url")
+TwitterUser = namedtuple("TwitterUser", "user modified aliases", defaults=[[]])
+Tweet = namedtuple("Tweet", "url text")
 
 class TwitterCog(BaseCog):
     """Twitter commands"""
@@ -31,49 +36,129 @@ class TwitterCog(BaseCog):
     EMOJI = "<:twitter:572746936658952197>"
 
     DIRS = ["db/twitter"]
-    FILES = [USERS_FILE]
 
     TWITTER_PAGES = 20
     MARKOV_LEN = 140
 
     def __init__(self, bot: commands.Bot) -> None:
         super().__init__(bot)
-        
-        # Key: Username, Value: markovify text model
-        self.text_models: Dict[str, markovify.NewlineText] = {}
+        self.db = get_db(MAIN_DB)
+        self.migrate_users_file()
+
+        # Key: Username, Value: TwitterUser
+        self.users: Dict[str, TwitterUser] = self.load_users()
+
+        # Key: Username, Value: IDs of user's tweets. Loaded on first use
+        self.tweet_ids: Dict[str, array] = {}
+
+        self.fetcher = TimelineFetcher(pages=self.TWITTER_PAGES)
 
+        # Markov models of users' tweets, persisted to disk
+        self.markov = MarkovStore("twitter")
+        self.sentences = SentencePool(
+            self.markov, 
+            lambda model: model.make_short_sentence(self.MARKOV_LEN, tries=300)
+        )
+
+        # Two commands per user: random tweet URL and markov generated tweet
+        self.url_commands = CommandRegistry(self, TwitterCog._twitter_url_cmd)
+        self.markov_commands = CommandRegistry(self, TwitterCog._twitter_markov_cmd)
         for user in self.users.values():
             self.create_commands(user)
         
-    @property
-    def users(self) -> Dict[str, TwitterUser]:
-        users = get_cached(USERS_FILE, category="twitter")
-        return {user: TwitterUser(*values) for user, values in users.items()}
+    @commands.Cog.listener()
+    async def on_ready(self) -> None:
+        # Load saved models in the background, so the first markov command is fast
+        self.bot.loop.create_task(self.markov.load_all())
+        self.sentences.start()
+
+    def cog_unload(self) -> None:
+        self.sentences.stop()
+
+    def load_users(self) -> Dict[str, TwitterUser]:
+        """NOTE: Blocking! Only used on startup."""
+        aliases: Dict[str, List[str]] = {}
+        for alias, username in self.db._twitter_get_aliases():
+            aliases.setdefault(username, []).append(alias)
+        return {
+            username: TwitterUser(username, submitted_at, aliases.get(username, []))
+            for username, submitted_at in self.db._twitter_get_users()
+        }
 
-    async def update_user(self, user: TwitterUser) -> None:
-        self.users[user.user] = user
-        await dump_json(USERS_FILE, self.users)
+    def migrate_users_file(self, path: str=USERS_FILE) -> None:
+        """Moves users and tweets from the old JSON file to the database.
+        NOTE: Blocking! Only used on startup."""
+        p = Path(path)
+        if not p.exists():
+            return
+
+        with open(p, "r") as f:
+            users = json.load(f)
+        skipped = 0
+        for username, (_, modified, tweets, *aliases) in users.items():
+            aliases = aliases[0] if aliases else []
+            # Submitter was never recorded in the JSON file
+            self.db._twitter_add_user(username, 0, aliases, modified)
+            rows, n_skipped = self._parse_tweets(tweets)
+            self.db._twitter_add_tweets(username, rows)
+            skipped += n_skipped
+        self.db.conn.commit()
+        if skipped:
+            print(f"Skipped {skipped} tweets without a status ID in their URL while migrating {path}")
+
+        # Keep the old file around, but make sure we never migrate it twice
+        p.rename(p.with_suffix(".json.migrated"))
+
+    @staticmethod
+    def _parse_tweets(tweets: Iterable[Tuple[str, str]]) -> Tuple[List[Tuple[int, str, str]], int]:
+        """Adds status IDs to (URL, text) tuples. Returns the tweets, and
+        the number of tweets skipped because their URL has no status ID."""
+        rows = []
+        skipped = 0
+        for url, text in tweets:
+            match = STATUS_ID.search(url)
+            if match:
+                rows.append((int(match.group(1)), url, text))
+            else:
+                skipped += 1
+        return rows, skipped
+
+    async def get_tweet_ids(self, user: str) -> array:
+        if user not in self.tweet_ids:
+            self.tweet_ids[user] = array("q", await self.db.twitter_get_tweet_ids(user))
+        return self.tweet_ids[user]
+
+    async def get_random_tweet(self, user: str) -> Optional[Tweet]:
+        # Pick a random ID from memory, and only fetch that tweet from the db
+        tweet_ids = await self.get_tweet_ids(user)
+        if not tweet_ids:
+            return None
+        tweet = await self.db.twitter_get_tweet(random.choice(tweet_ids))
+        return Tweet(*tweet) if tweet else None
 
     def create_commands(self, user: TwitterUser) -> None:
         username = user.user.lower()
-        aliases = user.aliases
+        aliases = list(user.aliases)
 
         # Make command that fetches random tweet URL
-        _u_cmd = asyncio.coroutine(partial(self._twitter_url_cmd, user=username))
-        url_cmd = commands.command(name=f"{username}", aliases=aliases)(_u_cmd)
+        self.url_commands.add(
+            CommandDef(name=username, aliases=aliases, kwargs={"user": username})
+        )
 
         # Make command that generates tweet using markov chain
-        _m_cmd = asyncio.coroutine(partial(self._twitter_markov_cmd, user=username))
-        markov_cmd = commands.command(name=f"{username}_markov", 
-                                      aliases=[f"{alias}m" for alias in aliases] or [f"{username}m"]
-                                      )(_m_cmd)
-
-        self.bot.add_command(url_cmd)
-        self.bot.add_command(markov_cmd)
+        self.markov_commands.add(
+            CommandDef(
+                name=f"{username}_markov",
+                aliases=[f"{alias}m" for alias in aliases] or [f"{username}m"],
+                kwargs={"user": username}
+            )
+        )
 
     async def _twitter_url_cmd(self, ctx: commands.Context, user: str) -> None:
-        tweets = self.users[user].tweets
-        await ctx.send(random.choice(tweets)[0])
+        tweet = await self.get_random_tweet(user)
+        if not tweet:
+            raise CommandError(f"No tweets found for {user}!")
+        await ctx.send(tweet.url)
 
     async def _twitter_markov_cmd(self, ctx: commands.Context, user: str) -> None:
         await ctx.send(await self.generate_sentence(user))
@@ -117,6 +202,23 @@ class TwitterCog(BaseCog):
         else:
             await ctx.send("User is not added! "
             f"Type **`{self.bot.command_prefix}twitter add <user>`** or ")
+
+    @twitter.command(name="updateall")
+    async def update_all_tweets(self, ctx: commands.Context) -> None:
+        """Update tweets for all users."""
+        async with ctx.typing():
+            cursors = {user: await self.get_cursor(user) for user in self.users}
+            results = await self.fetcher.fetch_many(cursors)
+
+            out = []
+            for user, result in results.items():
+                if isinstance(result, Exception):
+                    out.append(f"**{user}**: {result}")
+                else:
+                    n_added = await self.save_fetch(ctx.author.id, result)
+                    out.append(f"**{user}**: {n_added} new tweets")
+
+        await self.send_embed_message(ctx, "Twitter update", "\n".join(out))
     
     @twitter.command(name="users", aliases=["show", "list"])
     async def show_twitter_users(self, ctx: commands.Context) -> None:
@@ -131,124 +233,74 @@ class TwitterCog(BaseCog):
 
         await self.send_embed_message(ctx, "Twitter users", users)
 
-    async def get_tweets(self, ctx: commands.Context, user: str, aliases=None) -> List[Tuple[str, str]]:
+    async def get_tweets(self, ctx: commands.Context, user: str, aliases=None) -> None:
         """Retrieves tweets for a specific user.
         
-        If user already has saved tweets, new tweets are added to
-        existing list of tweets.
+        If user already has saved tweets, only tweets that are newer than
+        the newest saved tweet (or older than the oldest one) are fetched.
         """
         if not aliases:
             aliases = []
         
-        tweets = []
         msg = await ctx.send("Fetching tweets...")
         
         try:
-            to_run = partial(self._get_tweets, user, pages=self.TWITTER_PAGES)
             async with ctx.typing():
-                tweets = await self.bot.loop.run_in_executor(None, to_run)
-        except ValueError:
-            raise IOError(f"Unable not fetch tweets for {user}")
-        except lxml.etree.ParserError:
-            pass
+                result = await self.fetcher.fetch(user, await self.get_cursor(user))
+        except ValueError as e:
+            raise CommandError(str(e))
+        except httpx.HTTPError as e:
+            raise CommandError(f"Unable to fetch tweets for {user}: {e}")
         else:
-            if not tweets:
+            if not result.tweets and user not in self.users:
                 return
-            
-            # Add fetched tweets to existing user's tweets if they exist
-            _user = self.users.get(user)
-            if _user:
-                tweets = set(tuple(tweets))
-                old_tweets = set(tuple((tweet[0], tweet[1]) for tweet in _user.tweets))
-                tweets.update(old_tweets)
-                tweets = list(tweets)
-                aliases = _user.aliases      
-            
-            # Create new TwitterUser object with updated tweets
-            tu = TwitterUser(user, time.time(), tweets, aliases)
-            
-            # Save updated user
-            await self.update_user(tu)     
+            await self.save_fetch(ctx.author.id, result, aliases)
         finally:
             await msg.delete()
 
-    def _get_tweets(self, user: str, pages: int) -> Iterable[str]:
-        """Modified version of https://github.com/kennethreitz/twitter-scraper.
-
-        Generator of tweet URLs or tweet text from a specific user.
-        
-        Parameters
-        ----------
-        user : `str`
-            Username of user to get tweets from
-        pages : `int`, optional
-            Number of pages to return tweets from. 
-            25 is the maximum allowed number of pages.
-     
-        Raises
-        ------
-        ValueError
-            Raised if user cannot be found
-        
-        Returns
-        -------
-        `Iterable[str]`
-            Tweets
-        """
-
-        url = f'https://twitter.com/i/profiles/show/{user}/timeline/tweets?include_available_features=1&include_entities=1&include_new_items_bar=true'
-        headers = {
-            'Accept': 'application/json, text/javascript, */*; q=0.01',
-            'Referer': f'https://twitter.com/{user}',
-            'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_12_6) AppleWebKit/603.3.8 (KHTML, like Gecko) Version/10.1.2 Safari/603.3.8',
-            'X-Twitter-Active-User': 'yes',
-            'X-Requested-With': 'XMLHttpRequest'
-        }
-
-        def gen_tweets(pages: int):
-            r = session.get(url, headers=headers)
-
-            while pages > 0:
-                try:
-                    html = HTML(html=r.json()['items_html'],
-                                url='bunk', default_encoding='utf-8')
-                except KeyError:
-                    raise ValueError(
-                        f'Oops! Either "{user}" does not exist or is private.')
-
-                tweets = []
-                for tweet in html.find('.stream-item'):
-                    try:
-                        text = tweet.find('.tweet-text')[0].full_text.split(
-                            "pic.twitter.com")[0].split("https://")[0]
-                        _url = f"https://twitter.com/{user}/status/{tweet.attrs['data-item-id']}"
-                        tweets.append((_url, text))
-                    except:
-                        pass
-
-                last_tweet = html.find('.stream-item')[-1].attrs['data-item-id']
-
-                for tweet in tweets:
-                    if tweet:
-                        yield tweet
-
-                r = session.get(
-                    url, params = {'max_position': last_tweet}, headers = headers)
-                pages += -1
-
-        yield from gen_tweets(pages)
+    async def get_cursor(self, user: str) -> Optional[TimelineCursor]:
+        if user not in self.users:
+            return None
+        return TimelineCursor(*await self.db.twitter_get_cursor(user))
 
-    async def generate_sentence(self, user: str, length: int=140) -> str:
+    async def save_fetch(self, submitter_id: int, result: FetchResult, aliases: Iterable[str]=()) -> int:
+        """Saves fetched tweets and the user's new cursor.
+        Returns number of tweets that were added."""
+        user = result.user
+        if user not in self.users:
+            await self.db.twitter_add_user(user, submitter_id, aliases)
+            self.users[user] = TwitterUser(user, time.time(), list(aliases))
+
+        # Only tweets that aren't already stored are added
+        cursor = result.cursor
+        added = set(await self.db.twitter_save_fetch(
+            user, result.tweets, cursor.newest, cursor.oldest, cursor.exhausted
+        ))
+        if user in self.tweet_ids:
+            self.tweet_ids[user].extend(added)
+
+        # Train user's markov model on new tweets only.
+        # Missing models are created from all stored tweets on first use.
+        new = {url: text for tweet_id, url, text in result.tweets if tweet_id in added}
+        if new and await self.markov.load(user):
+            await self.markov.update(user, new)
+            self.sentences.clear(user)
+
+        return len(added)
+
+    async def generate_sentence(self, user: str, length: int=MARKOV_LEN) -> str:
         # Add user if username passed in is not added to database
         if user not in self.users:
             ctx = get_ctx()
             await self.get_tweets(ctx, user)
-        
-        # Get tweet text only
-        tweets = [tweet[1] for tweet in self.users[user].tweets]
 
-        # Create text model based on tweets
-        text_model = await self.get_text_model(user, tweets)
+        # Use pre-generated sentence if possible
+        if length == self.MARKOV_LEN:
+            sentence = self.sentences.pop(user)
+            if sentence:
+                return sentence
+        
+        text_model = await self.get_text_model(user)
 
         to_run = partial(text_model.make_short_sentence, length, tries=300)
         sentence = await self.bot.loop.run_in_executor(None, to_run)
@@ -258,13 +310,13 @@ class TwitterCog(BaseCog):
 
         return sentence
 
-    async def get_text_model(self, user: str, text: List[str]) -> markovify.Text:
-        # Check if we have already created a text model for this user
-        text_model = self.text_models.get(user)
-
-        if not text_model:
-            t = "\n".join([_t for _t in text])
-            text_model = markovify.NewlineText(t)
-            self.text_models[user] = text_model
-
-        return text_model
+    async def get_text_model(self, user: str) -> markovify.Text:
+        # Load saved model, or create one from the user's tweets
+        stored = await self.markov.load(user)
+        if not stored:
+            tweets = dict(await self.db.twitter_get_tweets(user))
+            try:
+                stored = await self.markov.update(user, tweets)
+            except ValueError:
+                raise CommandError(f"{user} has no tweets to generate text from!")
+        return stored.model
@@ -8,7 +8,8 @@ import asyncio
 from dataclasses import dataclass
 from datetime import datetime, timezone
 from functools import partial
-from typing import Dict, List, Tuple, Union
+from types import MappingProxyType
+from typing import Dict, List, Mapping, Tuple, Union
 
 import ciso8601
 import discord
@@ -16,7 +17,7 @@ from bs4 import BeautifulSoup
 from discord.ext import commands
 
 from ..config import ALL_ARGS, YES_ARGS
-from ..utils.caching import get_cached
+from ..utils.caching import cached_loader
 from ..utils.checks import admins_only
 from ..utils.converters import SteamID64Converter, UserOrMeConverter
 from ..utils.datetimeutils import format_time_difference
@@ -73,7 +74,7 @@ RANKS = {
 
 USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/74.0.3729.169 Safari/537.36"
 
-@dataclass
+@dataclass(frozen=True)
 class UnderlordsProfile:
     steamid: Union[str, int] = None
     userid: int = 0
@@ -171,6 +172,12 @@ class UnderlordsProfile:
         return last_updated
 
 
+@cached_loader(USERS_FILE, "underlords")
+def load_users(users: dict) -> Mapping[str, UnderlordsProfile]:
+    """Profiles of added users. Key: Discord user ID"""
+    return MappingProxyType({k: UnderlordsProfile(**v) for k, v in users.items()})
+
+
 @dataclass
 class Unit:
     name: str
@@ -207,12 +214,8 @@ class UnderlordsCog(BaseCog):
         super().__init__(bot)
 
     @property
-    def users(self) -> Dict[str, UnderlordsProfile]:
-        users = {}
-        _users_raw = get_cached(USERS_FILE, "underlords")
-        for k, v in _users_raw.items():
-            users[k] = UnderlordsProfile(**v)
-        return users
+    def users(self) -> Mapping[str, UnderlordsProfile]:
+        return load_users()
 
     async def dump_users(self, users: dict) -> None:
         await dump_json(USERS_FILE, users, default=lambda o: o.__dict__)
@@ -243,7 +246,7 @@ class UnderlordsCog(BaseCog):
 
     async def _do_add_user(self, user: discord.User, steamid: str) -> None:
         profile = await self.scrape_op_gg_stats(steamid, user.id)
-        users = self.users
+        users = dict(self.users)
         users[str(user.id)] = profile
         await self.dump_users(users)
 
@@ -1,6 +1,5 @@
 import sys
 from collections import namedtuple
-from contextlib import suppress
 from random import randint
 from typing import List
 
@@ -9,8 +8,10 @@ import psutil
 from discord.ext import commands
 
 from ..config import AUTHOR_MENTION, YES_ARGS
+from ..utils.access_control import ACCESS
 from ..utils.converters import BoolConverter
 from ..utils.exceptions import CategoryError, CogError, CommandError
+from ..utils.help import HelpIndex
 from ..utils.time import format_time
 from .base_cog import BaseCog, EmbedField
 
@@ -23,6 +24,18 @@ class UserCog(BaseCog):
     def __init__(self, bot: commands.Bot):
         super().__init__(bot)
         self.bot.remove_command('help')
+        self.help_index = HelpIndex(bot, fill_char=self.EMBED_FILL_CHAR)
+        # Trusted/blacklist changes affect which commands can be run
+        ACCESS.add_listener(self.help_index.invalidate_masks)
+
+    @commands.Cog.listener()
+    async def on_ready(self) -> None:
+        # Format all listings up front, so the first help command is fast
+        self.help_index.build()
+
+    def cog_unload(self) -> None:
+        ACCESS.remove_listener(self.help_index.invalidate_masks)
+        self.help_index.close()
 
     @commands.command(name="help", aliases=["Help", "hlep", "?", "pls"], usage="<command/category>")
     async def help_(self, ctx: commands.Context, cmd_or_category: str=None, advanced: BoolConverter(["advanced"])=False) -> None:
@@ -62,20 +75,23 @@ class UserCog(BaseCog):
         # We refer to cogs as categories to users 
         for cog in await self.get_cogs():
             if cog_name.lower() == cog.cog_name.lower():
-                cmds = await cog.get_invokable_commands(ctx)
-                if not cmds:
+                out = await self.help_index.render(ctx, cog, advanced)
+                if not out:
                     raise CommandError("Category has no associated commands!")
-                return await cog.send_cog_commands(ctx, advanced)
+                if advanced:
+                    # Add command signature legend string if advanced output is enabled
+                    out = self.SIGNATURE_HELP + out
+                return await self.send_embed_message(ctx, f"{cog.EMOJI} {cog.cog_name} commands", out)
         
         # If loop does not raise error or return, it means cog does not exist.
         raise CommandError(f"No such category **{cog_name}**.")
     
     @commands.command(name="categories")
     async def help_categories(self, ctx: commands.Context) -> None:
-        cogs = await self.get_cogs()
-        for idx, cog in enumerate(cogs):
-            if not await cog.get_invokable_commands(ctx) or not cog.__doc__:
-                cogs.pop(idx)
+        cogs = [
+            cog for cog in await self.get_cogs()
+            if cog.__doc__ and await self.help_index.visible(ctx, cog)
+        ]
         
         description = "\n".join([f"{cog.EMOJI} **{cog.cog_name}**: {cog.__doc__}\n" for cog in cogs])
         await self.send_embed_message(ctx, title="Categories", description=description)
@@ -145,9 +161,8 @@ class UserCog(BaseCog):
         l = []
         for cog in await self.get_cogs():
             # Ignore cogs returning no commands due to failed checks or lack of commands
-            with suppress(CommandError):
-                #cmds = await cog._get_cog_commands(ctx, advanced, rtn=True)
-                cmds = await cog._get_cog_commands(ctx, advanced)
+            cmds = await self.help_index.render(ctx, cog, advanced)
+            if cmds:
                 l.append(f"{cog.EMOJI} **{cog.cog_name}**\n_{cog.__doc__}_\n{cmds}\n")
 
         if not l:
@@ -18,6 +18,7 @@ TRUSTED_DIR = f"{DB_DIR}/access"
 TRUSTED_PATH = f"{TRUSTED_DIR}/trusted.json"
 TEMP_DIR = "temp"
 STATS_DIR = "stats"
+MARKOV_DIR = f"{DB_DIR}/markov"
 
 # COGS
 # -----------------
@@ -35,6 +36,13 @@ MAX_DL_SIZE = 25_000_000
 DOWNLOADS_ALLOWED = True
 
 
+# UPLOADS
+# -----------------
+
+# 8 MB. Discord's attachment size limit for guilds without boosts
+DISCORD_UPLOAD_LIMIT = 8_000_000
+
+
 # GUILDS
 # -----------------
 
@@ -68,6 +76,40 @@ GUILD_HISTORY_CHANNEL = 565674480660119592
 COMMAND_INVOCATION_CHANNEL = 584386122004561920 
 
 
+# MARKOV
+# -----------------
+
+# Pre-generated sentences kept per markov model
+MARKOV_POOL_SIZE = 20
+
+# Max sentences generated per model each time the pools are topped up
+MARKOV_POOL_BATCH = 5
+
+# Seconds between topping up sentence pools
+MARKOV_POOL_INTERVAL = 10.0
+
+
+# TWITTER
+# -----------------
+
+# Base URL of Twitter's timeline endpoint. Can be pointed at a fake server for testing
+TWITTER_BASE_URL = "https://twitter.com"
+
+# Max timeline requests per second, shared by all users being fetched
+TWITTER_RATE_LIMIT = 1.0
+
+# Max number of users whose timelines are fetched concurrently
+TWITTER_MAX_CONCURRENT = 4
+
+
+# REDDIT
+# -----------------
+
+# Reddit API endpoints. Can be pointed at a fake server for testing
+REDDIT_API_URL = "https://oauth.reddit.com"
+REDDIT_AUTH_URL = "https://www.reddit.com/api/v1/access_token"
+
+
 # USERS
 # -----------------
 OWNER_ID = 103890994440728576 # Replace with own User ID
@@ -17,6 +17,9 @@ import discord
 from discord.ext import commands
 
 import trueskill
+from trueskill import Rating
+
+from ..ladder import Player, get_new_player, rate
 from ..utils.exceptions import CommandError
 
 
@@ -40,7 +43,12 @@ class DatabaseConnection:
         async with self.wlock:
 
             def to_run():
-                r = meth(*args)
+                # Everything a write method does is committed together, or not at all
+                try:
+                    r = meth(*args)
+                except Exception:
+                    self.conn.rollback()
+                    raise
                 self.conn.commit()
                 return r
 
@@ -269,3 +277,288 @@ class DatabaseConnection:
     def _bag_get_guilds(self) -> List[Tuple[int, int, int]]:
         self.cursor.execute("SELECT * FROM bag")
         return self.cursor.fetchall()
+
+    #########
+    # TWITTER
+    #########
+
+    async def twitter_get_users(self) -> List[Tuple[str, float]]:
+        return await self.read(self._twitter_get_users)
+
+    def _twitter_get_users(self) -> List[Tuple[str, float]]:
+        self.cursor.execute("SELECT username, submittedAt FROM twitter")
+        return self.cursor.fetchall()
+
+    async def twitter_add_user(self, username: str, submitter_id: int, aliases: Iterable[str]=()) -> None:
+        await self.write(self._twitter_add_user, username, submitter_id, aliases)
+
+    def _twitter_add_user(self, username: str, submitter_id: int, aliases: Iterable[str]=(), submitted_at: float=None) -> None:
+        self.cursor.execute(
+            "INSERT OR IGNORE INTO twitter (username, submitterID, submittedAt) VALUES (?, ?, ?)",
+            [username, submitter_id, submitted_at or time.time()],
+        )
+        self.cursor.executemany(
+            "INSERT OR IGNORE INTO twitter_aliases (alias, username) VALUES (?, ?)",
+            [(alias, username) for alias in aliases],
+        )
+
+    async def twitter_get_aliases(self) -> List[Tuple[str, str]]:
+        return await self.read(self._twitter_get_aliases)
+
+    def _twitter_get_aliases(self) -> List[Tuple[str, str]]:
+        self.cursor.execute("SELECT alias, username FROM twitter_aliases")
+        return self.cursor.fetchall()
+
+    async def twitter_add_tweets(self, username: str, tweets: Iterable[Tuple[int, str, str]]) -> List[int]:
+        """Adds (tweet ID, URL, text) tuples. Returns IDs of tweets that were not already stored."""
+        return await self.write(self._twitter_add_tweets, username, tweets)
+
+    def _twitter_add_tweets(self, username: str, tweets: Iterable[Tuple[int, str, str]]) -> List[int]:
+        added = []
+        for tweet_id, url, text in tweets:
+            r = self.cursor.execute(
+                "INSERT OR IGNORE INTO tweets (tweetID, username, url, text) VALUES (?, ?, ?, ?)",
+                [tweet_id, username, url, text],
+            )
+            if r.rowcount:
+                added.append(tweet_id)
+        return added
+
+    async def twitter_get_cursor(self, username: str) -> Tuple[Optional[int], Optional[int], bool]:
+        return await self.read(self._twitter_get_cursor, username)
+
+    def _twitter_get_cursor(self, username: str) -> Tuple[Optional[int], Optional[int], bool]:
+        """Returns newest and oldest stored tweet IDs of a user, and whether
+        the oldest tweet is the first tweet of the user's timeline."""
+        self.cursor.execute(
+            "SELECT newest, oldest, exhausted FROM twitter_cursors WHERE username==?", [username]
+        )
+        row = self.cursor.fetchone()
+        if row:
+            return row[0], row[1], bool(row[2])
+
+        # Users added before cursors were saved
+        self.cursor.execute(
+            "SELECT MAX(tweetID), MIN(tweetID) FROM tweets WHERE username==?", [username]
+        )
+        newest, oldest = self.cursor.fetchone()
+        return newest, oldest, False
+
+    async def twitter_save_fetch(
+        self,
+        username: str,
+        tweets: Iterable[Tuple[int, str, str]],
+        newest: Optional[int],
+        oldest: Optional[int],
+        exhausted: bool,
+    ) -> List[int]:
+        """Adds fetched tweets and saves the user's cursor in a single transaction.
+        Returns IDs of tweets that were not already stored."""
+        return await self.write(self._twitter_save_fetch, username, tweets, newest, oldest, exhausted)
+
+    def _twitter_save_fetch(
+        self,
+        username: str,
+        tweets: Iterable[Tuple[int, str, str]],
+        newest: Optional[int],
+        oldest: Optional[int],
+        exhausted: bool,
+    ) -> List[int]:
+        added = self._twitter_add_tweets(username, tweets)
+        self.cursor.execute(
+            """INSERT INTO twitter_cursors (username, newest, oldest, exhausted)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(username)
+            DO UPDATE SET newest=excluded.newest, oldest=excluded.oldest, exhausted=excluded.exhausted""",
+            [username, newest, oldest, int(exhausted)],
+        )
+        return added
+
+    async def twitter_get_tweet_ids(self, username: str) -> List[int]:
+        return await self.read(self._twitter_get_tweet_ids, username)
+
+    def _twitter_get_tweet_ids(self, username: str) -> List[int]:
+        self.cursor.execute("SELECT tweetID FROM tweets WHERE username==?", [username])
+        return [row[0] for row in self.cursor.fetchall()]
+
+    async def twitter_get_tweet(self, tweet_id: int) -> Optional[Tuple[str, str]]:
+        return await self.read(self._twitter_get_tweet, tweet_id)
+
+    def _twitter_get_tweet(self, tweet_id: int) -> Optional[Tuple[str, str]]:
+        self.cursor.execute("SELECT url, text FROM tweets WHERE tweetID==?", [tweet_id])
+        return self.cursor.fetchone()
+
+    async def twitter_get_tweets(self, username: str) -> List[Tuple[str, str]]:
+        return await self.read(self._twitter_get_tweets, username)
+
+    def _twitter_get_tweets(self, username: str) -> List[Tuple[str, str]]:
+        self.cursor.execute("SELECT url, text FROM tweets WHERE username==?", [username])
+        return self.cursor.fetchall()
+
+    #########
+    # LADDER
+    #########
+
+    async def ladder_get_players(self, uids: Optional[Iterable[int]]=None) -> Dict[int, Player]:
+        """Fetches players by Discord user ID, or every player if `uids` is None.
+        Users who have never played are not included."""
+        return await self.read(self._ladder_get_players, uids)
+
+    def _ladder_get_players(self, uids: Optional[Iterable[int]]=None) -> Dict[int, Player]:
+        query = "SELECT uid, mu, sigma, wins, losses, draws FROM ladder_players"
+        params: List[int] = []
+        if uids is not None:
+            params = list(uids)
+            query += f" WHERE uid IN ({', '.join('?' * len(params))})"
+        self.cursor.execute(query, params)
+        return {
+            uid: Player(uid, Rating(mu, sigma), wins, losses, draws)
+            for uid, mu, sigma, wins, losses, draws in self.cursor.fetchall()
+        }
+
+    async def ladder_add_players(self, players: Iterable[Player]) -> None:
+        await self.write(self._ladder_add_players, players)
+
+    def _ladder_add_players(self, players: Iterable[Player]) -> None:
+        self.cursor.executemany(
+            """INSERT INTO ladder_players (uid, mu, sigma, wins, losses, draws)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(uid)
+            DO UPDATE SET mu=excluded.mu, sigma=excluded.sigma,
+            wins=excluded.wins, losses=excluded.losses, draws=excluded.draws""",
+            [
+                (p.uid, p.rating.mu, p.rating.sigma, p.wins, p.losses, p.draws)
+                for p in players
+            ],
+        )
+
+    async def ladder_get_seeds(self) -> Dict[int, Player]:
+        """Fetches the ratings and records players had before the match
+        history was recorded (players migrated from the old JSON file).
+        Empty once the ladder has been reset."""
+        return await self.read(self._ladder_get_seeds)
+
+    def _ladder_get_seeds(self) -> Dict[int, Player]:
+        self.cursor.execute(
+            """SELECT uid, mu, sigma, wins, losses, draws FROM ladder_seeds
+            WHERE NOT EXISTS (SELECT 1 FROM ladder_resets)"""
+        )
+        return {
+            uid: Player(uid, Rating(mu, sigma), wins, losses, draws)
+            for uid, mu, sigma, wins, losses, draws in self.cursor.fetchall()
+        }
+
+    def _ladder_has_seeds(self) -> bool:
+        self.cursor.execute("SELECT 1 FROM ladder_seeds LIMIT 1")
+        return self.cursor.fetchone() is not None
+
+    def _ladder_add_seeds(self, players: Iterable[Player]) -> None:
+        self.cursor.executemany(
+            """INSERT OR IGNORE INTO ladder_seeds (uid, mu, sigma, wins, losses, draws)
+            VALUES (?, ?, ?, ?, ?, ?)""",
+            [
+                (p.uid, p.rating.mu, p.rating.sigma, p.wins, p.losses, p.draws)
+                for p in players
+            ],
+        )
+
+    async def ladder_record_match(
+        self, team1: List[int], team2: List[int], winner: int
+    ) -> Tuple[List[Player], List[Player]]:
+        """Rates a match from the players' current ratings, then saves the
+        new ratings and the match in a single transaction.
+
+        Parameters
+        ----------
+        team1 : `List[int]`
+            Discord user IDs of team 1
+        team2 : `List[int]`
+            Discord user IDs of team 2
+        winner : `int`
+            Winning team, 1 or 2. 0 is a draw.
+
+        Returns
+        -------
+        `Tuple[List[Player], List[Player]]`
+            Both teams' players after the match
+        """
+        return await self.write(self._ladder_record_match, team1, team2, winner)
+
+    def _ladder_record_match(
+        self, team1: List[int], team2: List[int], winner: int
+    ) -> Tuple[List[Player], List[Player]]:
+        players = self._ladder_get_players(team1 + team2)
+        before1 = [players.get(uid) or get_new_player(uid) for uid in team1]
+        before2 = [players.get(uid) or get_new_player(uid) for uid in team2]
+        after1, after2 = rate(before1, before2, winner)
+        self._ladder_add_players(after1 + after2)
+
+        self.cursor.execute(
+            "INSERT INTO ladder_matches (playedAt, winner) VALUES (?, ?)",
+            [time.time(), winner],
+        )
+        match_id = self.cursor.lastrowid
+        self.cursor.executemany(
+            """INSERT INTO ladder_match_players
+            (matchID, uid, team, muBefore, sigmaBefore, muAfter, sigmaAfter)
+            VALUES (?, ?, ?, ?, ?, ?, ?)""",
+            [
+                (match_id, b.uid, team, b.rating.mu, b.rating.sigma, a.rating.mu, a.rating.sigma)
+                for team, before, after in [(1, before1, after1), (2, before2, after2)]
+                for b, a in zip(before, after)
+            ],
+        )
+        return after1, after2
+
+    async def ladder_get_matches(self) -> List[Tuple[int, float, int, List[Tuple[int, int]]]]:
+        """Fetches every match recorded since the last reset in the order it
+        was played, as (match ID, timestamp, winner, [(uid, team), ...]) tuples."""
+        return await self.read(self._ladder_get_matches)
+
+    def _ladder_get_matches(self) -> List[Tuple[int, float, int, List[Tuple[int, int]]]]:
+        self.cursor.execute(
+            """SELECT m.matchID, m.playedAt, m.winner, p.uid, p.team
+            FROM ladder_matches m JOIN ladder_match_players p ON m.matchID == p.matchID
+            WHERE m.matchID > (SELECT COALESCE(MAX(lastMatchID), 0) FROM ladder_resets)
+            ORDER BY m.matchID, p.team"""
+        )
+        matches: Dict[int, Tuple[int, float, int, List[Tuple[int, int]]]] = {}
+        for match_id, played_at, winner, uid, team in self.cursor.fetchall():
+            if match_id not in matches:
+                matches[match_id] = (match_id, played_at, winner, [])
+            matches[match_id][3].append((uid, team))
+        return list(matches.values())
+
+    async def ladder_set_rating(self, uid: int, mu: float) -> Optional[Rating]:
+        """Sets μ of a player. Returns the old rating, or None if the player
+        doesn't exist."""
+        return await self.write(self._ladder_set_rating, uid, mu)
+
+    def _ladder_set_rating(self, uid: int, mu: float) -> Optional[Rating]:
+        self.cursor.execute("SELECT mu, sigma FROM ladder_players WHERE uid==?", [uid])
+        row = self.cursor.fetchone()
+        if not row:
+            return None
+        self.cursor.execute("UPDATE ladder_players SET mu=? WHERE uid==?", [mu, uid])
+        return Rating(*row)
+
+    async def ladder_reset_players(self) -> int:
+        """Resets the rating and record of every player. The match history
+        is kept, but matches played before the reset (and seeds) are no
+        longer replayed. Returns the number of players reset."""
+        return await self.write(self._ladder_reset_players)
+
+    def _ladder_reset_players(self) -> int:
+        default = Rating()
+        r = self.cursor.execute(
+            "UPDATE ladder_players SET mu=?, sigma=?, wins=0, losses=0, draws=0",
+            [default.mu, default.sigma],
+        )
+        n_players = r.rowcount
+        if n_players:
+            self.cursor.execute(
+                """INSERT INTO ladder_resets (resetAt, lastMatchID)
+                VALUES (?, (SELECT COALESCE(MAX(matchID), 0) FROM ladder_matches))""",
+                [time.time()],
+            )
+        return n_players
@@ -11,21 +11,29 @@ import shutil
 import textwrap
 from os import listdir
 from random import randint
-from typing import Iterable, Union
+from typing import Iterable, Optional, Union
 
 import numpy as np
 import requests
 from PIL import Image, ImageDraw, ImageFilter, ImageFont, ImageEnhance
 
+from ..config import DISCORD_UPLOAD_LIMIT
 from ..utils.exceptions import InvalidURLError, NonImgUrlError, WordExceededLimit
+from ..utils.images import JPEG, encode_image, open_downscaled, resize_to_pixels
 
 
 class ImageFryer:
+    # JPEG quality range of fried images. Low quality is part of the charm
+    MIN_QUALITY = 5
+    MAX_QUALITY = 30
+    # Larger images are downscaled before frying. Nobody can tell the difference after frying anyway
+    MAX_PIXELS = 4_000_000
+
     def __init__(self, image: Union[io.BytesIO, Image.Image]):
         if isinstance(image, io.BytesIO):
-            self.img = Image.open(image)
+            self.img = open_downscaled(image, self.MAX_PIXELS)
         elif isinstance(image, Image.Image):
-            self.img = image
+            self.img = resize_to_pixels(image, self.MAX_PIXELS)
         else:
             raise TypeError('Argument "Image" must be type <io.BytesIO> or <Image.Image>')
     
@@ -149,7 +157,7 @@ class ImageFryer:
         
         return out
 
-    def fry(self, emoji: str, text: str, caption: str) -> Image.Image:
+    def fry(self, emoji: str, text: str, caption: str, max_bytes: Optional[int]=None) -> io.BytesIO:
         # Copy image instance attribute and convert to RGB palette
         img = self.img.copy().convert("RGB")
         
@@ -180,16 +188,12 @@ class ImageFryer:
         img = saturation.enhance(1.1)
 
         
-        # Create JPEG copy of image
-        jpg_copy = img.copy().convert("RGB")
-
-        # Create io.BytesIO file-like bytestream
-        rtn_img = io.BytesIO()
-        
-        # Save image as shitty jpeg
-        jpg_copy.save(rtn_img, format="JPEG", quality=30)
-        
-        # Seek to byte 0, so discord.File can .read() the file object
-        rtn_img.seek(0)
-        
-        return rtn_img
+        # Save image as shitty jpeg that fits within the upload limit
+        encoded = encode_image(
+            img,
+            max_bytes or DISCORD_UPLOAD_LIMIT,
+            chain=[JPEG],
+            min_quality=self.MIN_QUALITY,
+            max_quality=self.MAX_QUALITY
+        )
+        return encoded.data
@@ -1,13 +1,17 @@
-from dataclasses import dataclass, is_dataclass, field
+from dataclasses import dataclass, field, replace
 from itertools import combinations, chain
 import random
-from typing import List, Tuple, Dict
+from typing import List, Optional, Tuple, Dict
 import json
 
+import numpy as np
 import trueskill
 from trueskill import Rating, BETA, SIGMA, MU
 import math
 
+from .matchmaking import balanced_splits
+from .probability import evaluate_matches, win_probabilities
+
 
 PLAYERS_FILE = "db/dgvgk/ladder/players.json"
 ENV_FILE = "db/dgvgk/ladder/env.json"
@@ -15,6 +19,25 @@ ENV_FILE = "db/dgvgk/ladder/env.json"
 DEFAULT_MU = MU
 DEFAULT_SIGMA = SIGMA
 
+# TrueSkill environment parameters saved in ENV_FILE
+ENV_PARAMS = ("mu", "sigma", "beta", "tau", "draw_probability")
+
+
+def get_env_params(mu: Optional[float]=None, sigma: Optional[float]=None) -> Dict[str, float]:
+    """Parameters of the global TrueSkill environment, with `mu` and `sigma`
+    replaced if given. A new `sigma` also scales `beta` and `tau` like
+    TrueSkill's defaults do (σ/2 and σ/100).
+
+    Saved to `ENV_FILE` as is, so ratings computed with these parameters
+    match the environment every later match is rated in."""
+    env = trueskill.global_env()
+    params = {param: getattr(env, param) for param in ENV_PARAMS}
+    if mu is not None:
+        params["mu"] = mu
+    if sigma is not None:
+        params.update(sigma=sigma, beta=sigma / 2, tau=sigma / 100)
+    return params
+
 
 def load_env() -> None:
     env = None
@@ -27,7 +50,8 @@ def load_env() -> None:
         print(f"Failed to read '{ENV_FILE}'")
     finally:
         if env:
-            trueskill.setup(mu=env["mu"], sigma=env["sigma"])
+            # Files saved before beta, tau etc. were stored only have mu and sigma
+            trueskill.setup(**{param: env[param] for param in ENV_PARAMS if param in env})
         else:
             trueskill.setup(mu=DEFAULT_MU, sigma=DEFAULT_SIGMA)
 
@@ -61,21 +85,13 @@ class Match:
     team1: List[Player] = field(default_factory=list)
     team2: List[Player] = field(default_factory=list)
     win_probability: float = 0.0
+    quality: float = 0.0 # TrueSkill match quality (draw probability)
 
 
-def dump_players(players: Dict[int, Player]) -> None:
-    class EnhancedJSONEncoder(json.JSONEncoder):
-        def default(self, o):
-            if is_dataclass(o):
-                return o.asdict()
-            return super().default(o)
-
-    with open("db/dgvgk/ladder/players.json", "w") as f:
-        json.dump(players, f, cls=EnhancedJSONEncoder, indent=4)
-
-
-def load_players() -> Dict[int, Player]:
-    with open(PLAYERS_FILE, "r") as f:
+def load_players(path: str=PLAYERS_FILE) -> Dict[int, Player]:
+    """Reads players from the old JSON file. Players are stored in the
+    database now, this is only used to migrate them."""
+    with open(path, "r") as f:
         players = json.load(f)
 
     return {
@@ -93,65 +109,99 @@ def load_players() -> Dict[int, Player]:
     }
 
 
-def make_teams(players: Dict[int, Player], team_size: int=4) -> Match:
-    """
-    Tries to find the most balanced team combination.
-    I am literally the worst at math.
+def make_teams(players: Dict[int, Player], team_size: Optional[int]=None) -> Match:
+    """Finds the most balanced team combination."""
+    return find_matches(players, team_size)[0]
+
+
+def find_matches(players: Dict[int, Player], team_size: Optional[int]=None, top_k: int=1) -> List[Match]:
+    """Finds the `top_k` most balanced ways to split players into two teams.
+
+    Parameters
+    ----------
+    players : `Dict[int, Player]`
+        Players in the lobby. Everyone plays.
+    team_size : `Optional[int]`, optional
+        Players per team, by default half of the players
+    top_k : `int`, optional
+        Number of matches to return, by default 1
+
+    Raises
+    ------
+    `ValueError`
+        Raised if the players can't be split into two teams of `team_size`
+
+    Returns
+    -------
+    `List[Match]`
+        Matches, most balanced first
     """
-    p = sorted([p for p in players.values()], key=lambda p: p.rating)
-    comb = list(combinations(p, team_size))
+    p = sorted(players.values(), key=lambda p: p.rating)
+    if team_size is not None and team_size * 2 != len(p):
+        raise ValueError(f"Cannot make two teams of {team_size} from {len(p)} players")
+
+    mu = np.array([player.rating.mu for player in p])
+    sigma = np.array([player.rating.sigma for player in p])
+    splits, _ = balanced_splits(mu, top_k)
+    probabilities, qualities = evaluate_matches(mu, sigma, splits)
 
     matches = []
-    # Brute-force, because we are stupid like that
-    for pt1 in comb:
-        for pt2 in comb:
-            if len(list(set(p.uid for p in pt1+pt2))) == len(comb[0]) * 2:     
-                prob = win_probability(pt1, pt2)
-                matches.append(Match(team1=pt1, team2=pt2, win_probability=prob))
-    best = min(matches, key=lambda g: abs(g.win_probability-0.5))
-    return best
-
-
-def rate(winners: List[Player], losers: List[Player]) -> Tuple[List[Player], List[Player]]:
-    w = {p.uid: p.rating for p in winners}
-    l = {p.uid: p.rating for p in losers}
-
-    w, l = trueskill.rate([w, l], ranks=[0, 1])
-
-    update_rating(w, l)
-    
-    return winners, losers
-
-
-def update_rating(winners: Dict[int, Player], losers: Dict[int, Player]) -> None:
-    players = load_players()
-    def update(team: Dict[int, Player], win: bool=True):
-        for uid, rating in team.items():
-            if uid not in players:
-                players[uid] = Player(uid=uid, rating=rating)
-            else:
-                players[uid].rating = rating
-            
-            if win:
-                players[uid].wins += 1
-            else:
-                players[uid].losses += 1
-    
-    update(winners)
-    update(losers, win=False)
-    dump_players(players)
-
-
-def win_probability(team1, team2):
-    """Ripped from trueskill.org"""
-    team1r = [p.rating for p in team1]
-    team2r = [p.rating for p in team2]
-    delta_mu = sum(r.mu for r in team1r) - sum(r.mu for r in team2r)
-    sum_sigma = sum(r.sigma ** 2 for r in chain(team1r, team2r))
-    size = len(team1r) + len(team2r)
-    denom = math.sqrt(size * (BETA * BETA) + sum_sigma)
-    ts = trueskill.global_env()
-    return ts.cdf(delta_mu / denom)
+    for team1, prob, quality in zip(splits, probabilities, qualities):
+        in_team1 = set(team1.tolist())
+        t1 = [p[i] for i in sorted(in_team1)]
+        t2 = [player for i, player in enumerate(p) if i not in in_team1]
+        matches.append(Match(team1=t1, team2=t2, win_probability=float(prob), quality=float(quality)))
+    return matches
+
+def rate(team1: List[Player], team2: List[Player], winner: int) -> Tuple[List[Player], List[Player]]:
+    """Rates the result of a match. The players passed in are left untouched.
+
+    Parameters
+    ----------
+    team1 : `List[Player]`
+        Players of team 1
+    team2 : `List[Player]`
+        Players of team 2
+    winner : `int`
+        Winning team, 1 or 2. 0 is a draw.
+
+    Returns
+    -------
+    `Tuple[List[Player], List[Player]]`
+        Copies of both teams' players with updated ratings and records
+    """
+    if winner not in (0, 1, 2):
+        raise ValueError(f"Invalid winner {winner}")
+    ranks = [0, 0] if winner == 0 else [winner - 1, 2 - winner]
+    r1, r2 = trueskill.rate(
+        [[p.rating for p in team1], [p.rating for p in team2]],
+        ranks=ranks
+    )
+
+    def update(team: List[Player], ratings: List[Rating], n: int) -> List[Player]:
+        return [
+            replace(
+                p,
+                rating=rating,
+                wins=p.wins + (winner == n),
+                losses=p.losses + (winner not in (0, n)),
+                draws=p.draws + (winner == 0),
+            )
+            for p, rating in zip(team, ratings)
+        ]
+
+    return update(team1, r1, 1), update(team2, r2, 2)
+
+
+def win_probability(team1: List[Player], team2: List[Player]) -> float:
+    """Win probability of team 1. Use `probability.win_probabilities`
+    directly to evaluate many matches at once."""
+    ratings = [p.rating for p in chain(team1, team2)]
+    mu = np.array([r.mu for r in ratings])
+    sigma = np.array([r.sigma for r in ratings])
+    t1 = np.arange(len(team1))
+    t2 = np.arange(len(team1), len(ratings))
+    return float(win_probabilities(mu, sigma, t1, t2)[0])
 
 
 def get_new_player(uid: int) -> Player:
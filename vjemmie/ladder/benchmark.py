@@ -0,0 +1,48 @@
+"""
+Benchmarks for the matchmaker, from 4v4 to 12v12.
+
+Run with `python -m vjemmie.ladder.benchmark`.
+"""
+import timeit
+from typing import Callable, Optional
+
+import numpy as np
+
+from . import matchmaking
+from .matchmaking import _all_splits, _meet_in_the_middle, balanced_splits, n_splits
+
+TEAM_SIZES = range(4, 13)
+TOP_K = 5
+EXHAUSTIVE_MAX_TEAM_SIZE = 10 # 11v11 and up allocate too much memory when evaluated exhaustively
+
+
+def _time(func: Callable[[], object], repeat: int=5) -> float:
+    """Best of `repeat` runs, in milliseconds."""
+    number = 1
+    while timeit.timeit(func, number=number) < 0.2 and number < 1000:
+        number *= 10
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number * 1000
+
+
+def _exhaustive(mu: np.ndarray) -> None:
+    team1 = _all_splits(len(mu))
+    np.abs(2 * mu[team1].sum(axis=1) - mu.sum()).argmin()
+
+
+def run(seed: int=0) -> None:
+    rng = np.random.RandomState(seed)
+    print(f"{'Teams':>7} {'Splits':>10} {'Exhaustive':>12} {'MITM':>10} {'Default':>10}")
+    for k in TEAM_SIZES:
+        mu = rng.normal(25, 8, 2 * k)
+        exhaustive: Optional[float] = None
+        if k <= EXHAUSTIVE_MAX_TEAM_SIZE:
+            exhaustive = _time(lambda: _exhaustive(mu))
+        mitm = _time(lambda: _meet_in_the_middle(mu, TOP_K))
+        default = _time(lambda: balanced_splits(mu, TOP_K))
+        ex = f"{exhaustive:.2f}ms" if exhaustive is not None else "-"
+        print(f"{k:>3}v{k:<3} {n_splits(2 * k):>10} {ex:>12} {mitm:>8.2f}ms {default:>8.2f}ms")
+    print(f"Exhaustive search is used for up to {matchmaking.BRUTE_FORCE_LIMIT} splits.")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,119 @@
+"""
+Line chart of inhouse ratings over time, drawn with PIL.
+"""
+import io
+from typing import Dict, List, Sequence, Tuple
+
+from PIL import Image, ImageDraw, ImageFont
+
+FONT_PATH = "memes/fonts/LiberationSans-Regular.ttf"
+FONT_SIZE = 14
+
+BACKGROUND = (47, 49, 54)
+FOREGROUND = (220, 221, 222)
+GRID = (70, 73, 79)
+COLORS = [
+    (88, 101, 242), (237, 66, 69), (87, 242, 135), (254, 231, 92),
+    (235, 69, 158), (52, 152, 219), (230, 126, 34), (155, 89, 182),
+    (26, 188, 156), (149, 165, 166),
+]
+
+MARGIN = (60, 20, 20, 40) # Left, top, right, bottom
+Y_TICKS = 5
+
+
+def _get_font() -> ImageFont.ImageFont:
+    try:
+        return ImageFont.truetype(FONT_PATH, FONT_SIZE)
+    except OSError:
+        return ImageFont.load_default()
+
+
+def _text_size(draw: ImageDraw.ImageDraw, text: str, font: ImageFont.ImageFont) -> Tuple[int, int]:
+    left, top, right, bottom = draw.textbbox((0, 0), text, font=font)
+    return right - left, bottom - top
+
+
+def _ticks(lo: float, hi: float, n: int) -> List[float]:
+    """Up to `n` evenly spaced round values between `lo` and `hi`."""
+    span = max(hi - lo, 1)
+    step = 10 ** len(str(int(span / n))) / 10
+    for factor in (1, 2, 5, 10):
+        if span / (step * factor) <= n:
+            step *= factor
+            break
+    first = -(-lo // step) * step
+    return [first + i * step for i in range(int((hi - first) // step) + 1)]
+
+
+def draw_rating_chart(series: Dict[str, Sequence[Tuple[int, float]]],
+                      size: Tuple[int, int]=(800, 450)
+                      ) -> io.BytesIO:
+    """Draws a line per player of their rating after each of their matches.
+
+    Parameters
+    ----------
+    series : `Dict[str, Sequence[Tuple[int, float]]]`
+        Key: Label, Value: (match number, rating) points, in order
+    size : `Tuple[int, int]`, optional
+        Width and height of the image, by default (800, 450)
+
+    Returns
+    -------
+    `io.BytesIO`
+        PNG image
+    """
+    points = [p for s in series.values() for p in s]
+    if not points:
+        raise ValueError("No ratings to draw")
+
+    img = Image.new("RGB", size, BACKGROUND)
+    draw = ImageDraw.Draw(img)
+    font = _get_font()
+
+    left, top = MARGIN[0], MARGIN[1]
+    right, bottom = size[0] - MARGIN[2], size[1] - MARGIN[3]
+    x_lo, x_hi = min(p[0] for p in points), max(p[0] for p in points)
+    y_lo, y_hi = min(p[1] for p in points), max(p[1] for p in points)
+    pad = max((y_hi - y_lo) * 0.05, 1)
+    y_lo, y_hi = y_lo - pad, y_hi + pad
+    x_span = max(x_hi - x_lo, 1)
+
+    def to_xy(x: float, y: float) -> Tuple[float, float]:
+        return (
+            left + (x - x_lo) / x_span * (right - left),
+            bottom - (y - y_lo) / (y_hi - y_lo) * (bottom - top)
+        )
+
+    # Grid and axis labels
+    for y in _ticks(y_lo, y_hi, Y_TICKS):
+        _, py = to_xy(x_lo, y)
+        draw.line([(left, py), (right, py)], fill=GRID)
+        label = f"{y:.0f}"
+        w, h = _text_size(draw, label, font)
+        draw.text((left - w - 8, py - h / 2), label, font=font, fill=FOREGROUND)
+    for x in _ticks(x_lo, x_hi, 10):
+        px, _ = to_xy(x, y_lo)
+        label = f"{x:.0f}"
+        w, _ = _text_size(draw, label, font)
+        draw.text((px - w / 2, bottom + 6), label, font=font, fill=FOREGROUND)
+    draw.rectangle([left, top, right, bottom], outline=FOREGROUND)
+
+    # Lines, then a legend in the top left corner
+    for i, (label, s) in enumerate(series.items()):
+        color = COLORS[i % len(COLORS)]
+        xy = [to_xy(x, y) for x, y in s]
+        if len(xy) > 1:
+            draw.line(xy, fill=color, width=2)
+        for px, py in xy[-1:]:
+            draw.ellipse([px - 3, py - 3, px + 3, py + 3], fill=color)
+
+        _, h = _text_size(draw, label, font)
+        ly = top + 8 + i * (h + 6)
+        draw.rectangle([left + 8, ly, left + 8 + h, ly + h], fill=color)
+        draw.text((left + 14 + h, ly), label, font=font, fill=FOREGROUND)
+
+    out = io.BytesIO()
+    img.save(out, format="PNG")
+    out.seek(0)
+    return out
@@ -0,0 +1,135 @@
+"""
+Exact search for the most balanced ways to split a lobby into two teams.
+
+Every player in the lobby plays, so the sum of σ² over both teams is the same
+for every split. The TrueSkill win probability of team 1 is then a monotonic
+function of Δμ (sum of team 1's μ minus sum of team 2's μ) alone, and the most
+balanced splits are simply the ones with the smallest |Δμ|.
+
+Player 0 is always put on team 1, so each split is only considered once
+instead of twice (once per side). Small lobbies are evaluated exhaustively in
+a single NumPy pass. Larger lobbies use a meet-in-the-middle search over the
+subset sums of each half of the lobby, which is exact as well.
+"""
+import math
+from itertools import chain, combinations
+from typing import Tuple
+
+import numpy as np
+
+# Max number of splits evaluated exhaustively. Above this (8v8 and up),
+# meet-in-the-middle is faster.
+BRUTE_FORCE_LIMIT = 5000
+
+
+def n_splits(n: int) -> int:
+    """Number of ways to split `n` players into two equal teams."""
+    k = n // 2
+    return math.factorial(n - 1) // (math.factorial(k - 1) * math.factorial(n - k))
+
+
+def balanced_splits(mu: np.ndarray, top_k: int=1) -> Tuple[np.ndarray, np.ndarray]:
+    """Finds the `top_k` most balanced splits of a lobby into two equal teams.
+
+    Parameters
+    ----------
+    mu : `np.ndarray`
+        μ of each player, shape (n,). n must be even.
+    top_k : `int`, optional
+        Number of splits to return, by default 1
+
+    Raises
+    ------
+    `ValueError`
+        Raised if the number of players is odd or less than 2
+
+    Returns
+    -------
+    `Tuple[np.ndarray, np.ndarray]`
+        Player indices of team 1 for each split, shape (top_k, n/2),
+        and Δμ of each split. Most balanced split first.
+    """
+    mu = np.asarray(mu, dtype=np.float64)
+    n = len(mu)
+    if n < 2 or n % 2:
+        raise ValueError("Teams can only be made for an even number of players")
+    top_k = max(1, min(top_k, n_splits(n)))
+
+    if n_splits(n) <= BRUTE_FORCE_LIMIT:
+        team1 = _all_splits(n)
+    else:
+        team1 = _meet_in_the_middle(mu, top_k)
+
+    delta = 2 * mu[team1].sum(axis=1) - mu.sum()
+    best = _smallest(np.abs(delta), top_k)
+    return team1[best], delta[best]
+
+
+def _smallest(values: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the `k` smallest values, in ascending order."""
+    if k < len(values):
+        idx = np.argpartition(values, k - 1)[:k]
+    else:
+        idx = np.arange(len(values))
+    return idx[np.argsort(values[idx], kind="stable")]
+
+
+def _all_splits(n: int) -> np.ndarray:
+    """Team 1 of every split, shape (n_splits(n), n/2)."""
+    k = n // 2
+    m = n_splits(n)
+    rest = np.fromiter(
+        chain.from_iterable(combinations(range(1, n), k - 1)),
+        dtype=np.int16,
+        count=m * (k - 1)
+    ).reshape(m, k - 1)
+    return np.hstack([np.zeros((m, 1), dtype=np.int16), rest])
+
+
+def _subset_sums(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Sum and size of every subset of `values`. Subset i contains
+    value j if bit j of i is set."""
+    sums = np.zeros(1)
+    sizes = np.zeros(1, dtype=np.int64)
+    for v in values:
+        sums = np.concatenate([sums, sums + v])
+        sizes = np.concatenate([sizes, sizes + 1])
+    return sums, sizes
+
+
+def _meet_in_the_middle(mu: np.ndarray, top_k: int) -> np.ndarray:
+    """Team 1 of a set of splits that contains the `top_k` most balanced ones.
+
+    The lobby is cut into halves A (which contains player 0) and B. A team is a
+    subset of A plus a subset of B, and the best B-subsets for a given A-subset
+    are the ones whose sums are closest to what it needs to reach half of the
+    total μ. With the B-sums sorted, those are the `top_k` neighbours on each
+    side of the binary search position.
+    """
+    n = len(mu)
+    k = n // 2
+    h = n // 2
+    target = mu.sum() / 2
+
+    a_sums, a_sizes = _subset_sums(mu[:h])
+    b_sums, b_sizes = _subset_sums(mu[h:])
+    a_masks = np.arange(len(a_sums), dtype=np.int64)
+    b_masks = np.arange(len(b_sums), dtype=np.int64)
+
+    keys = []
+    for size in range(1, k + 1):
+        a = (a_sizes == size) & (a_masks & 1 == 1) # Player 0 is always on team 1
+        b = b_sizes == k - size
+        if not a.any() or not b.any():
+            continue
+        order = np.argsort(b_sums[b], kind="stable")
+        bs, bm = b_sums[b][order], b_masks[b][order]
+
+        pos = np.searchsorted(bs, target - a_sums[a])
+        cand = np.clip(pos[:, None] + np.arange(-top_k, top_k), 0, len(bs) - 1)
+        keys.append((a_masks[a][:, None] | (bm[cand] << h)).ravel())
+
+    # Clipping at the ends of the B-sums produces duplicates
+    keys = np.unique(np.concatenate(keys))
+    bits = (keys[:, None] >> np.arange(n)) & 1
+    return np.nonzero(bits)[1].reshape(-1, k).astype(np.int16)
@@ -0,0 +1,106 @@
+"""
+Batched TrueSkill win probability and match quality of two-team matches.
+
+Candidate matches are given as index matrices into arrays of player μ and σ,
+one row per match, so thousands of candidates are evaluated in one NumPy pass
+instead of one Python loop over `Rating` objects per match.
+"""
+from typing import Optional, Tuple
+
+import numpy as np
+import trueskill
+
+
+def erfc(x: np.ndarray) -> np.ndarray:
+    """Complementary error function. Same approximation as trueskill's
+    default backend, so results match `trueskill.global_env().cdf`."""
+    z = np.abs(x)
+    t = 1.0 / (1.0 + z / 2.0)
+    r = t * np.exp(-z * z - 1.26551223 + t * (1.00002368 + t * (
+        0.37409196 + t * (0.09678418 + t * (-0.18628806 + t * (
+            0.27886807 + t * (-1.13520398 + t * (1.48851587 + t * (
+                -0.82215223 + t * 0.17087277
+            )))
+        )))
+    )))
+    return np.where(x < 0, 2.0 - r, r)
+
+
+def cdf(x: np.ndarray) -> np.ndarray:
+    """Standard normal cumulative distribution function."""
+    return 0.5 * erfc(-x / np.sqrt(2))
+
+
+def complement(team1: np.ndarray, n: int) -> np.ndarray:
+    """Indices of the players that are not on team 1, for each row of `team1`."""
+    team1 = np.atleast_2d(team1)
+    mask = np.ones((len(team1), n), dtype=bool)
+    mask[np.arange(len(team1))[:, None], team1] = False
+    return np.nonzero(mask)[1].reshape(len(team1), -1)
+
+
+def evaluate_matches(mu: np.ndarray,
+                     sigma: np.ndarray,
+                     team1: np.ndarray,
+                     team2: Optional[np.ndarray]=None,
+                     beta: Optional[float]=None
+                     ) -> Tuple[np.ndarray, np.ndarray]:
+    """Computes win probability of team 1 and match quality of every candidate match.
+
+    Parameters
+    ----------
+    mu : `np.ndarray`
+        μ of each player, shape (n,)
+    sigma : `np.ndarray`
+        σ of each player, shape (n,)
+    team1 : `np.ndarray`
+        Player indices of team 1, shape (matches, team 1 size)
+    team2 : `Optional[np.ndarray]`, optional
+        Player indices of team 2, shape (matches, team 2 size),
+        by default every player that is not on team 1
+    beta : `Optional[float]`, optional
+        Skill-to-performance factor, by default β of the global trueskill environment
+
+    Returns
+    -------
+    `Tuple[np.ndarray, np.ndarray]`
+        Win probability of team 1 and match quality, shape (matches,)
+    """
+    mu = np.asarray(mu, dtype=np.float64)
+    sigma = np.asarray(sigma, dtype=np.float64)
+    team1 = np.atleast_2d(team1)
+    if team2 is None:
+        team2 = complement(team1, len(mu))
+    team2 = np.atleast_2d(team2)
+    if beta is None:
+        beta = trueskill.global_env().beta
+
+    delta_mu = mu[team1].sum(axis=1) - mu[team2].sum(axis=1)
+    sum_sigma = (sigma[team1] ** 2).sum(axis=1) + (sigma[team2] ** 2).sum(axis=1)
+    n_beta = (team1.shape[1] + team2.shape[1]) * beta ** 2
+    variance = n_beta + sum_sigma
+
+    win_probability = cdf(delta_mu / np.sqrt(variance))
+    quality = np.sqrt(n_beta / variance) * np.exp(-delta_mu ** 2 / (2 * variance))
+    return win_probability, quality
+
+
+def win_probabilities(mu: np.ndarray,
+                      sigma: np.ndarray,
+                      team1: np.ndarray,
+                      team2: Optional[np.ndarray]=None,
+                      beta: Optional[float]=None
+                      ) -> np.ndarray:
+    """Win probability of team 1 for every candidate match. See `evaluate_matches`."""
+    return evaluate_matches(mu, sigma, team1, team2, beta)[0]
+
+
+def match_quality(mu: np.ndarray,
+                  sigma: np.ndarray,
+                  team1: np.ndarray,
+                  team2: Optional[np.ndarray]=None,
+                  beta: Optional[float]=None
+                  ) -> np.ndarray:
+    """TrueSkill match quality (draw probability) of every candidate match.
+    See `evaluate_matches`."""
+    return evaluate_matches(mu, sigma, team1, team2, beta)[1]
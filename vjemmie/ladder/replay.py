@@ -0,0 +1,174 @@
+"""
+Recomputes every inhouse rating from the recorded match history.
+
+Used to see (and apply) what the ladder would look like under different
+TrueSkill environment parameters, and to get each player's rating over time.
+
+Every match is two teams, for which the TrueSkill factor graph has a closed
+form solution. Rating a match is then a handful of float operations instead
+of running `trueskill.rate`'s message passing schedule, which is over 10x
+faster (5000 5v5 matches take about 0.3s). Results are the same as
+`trueskill.rate`'s, up to floating point error.
+
+Replays only take plain tuples and floats, so they can be run in a worker process.
+"""
+import math
+from dataclasses import dataclass, field
+from typing import (Dict, Iterable, List, NamedTuple, Optional, Sequence, Set,
+                    Tuple)
+
+import trueskill
+
+from . import Player
+
+# (match ID, timestamp, winning team (0 is a draw), [(uid, team), ...])
+MatchRecord = Tuple[int, float, int, List[Tuple[int, int]]]
+# (μ, σ, wins, losses, draws) of a player before the first recorded match
+Seed = Tuple[float, float, int, int, int]
+
+
+class RatingPoint(NamedTuple):
+    match: int # Index of the match in the history, starting at 1
+    mu: float
+    sigma: float
+
+
+@dataclass
+class Replay:
+    players: Dict[int, Player] = field(default_factory=dict)
+    history: Dict[int, List[RatingPoint]] = field(default_factory=dict) # Key: Discord user ID
+
+
+def make_env(mu: Optional[float]=None,
+             sigma: Optional[float]=None,
+             beta: Optional[float]=None,
+             tau: Optional[float]=None,
+             draw_probability: Optional[float]=None
+             ) -> trueskill.TrueSkill:
+    """Creates a TrueSkill environment. Parameters that are not given
+    are taken from the global environment."""
+    env = trueskill.global_env()
+    return trueskill.TrueSkill(
+        mu=env.mu if mu is None else mu,
+        sigma=env.sigma if sigma is None else sigma,
+        beta=env.beta if beta is None else beta,
+        tau=env.tau if tau is None else tau,
+        draw_probability=env.draw_probability if draw_probability is None else draw_probability,
+    )
+
+
+def rate_two_teams(env: trueskill.TrueSkill,
+                   team1: Sequence[Tuple[float, float]],
+                   team2: Sequence[Tuple[float, float]],
+                   winner: int
+                   ) -> Tuple[List[Tuple[float, float]], List[Tuple[float, float]]]:
+    """Rates a match between two teams of (μ, σ) pairs. Same as
+    `env.rate` with two teams, without building a factor graph.
+
+    Parameters
+    ----------
+    env : `trueskill.TrueSkill`
+        Environment to rate the match in
+    team1 : `Sequence[Tuple[float, float]]`
+        (μ, σ) of each player on team 1
+    team2 : `Sequence[Tuple[float, float]]`
+        (μ, σ) of each player on team 2
+    winner : `int`
+        Winning team, 1 or 2. 0 is a draw.
+
+    Returns
+    -------
+    `Tuple[List[Tuple[float, float]], List[Tuple[float, float]]]`
+        New (μ, σ) of each player on both teams
+    """
+    # Skill uncertainty grows by τ between matches
+    var1 = [sigma ** 2 + env.tau ** 2 for _, sigma in team1]
+    var2 = [sigma ** 2 + env.tau ** 2 for _, sigma in team2]
+    n = len(team1) + len(team2)
+    c = math.sqrt(sum(var1) + sum(var2) + n * env.beta ** 2)
+    draw_margin = trueskill.calc_draw_margin(env.draw_probability, n, env) / c
+
+    # Performance difference is always measured from the winning team's side
+    sign = -1.0 if winner == 2 else 1.0
+    diff = sign * (sum(mu for mu, _ in team1) - sum(mu for mu, _ in team2)) / c
+    if winner == 0:
+        v, w = env.v_draw(diff, draw_margin), env.w_draw(diff, draw_margin)
+    else:
+        v, w = env.v_win(diff, draw_margin), env.w_win(diff, draw_margin)
+
+    def update(team: Sequence[Tuple[float, float]], var: List[float], direction: float) -> List[Tuple[float, float]]:
+        return [
+            (mu + direction * s2 / c * v, math.sqrt(s2 * (1 - s2 / c ** 2 * w)))
+            for (mu, _), s2 in zip(team, var)
+        ]
+
+    return update(team1, var1, sign), update(team2, var2, -sign)
+
+
+def replay(matches: Iterable[MatchRecord],
+           mu: Optional[float]=None,
+           sigma: Optional[float]=None,
+           beta: Optional[float]=None,
+           tau: Optional[float]=None,
+           draw_probability: Optional[float]=None,
+           uids: Optional[Iterable[int]]=None,
+           seeds: Optional[Dict[int, Seed]]=None
+           ) -> Replay:
+    """Rates every match from scratch, in the order they were played.
+
+    Parameters
+    ----------
+    matches : `Iterable[MatchRecord]`
+        Match history, oldest first
+    mu, sigma, beta, tau, draw_probability : `Optional[float]`, optional
+        Environment parameters, see `make_env`
+    uids : `Optional[Iterable[int]]`, optional
+        Players to keep the rating history of, by default everyone
+    seeds : `Optional[Dict[int, Seed]]`, optional
+        Ratings and records players start from instead of the environment's
+        default rating, such as those of players migrated from the old JSON file.
+        Used as is, regardless of `mu` and `sigma`. Key: Discord user ID
+
+    Returns
+    -------
+    `Replay`
+        Every player's final rating and record, and the rating history
+        of the requested players. Players who have never played a recorded
+        match are not included, even if they have a seed.
+    """
+    env = make_env(mu, sigma, beta, tau, draw_probability)
+    keep = set(uids) if uids is not None else None
+
+    seeds = seeds or {}
+    ratings: Dict[int, Tuple[float, float]] = {uid: seed[:2] for uid, seed in seeds.items()}
+    records: Dict[int, List[int]] = {uid: list(seed[2:]) for uid, seed in seeds.items()} # Key: uid, Value: [wins, losses, draws]
+    played: Set[int] = set() # Players with recorded matches
+    history: Dict[int, List[RatingPoint]] = {}
+    default = (env.mu, env.sigma)
+
+    for i, (_, _, winner, participants) in enumerate(matches, 1):
+        teams: Tuple[List[int], List[int]] = ([], [])
+        for uid, team in participants:
+            teams[team - 1].append(uid)
+        new1, new2 = rate_two_teams(
+            env,
+            [ratings.get(uid, default) for uid in teams[0]],
+            [ratings.get(uid, default) for uid in teams[1]],
+            winner
+        )
+
+        for n, team, new in [(1, teams[0], new1), (2, teams[1], new2)]:
+            for uid, rating in zip(team, new):
+                played.add(uid)
+                ratings[uid] = rating
+                record = records.setdefault(uid, [0, 0, 0])
+                record[0 if winner == n else 2 if winner == 0 else 1] += 1
+                if keep is None or uid in keep:
+                    history.setdefault(uid, []).append(RatingPoint(i, *rating))
+
+    players = {
+        uid: Player(uid, env.create_rating(*ratings[uid]), *records[uid])
+        for uid in ratings
+        if uid in played
+    }
+    return Replay(players=players, history=history)
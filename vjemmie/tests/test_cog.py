@@ -9,26 +9,50 @@ It's pretty fucking bad, let's be real, but it gets the job done.
 import asyncio
 import copy
 import inspect
+import json
+import math
 import operator
+import tempfile
+import threading
 import time
 import traceback
 from contextlib import contextmanager
 from functools import partial, wraps
-from itertools import cycle
+from itertools import combinations, cycle
 from pathlib import Path
 from typing import (Any, Awaitable, Callable, ContextManager, Coroutine,
-                    Optional, TypeVar)
+                    FrozenSet, Optional, Tuple, TypeVar)
 from unittest.mock import Mock
 
 import discord
+import numpy as np
+import trueskill
 from aiofile import AIOFile
+from aiohttp import web
 from discord.ext import commands
 
 from ..cogs.base_cog import BaseCog
+from ..db.db import DatabaseConnection
+from ..ladder import Player, get_env_params
+from ..ladder.matchmaking import balanced_splits
+from ..ladder.probability import evaluate_matches
+from ..ladder.replay import replay
+from ..utils import caching
+from ..utils.access_control import AccessControl, Categories
 from ..utils.checks import owners_only, test_server_cmd
+from ..utils.commands import CommandDef, CommandRegistry, bind_kwargs
+from ..utils.concurrency import RateLimiter
 from ..utils.exceptions import CommandError
+from ..utils.help import HelpIndex
+from ..utils.images import scale_to_pixels, split_rows
+from ..utils.json import JSONWriter, dump_json, flush
+from ..utils.markov import MarkovStore, SentencePool
 from ..utils.messaging import ask_user_yes_no
+from ..utils.output import Sender, pack_embeds, split_lines
+from ..utils.reddit import (IMAGE, TEXT, Forbidden, NotFound, Post,
+                            RedditClient, RedditSubmissions, make_key)
 from ..utils.time import format_time
+from ..utils.twitter import TIMELINE_PATH, TimelineFetcher
 
 SENTINEL = object() # Shouldn't strictly be called "sentinel", but it's not a None-value either...
 DEFAULT_OPERATOR = operator.eq
@@ -429,6 +453,11 @@ class TestCog(BaseCog):
         """AvatarCog command where `template_overlay == True`"""
         await self.do_test_command(ctx, "mlady")
 
+    @discord_io
+    async def test_avatarcog_batchavatar(self, ctx: commands.Context) -> None:
+        """AvatarCog batch command with more users than avatar placements"""
+        await self.do_test_command(ctx, "batchavatar", "autism2", ctx.message.author, self.bot.user, ctx.message.author)
+
     # FunCog
     async def test_funcog_roll_1_100(self, ctx: commands.Context) -> None:
         await self.do_test_command(ctx, "roll", 1, 100)
@@ -482,6 +511,124 @@ class TestCog(BaseCog):
     async def test_redditcog_subs(self, ctx: commands.Context) -> None:
         await self.do_test_command(ctx, "reddit subs")
 
+    async def test_reddit_reset_seen(self, ctx: commands.Context) -> None:
+        async def fetch(key):
+            return []
+        with tempfile.TemporaryDirectory() as tmp:
+            submissions = RedditSubmissions(fetch, f"{tmp}/listings.json", f"{tmp}/seen.json")
+            key = make_key("test", "top", "all")
+            submissions.add(key, [
+                Post("i1", "", "https://example.com/1.png", "", None, False, False),
+                Post("t1", "", "", "text", None, False, False),
+                Post("t2", "", "", "text", None, False, False),
+            ])
+            assert submissions.pop_unseen(1, key, (IMAGE,)).id == "i1"
+            assert submissions.pop_unseen(1, key, (TEXT,)) is not None
+            assert submissions.pop_unseen(1, key, (IMAGE,)) is None
+
+            # Resetting image posts keeps text progress
+            assert submissions.reset_seen(1, key, (IMAGE,))
+            assert submissions.pop_unseen(1, key, (IMAGE,)).id == "i1"
+            assert len(submissions.unseen(1, key)) == 1
+            # Nothing to reset if the listing has no posts of a kind
+            submissions.add(key, [Post("t3", "", "", "text", None, False, False)])
+            assert not submissions.reset_seen(1, key, (IMAGE,))
+
+            # NSFW posts are left for channels that allow them
+            submissions.add(key, [
+                Post("n1", "", "", "nsfw", None, False, True),
+                Post("t4", "", "", "text", None, False, False),
+            ])
+            assert submissions.pop_unseen(2, key, (TEXT,), allow_nsfw=False).id == "t4"
+            assert submissions.pop_unseen(2, key, (TEXT,), allow_nsfw=False) is None
+            assert submissions.pop_unseen(2, key, (TEXT,)).id == "n1"
+
+    async def test_reddit_extend(self, ctx: commands.Context) -> None:
+        def make_posts(start, stop):
+            return [Post(f"p{i}", "", "", "text", None, False, False) for i in range(start, stop)]
+
+        calls = []
+        async def fetch(key):
+            return make_posts(0, 3)
+        async def fetch_more(listing, limit):
+            calls.append(limit)
+            await asyncio.sleep(0)
+            start = len(listing.posts)
+            return make_posts(start, min(start + limit, 8))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            submissions = RedditSubmissions(fetch, f"{tmp}/listings.json", f"{tmp}/seen.json")
+            key = make_key("test", "top", "all")
+            # Concurrent calls share a fetch
+            listings = await asyncio.gather(*(submissions.extend(key, 6, fetch_more) for _ in range(3)))
+            assert calls == [3] and all(len(listing.posts) == 6 for listing in listings)
+            await submissions.extend(key, 5, fetch_more)
+            assert calls == [3] # Already long enough
+
+            # Added posts survive a refresh of the listing and a restart
+            listing = await submissions.get(key, force=True)
+            assert [post.id for post in listing.posts] == [f"p{i}" for i in range(6)]
+            submissions.save_blocking()
+            submissions = RedditSubmissions(fetch, f"{tmp}/listings.json", f"{tmp}/seen.json")
+            submissions.load()
+            assert submissions.listings[key].extra == 3
+
+    async def test_reddit_client_fake_server(self, ctx: commands.Context) -> None:
+        # Fake listing of 250 posts, served 100 per page
+        posts = [f"p{i}" for i in range(250)]
+        tokens = []
+
+        async def access_token(request: web.Request) -> web.Response:
+            tokens.append(1)
+            return web.json_response({"access_token": "token", "expires_in": 3600})
+
+        async def listing(request: web.Request) -> web.Response:
+            assert request.headers["Authorization"] == "bearer token"
+            sub = request.match_info["sub"]
+            if sub == "private":
+                return web.Response(status=403)
+            if sub == "missing":
+                raise web.HTTPFound("/subreddits/search")
+            after = request.query.get("after")
+            start = posts.index(after) + 1 if after else 0
+            page = posts[start:start + int(request.query["limit"])]
+            return web.json_response(
+                {
+                    "data": {
+                        "after": page[-1] if start + len(page) < len(posts) else None,
+                        "children": [
+                            {"kind": "t3", "data": {"id": i, "title": i, "url": f"https://i.redd.it/{i}.png"}}
+                            for i in page
+                        ],
+                    }
+                },
+                headers={"X-Ratelimit-Remaining": "100", "X-Ratelimit-Reset": "60"}
+            )
+
+        app = web.Application()
+        app.router.add_post("/api/v1/access_token", access_token)
+        app.router.add_get("/r/{sub}/{sorting}", listing)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", 0).start()
+        url = f"http://127.0.0.1:{runner.addresses[0][1]}"
+
+        try:
+            client = RedditClient("id", "secret", "test", api_url=url, auth_url=f"{url}/api/v1/access_token")
+            result = await client.listing("fake", "top", "all", limit=1000)
+            assert [p.id for p in result] == posts
+            assert len(tokens) == 1 # Token is reused between pages
+            assert client._remaining == 100 # Quota is read from response headers
+            for sub, exc in [("private", Forbidden), ("missing", NotFound)]:
+                try:
+                    await client.listing(sub, "hot")
+                except exc:
+                    pass
+                else:
+                    raise TestError(f"Expected {exc.__name__} for r/{sub}")
+        finally:
+            await runner.cleanup()
+
     # SoundCog
     @voice
     async def test_soundcog_connect(self, ctx: commands.Context) -> None:
@@ -581,6 +728,98 @@ class TestCog(BaseCog):
     async def test_twittercog_users(self, ctx: commands.Context) -> None:
         await self.do_test_command(ctx, "twitter users")
 
+    def _get_twitter_cog_with_db(self) -> Tuple[commands.Cog, DatabaseConnection]:
+        """Copy of TwitterCog that uses an empty in-memory database."""
+        db = DatabaseConnection(":memory:", self.bot)
+        with open("db/vjemmie.db.sql", "r") as f:
+            db.cursor.executescript(f.read())
+        twitter_cog = copy.copy(self.bot.get_cog("TwitterCog"))
+        twitter_cog.db = db
+        twitter_cog.users = {}
+        twitter_cog.tweet_ids = {}
+        return twitter_cog, db
+
+    async def test_twitter_db_save_fetch(self, ctx: commands.Context) -> None:
+        _, db = self._get_twitter_cog_with_db()
+        await db.twitter_add_user("fake", 1)
+        tweets = [(2, "https://twitter.com/fake/status/2", "b"), (1, "https://twitter.com/fake/status/1", "a")]
+        assert sorted(await db.twitter_save_fetch("fake", tweets, 2, 1, False)) == [1, 2]
+        # Tweets that are already stored are not added again
+        assert await db.twitter_save_fetch("fake", tweets, 2, 1, True) == []
+        assert sorted(await db.twitter_get_tweet_ids("fake")) == [1, 2]
+        assert await db.twitter_get_cursor("fake") == (2, 1, True)
+
+    async def test_twitter_migrate_users_file(self, ctx: commands.Context) -> None:
+        twitter_cog, db = self._get_twitter_cog_with_db()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "users.json"
+            with open(path, "w") as f:
+                json.dump({
+                    "fake": [
+                        "fake", 123.0,
+                        [
+                            ["https://twitter.com/fake/status/1", "a"],
+                            ["https://twitter.com/fake/status/2?s=20", "b"],
+                            ["https://twitter.com/fake/status/3/", "c"],
+                            ["https://twitter.com/fake", "not a tweet"],
+                        ],
+                        ["f"],
+                    ]
+                }, f)
+            twitter_cog.migrate_users_file(str(path))
+
+            # File is only migrated once
+            assert not path.exists() and path.with_suffix(".json.migrated").exists()
+            twitter_cog.migrate_users_file(str(path))
+
+        assert await db.twitter_get_users() == [("fake", 123.0)]
+        assert await db.twitter_get_aliases() == [("f", "fake")]
+        assert sorted(await db.twitter_get_tweet_ids("fake")) == [1, 2, 3]
+
+    async def test_twitter_random_tweet(self, ctx: commands.Context) -> None:
+        twitter_cog, db = self._get_twitter_cog_with_db()
+        await db.twitter_add_user("fake", 1)
+        assert await twitter_cog.get_random_tweet("fake") is None
+        await db.twitter_add_tweets("fake", [(1, "https://twitter.com/fake/status/1", "a")])
+        twitter_cog.tweet_ids = {}
+        assert (await twitter_cog.get_random_tweet("fake")).text == "a"
+
+    async def test_twitter_fetcher_fake_server(self, ctx: commands.Context) -> None:
+        # Fake timeline of 45 tweets, newest first, served 20 per page
+        timeline = list(range(145, 100, -1))
+
+        async def timeline_page(request: web.Request) -> web.Response:
+            max_position = int(request.query.get("max_position", 0))
+            ids = [i for i in timeline if not max_position or i < max_position][:20]
+            items = "".join(
+                f'<li class="stream-item" data-item-id="{i}"><p class="tweet-text">tweet {i}</p></li>'
+                for i in ids
+            )
+            return web.json_response({"items_html": items, "has_more_items": len(ids) == 20})
+
+        app = web.Application()
+        app.router.add_get(TIMELINE_PATH.format(user="fake"), timeline_page)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", 0).start()
+        port = runner.addresses[0][1]
+
+        try:
+            fetcher = TimelineFetcher(f"http://127.0.0.1:{port}", pages=2, limiter=RateLimiter(100, burst=10))
+
+            # New user: first 2 pages
+            result = await fetcher.fetch("fake")
+            assert [t[0] for t in result.tweets] == list(range(145, 105, -1))
+            assert (result.cursor.newest, result.cursor.oldest, result.cursor.exhausted) == (145, 106, False)
+
+            # New tweet: stop at stored tweets, then continue from the oldest one
+            timeline.insert(0, 146)
+            result = await fetcher.fetch("fake", result.cursor)
+            assert sorted(t[0] for t in result.tweets) == [101, 102, 103, 104, 105, 146]
+            assert (result.cursor.newest, result.cursor.oldest, result.cursor.exhausted) == (146, 101, True)
+        finally:
+            await runner.cleanup()
+
     # UserCog
     async def test_usercog_help(self, ctx: commands.Context) -> None:
         await self.do_test_command(ctx, "help")
@@ -624,6 +863,392 @@ class TestCog(BaseCog):
         assert format_time(3600 * 24) == "1d"
         assert format_time(3600 * 24 + 1) == "1d 01s"
 
+    # Images
+
+    async def test_images_scale_to_pixels(self, ctx: commands.Context) -> None:
+        assert scale_to_pixels(4000, 3000, 240_000) == (565, 424)
+        assert scale_to_pixels(100, 100, 240_000) == (100, 100)
+        assert scale_to_pixels(100, 100, 240_000, upscale=True) == (489, 489)
+        w, h = scale_to_pixels(8000, 10, 1000)
+        assert w * h <= 1000 and h >= 1
+
+    async def test_images_split_rows(self, ctx: commands.Context) -> None:
+        assert split_rows(1800, 2000, 150) == [(0, 1800)]
+        assert split_rows(5000, 2000, 200) == [(0, 2000), (1800, 3800), (3600, 5000)]
+        assert split_rows(3800, 2000, 200) == [(0, 2000), (1800, 3800)]
+
+    async def test_imagecog_merge_tile_text(self, ctx: commands.Context) -> None:
+        cog = self.bot.get_cog("ImageCog")
+        merged = cog.merge_tile_text(["foo\nbar\nbaz\n", "baz\nqux\n"])
+        assert merged == "foo\nbar\nbaz\nqux"
+        # A single band is formatted the same way
+        assert cog.merge_tile_text([" foo\n\nbar \n"]) == "foo\nbar"
+
+    # Ladder
+
+    async def test_ladder_balanced_splits(self, ctx: commands.Context) -> None:
+        rng = np.random.RandomState(0)
+        for n in (2, 8, 18):
+            mu = rng.normal(25, 8, n)
+            # Reference: every split, including both sides of each
+            total = mu.sum()
+            ref = sorted(abs(2 * mu[list(c)].sum() - total) for c in combinations(range(n), n // 2))[:10:2]
+            team1, delta = balanced_splits(mu, top_k=5)
+            assert np.allclose(np.abs(delta), ref[:len(delta)])
+            assert all(0 in t and len(set(t.tolist())) == n // 2 for t in team1)
+
+    async def test_ladder_evaluate_matches(self, ctx: commands.Context) -> None:
+        rng = np.random.RandomState(0)
+        mu, sigma = rng.normal(25, 5, 6), rng.uniform(2, 8, 6)
+        team1 = np.array([[0, 1, 2], [0, 3, 5]])
+        probabilities, qualities = evaluate_matches(mu, sigma, team1)
+        for t1, prob, quality in zip(team1, probabilities, qualities):
+            r1 = [trueskill.Rating(mu[i], sigma[i]) for i in t1]
+            r2 = [trueskill.Rating(mu[i], sigma[i]) for i in range(6) if i not in t1]
+            assert math.isclose(quality, trueskill.quality([r1, r2]))
+            env = trueskill.global_env()
+            delta_mu = sum(r.mu for r in r1) - sum(r.mu for r in r2)
+            denom = math.sqrt(6 * env.beta ** 2 + sum(r.sigma ** 2 for r in r1 + r2))
+            assert math.isclose(prob, env.cdf(delta_mu / denom))
+
+    async def test_ladder_record_match(self, ctx: commands.Context) -> None:
+        db = DatabaseConnection(":memory:", self.bot)
+        with open("db/vjemmie.db.sql", "r") as f:
+            db.cursor.executescript(f.read())
+        await db.ladder_add_players([Player(1, trueskill.Rating(30, 4), wins=3)])
+
+        team1, team2 = await db.ladder_record_match([1, 2], [3, 4], 1)
+        assert team1[0].wins == 4 and team1[1].wins == 1 and team2[0].losses == 1
+        assert team1[0].rating.mu > 30 and team2[0].rating.mu < trueskill.Rating().mu
+        players = await db.ladder_get_players([1, 3, 5])
+        assert sorted(players) == [1, 3] and players[1] == team1[0]
+
+        # Failed writes leave no partial match behind
+        try:
+            await db.ladder_record_match([1], [2], 3)
+        except ValueError:
+            pass
+        matches = await db.ladder_get_matches()
+        assert len(matches) == 1 and matches[0][2] == 1 and len(matches[0][3]) == 4
+
+    async def test_ladder_reset(self, ctx: commands.Context) -> None:
+        db = DatabaseConnection(":memory:", self.bot)
+        with open("db/vjemmie.db.sql", "r") as f:
+            db.cursor.executescript(f.read())
+        migrated = Player(1, trueskill.Rating(40, 3), wins=10)
+        db._ladder_add_players([migrated])
+        db._ladder_add_seeds([migrated])
+        await db.ladder_record_match([1, 2], [3, 4], 1)
+
+        # Replaying after a reset starts over from the default rating
+        assert await db.ladder_reset_players() == 4
+        assert await db.ladder_get_matches() == [] and await db.ladder_get_seeds() == {}
+        team1, team2 = await db.ladder_record_match([1, 3], [2, 4], 2)
+        seeds = await db.ladder_get_seeds()
+        result = replay(await db.ladder_get_matches(), seeds=seeds)
+        players = await db.ladder_get_players()
+        assert players[1].wins == 0 and players[1].losses == 1
+        for uid, player in result.players.items():
+            assert (player.wins, player.losses) == (players[uid].wins, players[uid].losses)
+            assert math.isclose(player.rating.mu, players[uid].rating.mu)
+
+    async def test_ladder_replay(self, ctx: commands.Context) -> None:
+        matches = [
+            (1, 0.0, 1, [(1, 1), (2, 1), (3, 2), (4, 2)]),
+            (2, 0.0, 2, [(1, 1), (3, 1), (2, 2), (4, 2)]),
+            (3, 0.0, 0, [(1, 1), (4, 1), (2, 2), (3, 2)]),
+        ]
+        result = replay(matches, mu=30, sigma=6, uids=[1])
+        assert [p.match for p in result.history[1]] == [1, 2, 3] and list(result.history) == [1]
+        assert (result.players[1].wins, result.players[1].losses, result.players[1].draws) == (1, 1, 1)
+
+        # Same ratings as trueskill's factor graph
+        env = trueskill.TrueSkill(mu=30, sigma=6)
+        r = {uid: env.create_rating() for uid in range(1, 5)}
+        for _, _, winner, participants in matches:
+            teams = [{u: r[u] for u, t in participants if t == n} for n in (1, 2)]
+            ranks = [0, 0] if winner == 0 else [winner - 1, 2 - winner]
+            for team in env.rate(teams, ranks=ranks):
+                r.update(team)
+        for uid, player in result.players.items():
+            assert math.isclose(player.rating.mu, r[uid].mu) and math.isclose(player.rating.sigma, r[uid].sigma)
+
+        # Seeded (migrated) players start from their seed instead of the default rating
+        seeded = replay(matches, mu=30, sigma=6, seeds={1: (40.0, 3.0, 10, 5, 0), 9: (20.0, 3.0, 1, 1, 0)})
+        assert seeded.history[1][0].mu > result.history[1][0].mu + 5
+        assert (seeded.players[1].wins, seeded.players[1].losses) == (11, 6)
+        assert 9 not in seeded.players # Never played a recorded match
+
+        # Replays use the same environment that is set up afterwards
+        params = get_env_params(30, 6)
+        assert (params["beta"], params["tau"]) == (3, 0.06)
+        current = get_env_params()
+        try:
+            trueskill.setup(**params)
+            assert get_env_params() == params
+            assert replay(matches, **params).players == replay(matches).players
+        finally:
+            trueskill.setup(**current)
+
+    # Commands
+
+    async def test_commands_registry(self, ctx: commands.Context) -> None:
+        async def echo(cog: commands.Cog, ctx: commands.Context, *, word: str) -> None:
+            await ctx.send(word)
+
+        registry = CommandRegistry(self, echo)
+        try:
+            registry.add(CommandDef("_registry_a", ["_registry_b"], kwargs={"word": "a"}))
+            assert registry.get("_registry_b").name == "_registry_a"
+            assert "word" not in self.bot.get_command("_registry_b").clean_params
+
+            # Unchanged definitions are left alone
+            cmd = self.bot.get_command("_registry_a")
+            added, removed, changed = registry.sync([
+                CommandDef("_registry_a", ["_registry_b"], kwargs={"word": "a"}),
+                CommandDef("_registry_c", kwargs={"word": "c"}),
+            ])
+            assert (added, removed, changed) == (["_registry_c"], [], [])
+            assert self.bot.get_command("_registry_a") is cmd
+
+            # Changed alias replaces only that command
+            registry.sync([
+                CommandDef("_registry_a", ["_registry_d"], kwargs={"word": "a"}),
+                CommandDef("_registry_c", kwargs={"word": "c"}),
+            ])
+            assert "_registry_b" not in registry and self.bot.get_command("_registry_b") is None
+            assert registry.get("_registry_d").name == "_registry_a"
+        finally:
+            registry.sync([])
+        assert self.bot.get_command("_registry_a") is None and not registry.index
+
+        # String annotations are resolved in the namespace of the callback
+        async def count(cog: "commands.Cog", ctx: "commands.Context", n: "int", *, word: str) -> None:
+            pass
+        params = inspect.signature(bind_kwargs(count, word="a")).parameters
+        assert list(params) == ["cog", "ctx", "n"] and params["n"].annotation is int
+
+    async def test_help_index(self, ctx: commands.Context) -> None:
+        async def echo(cog: commands.Cog, ctx: commands.Context, *, word: str) -> None:
+            await ctx.send(word)
+
+        index = HelpIndex(self.bot)
+        registry = CommandRegistry(self, echo)
+        try:
+            index.build()
+            before = len(await index.visible(ctx, self))
+            registry.add(CommandDef("_help_a", help="Help A", kwargs={"word": "a"}), persist=False)
+            registry.add(CommandDef("_help_b", kwargs={"word": "b"}), persist=False)
+
+            # Only the changed cog is reformatted, and cached masks are not reused
+            listing = await index.render(ctx, self, advanced=True)
+            assert "_help_a" in listing and "Help A" in listing and "_help_b" in listing
+            assert len(await index.visible(ctx, self)) == before + 2
+            assert await index.visible(ctx, self) is await index.visible(ctx, self)
+
+            registry.remove("_help_a", persist=False)
+            assert "_help_a" not in await index.render(ctx, self)
+        finally:
+            registry.sync([])
+            index.close()
+
+    async def test_access_control(self, ctx: commands.Context) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            access = AccessControl(f"{tmp}/trusted.json", f"{tmp}/blacklist.json")
+            changes = []
+            access.add_listener(lambda: changes.append(1))
+
+            access.add_trusted(1, 10, Categories.MEMBER)
+            access.add_trusted(1, 20, Categories.ROLE)
+            assert access.is_trusted(1, 10) and not access.is_trusted(1, 20)
+            assert not access.is_trusted(1, 99) and not access.is_trusted(2, 10)
+            assert access.add_blacklist(10) and not access.add_blacklist(10)
+            assert len(changes) == 3
+
+            # Changes are written to disk in the background
+            await flush()
+            reloaded = AccessControl(f"{tmp}/trusted.json", f"{tmp}/blacklist.json")
+            assert reloaded.is_blacklisted(10) and reloaded.get_trusted(1, Categories.ROLE) == {20}
+            reloaded.remove_trusted(1, 10, Categories.MEMBER)
+            try:
+                reloaded.remove_trusted(1, 10, Categories.MEMBER)
+            except ValueError:
+                pass
+            else:
+                raise AssertionError("Removing an untrusted member should fail")
+
+            # Unreadable files are never overwritten, until they are fixed
+            with open(f"{tmp}/blacklist.json", "w") as f:
+                f.write("[10, 11")
+            broken = AccessControl(f"{tmp}/trusted.json", f"{tmp}/blacklist.json")
+            assert not broken.is_blacklisted(10)
+            try:
+                broken.add_blacklist(12)
+            except CommandError:
+                pass
+            else:
+                raise AssertionError("Changing an unreadable blacklist should fail")
+            with open(f"{tmp}/blacklist.json", "w") as f:
+                f.write("[10, 11]")
+            assert broken.add_blacklist(12) and broken.get_blacklist() == {10, 11, 12}
+
+    async def test_caching(self, ctx: commands.Context) -> None:
+        lfu = caching.Cache(caching.Policy.LFU, max_items=2)
+        lfu.set("a", 1)
+        lfu.set("b", 2)
+        lfu.get("a")
+        lfu.set("c", 3) # Evicts "b", the least frequently used
+        assert "a" in lfu and "b" not in lfu and lfu.stats.evictions == 1
+
+        sized = caching.Cache(max_bytes=1000, sizeof=len)
+        for i in range(10):
+            sized.set(i, "x" * 300)
+        assert len(sized) == 3 and sized.nbytes == 900
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = f"{tmp}/test.json"
+            caching.configure("test_caching", revalidate=60)
+            await dump_json(path, {"a": 1})
+            assert caching.get_cached(path, "test_caching") == {"a": 1}
+            # Writing through utils.json invalidates the cached file
+            await dump_json(path, {"a": 2})
+            assert caching.get_cached(path, "test_caching") == {"a": 2}
+            assert caching.get_stats()["test_caching"].misses == 2
+
+            @caching.cached_loader(path, "test_caching")
+            def load_keys(contents: dict) -> FrozenSet[str]:
+                return frozenset(contents)
+            # Built once per version of the file
+            assert load_keys() is load_keys() == {"a"}
+            await dump_json(path, {"b": 1})
+            assert load_keys() == {"b"}
+
+        calls = []
+        @caching.memoize(max_items=10)
+        async def square(n: int) -> int:
+            calls.append(n)
+            return n * n
+        assert [await square(3), await square(3)] == [9, 9] and calls == [3]
+        square.cache_clear()
+        assert await square(3) == 9 and calls == [3, 3]
+
+    async def test_json_writer(self, ctx: commands.Context) -> None:
+        writer = JSONWriter()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = f"{tmp}/test.json"
+            # Concurrent writes to the same file are coalesced, and the newest one wins
+            await asyncio.gather(*[writer.write(path, {"n": n}) for n in range(10)])
+            with open(path) as f:
+                assert json.load(f) == {"n": 9}
+
+            writer.write_later(path, [1], delay=0.1)
+            writer.write_later(path, [1, 2], delay=0.1)
+            writer.write_blocking(path, [3]) # Newer than the deferred writes
+            await writer.flush()
+            with open(path) as f:
+                assert json.load(f) == [3]
+            assert list(Path(tmp).iterdir()) == [Path(path)] # No temporary files left behind
+
+            # Waiting for a write doesn't wait for the delay of a deferred write
+            writer.write_later(path, [4], delay=10)
+            await asyncio.wait_for(writer.write(path, [5]), 1)
+            with open(path) as f:
+                assert json.load(f) == [5]
+
+    async def test_output(self, ctx: commands.Context) -> None:
+        text = "\n".join(["a" * 5, "b" * 12, "c" * 3, "d" * 4])
+        chunks = split_lines(text, 10)
+        # Lines longer than the limit are split, the rest is split between lines
+        assert chunks == ["aaaaa\n", "b" * 10, "bb\nccc\n", "dddd"]
+
+        embeds = [discord.Embed(description="x" * 1000) for _ in range(13)]
+        assert [len(m) for m in pack_embeds(embeds)] == [6, 6, 1]
+        embeds = [discord.Embed(description="x") for _ in range(23)]
+        assert [len(m) for m in pack_embeds(embeds)] == [10, 10, 3]
+
+        class FakeChannel:
+            id = 1
+            sent = []
+            async def _get_channel(self):
+                return self
+            async def send(self, content):
+                await asyncio.sleep(0)
+                self.sent.append(content)
+
+        # Outputs to the same channel are not interleaved
+        channel = FakeChannel()
+        sender = Sender()
+        await asyncio.gather(sender.send_text(channel, ["a1", "a2"]), sender.send_text(channel, ["b1", "b2"]))
+        assert channel.sent in (["a1", "a2", "b1", "b2"], ["b1", "b2", "a1", "a2"])
+
+        # At most `limit` messages are sent in any `period` seconds
+        class TimedChannel(FakeChannel):
+            id = 2
+            times = []
+            async def send(self, content):
+                self.times.append(time.monotonic())
+        channel = TimedChannel()
+        sender = Sender(limit=3, period=0.2)
+        await sender.send_text(channel, [str(i) for i in range(7)])
+        times = channel.times
+        assert all(times[i + 3] - times[i] >= 0.2 for i in range(len(times) - 3))
+        assert times[-1] - times[0] < 0.6 # Paced, not serialized one by one
+
+    async def test_markov_store_keys(self, ctx: commands.Context) -> None:
+        store = MarkovStore("test")
+        assert MarkovStore.is_valid_key("Python_3")
+        for key in ["../../x", "a/b", "..", "", "x.json"]:
+            assert not MarkovStore.is_valid_key(key)
+            try:
+                await store.load(key)
+            except ValueError:
+                pass
+            else:
+                raise AssertionError(f"Loaded invalid key {key!r}")
+
+    async def test_markov_sentence_pool(self, ctx: commands.Context) -> None:
+        started, release = threading.Event(), threading.Event()
+        def generate(model):
+            started.set()
+            release.wait(1)
+            return model
+
+        class FakeStore:
+            model = "old"
+            def get(self, key):
+                return Mock(model=self.model)
+
+        store = FakeStore()
+        pool = SentencePool(store, generate, size=2, batch=2)
+        try:
+            assert pool.pop("r") is None # Marks "r" as active
+
+            # Sentences of a model cleared while they are generated are discarded
+            refill = asyncio.get_event_loop().create_task(pool.refill())
+            await asyncio.get_event_loop().run_in_executor(None, started.wait, 1)
+            store.model = "new"
+            pool.clear("r")
+            release.set()
+            await refill
+            assert pool.pop("r") is None
+
+            await pool.refill()
+            assert pool.pop("r") == "new"
+
+            # Errors are counted, and don't stop other models from being refilled
+            def generate(model):
+                if model == "broken":
+                    raise KeyError(model)
+                return model
+            pool.generate = generate
+            store.get = lambda key: Mock(model="broken" if key == "r" else key)
+            pool.clear("r")
+            assert pool.pop("s") is None
+            await pool.refill()
+            assert pool.stats["r"].failed == 2 and pool.pop("s") == "s"
+        finally:
+            pool.stop()
+
     async def _test_deepfry(self, ctx: commands.Context) -> None:
         # Get !deepfry command
         deepfry_cmd = self.bot.get_command("deepfry")
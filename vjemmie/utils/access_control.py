@@ -1,86 +1,227 @@
-from collections import defaultdict
+"""
+Trusted members and roles of each guild, and the global blacklist.
+
+Both are loaded from disk once and kept in memory as sets, so checks are O(1)
+lookups that never touch the filesystem. Changes are written to disk in the
+background (rapid changes are combined into one write), and listeners added
+with `add_listener` are notified, so anything derived from the outcome of
+checks can be invalidated.
+"""
+import json
 from enum import Enum
-from functools import partial
-from typing import DefaultDict, Optional, Union
+from typing import Callable, Dict, FrozenSet, List, Set
 
-from ..config import TRUSTED_PATH
-from .caching import get_cached
-from .json import dump_json_blocking
+from ..config import BLACKLIST_PATH, TRUSTED_PATH
+from .exceptions import CommandError
+from .json import dump_json_later
+from .printing import eprint
 
-DEFAULT = list
 
 class Categories(Enum):
     MEMBER = "members"
     ROLE = "roles"
 
 
-def _get_trusted() -> dict:
-    return defaultdict(partial(defaultdict, DEFAULT), get_cached(TRUSTED_PATH))
+def _read_json(path: str, default):
+    """Reads a JSON file, or returns `default` if it doesn't exist.
+    Invalid files raise `json.JSONDecodeError`, so they are never
+    mistaken for empty ones and overwritten."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f) or default
+    except FileNotFoundError:
+        return default
+
+
+class AccessControl:
+    """In-memory trusted lists and blacklist, persisted to JSON files.
+
+    Parameters
+    ----------
+    trusted_path : `str`, optional
+        File with trusted members and roles per guild,
+        by default `config.TRUSTED_PATH`
+    blacklist_path : `str`, optional
+        File with blacklisted user IDs, by default `config.BLACKLIST_PATH`
+    """
+
+    def __init__(self, trusted_path: str=TRUSTED_PATH, blacklist_path: str=BLACKLIST_PATH) -> None:
+        self.trusted_path = trusted_path
+        self.blacklist_path = blacklist_path
+        self._trusted: Dict[int, Dict[Categories, Set[int]]] = {} # Key: Guild ID
+        self._blacklist: Set[int] = set()
+        self._listeners: List[Callable[[], None]] = []
+        self._loaded = False
+        self._unreadable: Set[str] = set() # Files that failed to load, and must not be overwritten
+
+    def reload(self) -> None:
+        """Reads both files from disk. Only needed if they are edited by hand."""
+        self._load()
+        self._notify()
+
+    def _load(self) -> None:
+        self._load_trusted()
+        self._load_blacklist()
+        self._loaded = True
+
+    def _load_trusted(self) -> None:
+        self._trusted = {
+            int(guild_id): {
+                category: set(categories.get(category.value, []))
+                for category in Categories
+            }
+            for guild_id, categories in self._read(self.trusted_path, {}).items()
+        }
+
+    def _load_blacklist(self) -> None:
+        self._blacklist = set(self._read(self.blacklist_path, []))
+
+    def _read(self, path: str, default):
+        try:
+            obj = _read_json(path, default)
+        except json.JSONDecodeError as e:
+            # Start out empty, but don't replace the file until it is fixed
+            eprint(f"Failed to read '{path}': {e}")
+            self._unreadable.add(path)
+            return default
+        self._unreadable.discard(path)
+        return obj
+
+    def _check_writable(self, path: str, load: Callable[[], None]) -> None:
+        """Raises if a file could not be read, after trying to read it again."""
+        if path in self._unreadable:
+            load()
+            if path in self._unreadable:
+                raise CommandError(f"Unable to make changes: `{path}` is not valid JSON. Fix or remove it first!")
+            self._notify()
+
+    def _ensure_loaded(self) -> None:
+        if not self._loaded:
+            self._load()
+
+    def add_listener(self, listener: Callable[[], None]) -> None:
+        """Registers a function that is called after every change."""
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[], None]) -> None:
+        self._listeners.remove(listener)
+
+    def _notify(self) -> None:
+        for listener in self._listeners:
+            listener()
+
+    # Trusted
+
+    def _get_category(self, guild_id: int, category: Categories) -> Set[int]:
+        self._ensure_loaded()
+        guild = self._trusted.get(guild_id)
+        return guild[category] if guild else set()
+
+    def get_trusted(self, guild_id: int, category: Categories) -> FrozenSet[int]:
+        return frozenset(self._get_category(guild_id, category))
+
+    def is_trusted(self, guild_id: int, user_id: int) -> bool:
+        """Checks if a member is trusted in a guild."""
+        return user_id in self._get_category(guild_id, Categories.MEMBER)
+
+    def add_trusted(self, guild_id: int, id_: int, category: Categories, *, exist_ok: bool=True) -> None:
+        self._ensure_loaded()
+        self._check_writable(self.trusted_path, self._load_trusted)
+        guild = self._trusted.setdefault(guild_id, {c: set() for c in Categories})
+        if id_ in guild[category]:
+            if not exist_ok:
+                raise ValueError(f"{id_} has already been added!")
+            return
+        guild[category].add(id_)
+        self._save_trusted()
+
+    def remove_trusted(self, guild_id: int, id_: int, category: Categories, *, exist_ok: bool=False) -> None:
+        self._ensure_loaded()
+        self._check_writable(self.trusted_path, self._load_trusted)
+        ids = self._get_category(guild_id, category)
+        if id_ not in ids:
+            if not exist_ok:
+                raise ValueError(f"{id_} is not trusted!")
+            return
+        ids.remove(id_)
+        self._save_trusted()
 
+    def _save_trusted(self) -> None:
+        dump_json_later(self.trusted_path, {
+            str(guild_id): {category.value: sorted(ids) for category, ids in categories.items()}
+            for guild_id, categories in self._trusted.items()
+        })
+        self._notify()
 
-def _dump_trusted(trusted: dict) -> None:
-    dump_json_blocking(TRUSTED_PATH, trusted)
+    # Blacklist
+
+    def get_blacklist(self) -> FrozenSet[int]:
+        self._ensure_loaded()
+        return frozenset(self._blacklist)
+
+    def is_blacklisted(self, user_id: int) -> bool:
+        self._ensure_loaded()
+        return user_id in self._blacklist
+
+    def add_blacklist(self, user_id: int) -> bool:
+        """Returns False if the user was already blacklisted."""
+        self._ensure_loaded()
+        self._check_writable(self.blacklist_path, self._load_blacklist)
+        if user_id in self._blacklist:
+            return False
+        self._blacklist.add(user_id)
+        self._save_blacklist()
+        return True
+
+    def remove_blacklist(self, user_id: int) -> bool:
+        """Returns False if the user was not blacklisted."""
+        self._ensure_loaded()
+        self._check_writable(self.blacklist_path, self._load_blacklist)
+        if user_id not in self._blacklist:
+            return False
+        self._blacklist.remove(user_id)
+        self._save_blacklist()
+        return True
+
+    def clear_blacklist(self) -> None:
+        self._ensure_loaded()
+        self._check_writable(self.blacklist_path, self._load_blacklist)
+        self._blacklist.clear()
+        self._save_blacklist()
+
+    def _save_blacklist(self) -> None:
+        dump_json_later(self.blacklist_path, sorted(self._blacklist))
+        self._notify()
 
-def _get_trusted_guild_category(guild_id: int, category: Categories) -> list:
-    try:
-        return _get_trusted()[str(guild_id)][category.value]
-    except KeyError:
-        return DEFAULT()    
 
+ACCESS = AccessControl()
 
-def get_trusted_members(guild_id: int) -> list:
-    """Get a list of trusted members for a guild."""
-    return _get_trusted_guild_category(guild_id, Categories.MEMBER)
 
+def get_trusted_members(guild_id: int) -> FrozenSet[int]:
+    """Get trusted members of a guild."""
+    return ACCESS.get_trusted(guild_id, Categories.MEMBER)
 
-def get_trusted_roles(guild_id: int) -> list:
-    """Get a list of trusted roles for a guild."""
-    return _get_trusted_guild_category(guild_id, Categories.ROLE)
+
+def get_trusted_roles(guild_id: int) -> FrozenSet[int]:
+    """Get trusted roles of a guild."""
+    return ACCESS.get_trusted(guild_id, Categories.ROLE)
 
 
 def add_trusted_member(guild_id: int, user_id: int) -> None:
     """Add a trusted member for a guild."""
-    _add_trusted(guild_id, user_id, category=Categories.MEMBER)
+    ACCESS.add_trusted(guild_id, user_id, Categories.MEMBER)
 
 
 def add_trusted_role(guild_id: int, role_id: int) -> None:
     """Add a trusted role for a guild."""
-    _add_trusted(guild_id, role_id, category=Categories.ROLE)
-
-
-def _add_trusted(guild_id: int, id_: int, category: str=Categories.MEMBER, *, exist_ok: bool=True) -> None:
-    trusted = _get_trusted()
-    
-    try:
-        if id_ in trusted[str(guild_id)][category.value]:
-            if not exist_ok:
-                raise ValueError(f"{id_} has already been added!")
-            return
-    except KeyError:
-        trusted[str(guild_id)][category.value] = DEFAULT()
-    finally:
-        trusted[str(guild_id)][category.value].append(id_)
-
-    _dump_trusted(trusted)
+    ACCESS.add_trusted(guild_id, role_id, Categories.ROLE)
 
 
 def remove_trusted_member(guild_id: int, user_id: int, **kwargs) -> None:
     """Remove a trusted member for a guild."""
-    _remove_trusted(guild_id, user_id, category=Categories.MEMBER, **kwargs)
+    ACCESS.remove_trusted(guild_id, user_id, Categories.MEMBER, **kwargs)
 
 
 def remove_trusted_role(guild_id: int, role_id: int, **kwargs) -> None:
     """Remove a trusted role for a guild."""
-    _remove_trusted(guild_id, role_id, category=Categories.ROLE, **kwargs)
-
-
-def _remove_trusted(guild_id: int, user_id: int, category: str=Categories.MEMBER, *, exist_ok: bool=False) -> None:
-    trusted = _get_trusted()
-    try:
-        trusted[str(guild_id)][category.value].remove(user_id)
-    except ValueError:
-        if not exist_ok:
-            raise
-    else:
-        _dump_trusted(trusted)
-
+    ACCESS.remove_trusted(guild_id, role_id, Categories.ROLE, **kwargs)
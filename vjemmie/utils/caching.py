@@ -1,33 +1,373 @@
+"""
+In-memory caches for file contents and expensive function results.
+
+Every category is a separate `Cache` with its own eviction policy:
+
+* `Policy.LRU`: Evicts the least recently used entry
+* `Policy.LFU`: Evicts the least frequently used entry (oldest first on ties)
+* `Policy.TTL`: Like LRU, but entries also expire a fixed time after being added
+
+Caches are bounded by number of entries and/or estimated size in bytes, and
+count their hits, misses and evictions (see `get_stats()`).
+
+`get_cached()` caches file contents and only checks if a file has been modified
+at most once per `revalidate` seconds, instead of on every access. Files written
+through `utils.json` are invalidated right away.
+
+`cached_loader()` registers a function that turns the parsed contents of a file
+into domain objects. The objects are built once per version of the file and
+shared by every caller, so loaders should return immutable views
+(`MappingProxyType`, `frozenset`, tuples, frozen records).
+
+`memoize()` caches the results of pure functions in a category of its own.
+"""
+import asyncio
+import functools
 import json
 import os
+import sys
+import threading
 import time
-from typing import Any, Dict, Union, Tuple
-from collections import deque, defaultdict, OrderedDict
-from functools import partial
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import (Any, Callable, Dict, Hashable, Iterator, Optional, Tuple,
+                    TypeVar, Union)
 
 from recordclass import recordclass
-from recordclass.recordobject import recordclasstype
 
 
 class CacheError(Exception):
-    """Exceptions stemming from operations 
+    """Exceptions stemming from operations
     performed on the cache data structure"""
 
+
+class Policy(Enum):
+    LRU = "lru"
+    LFU = "lfu"
+    TTL = "ttl"
+
+
 DEFAULT_CATEGORY = "default"
-MAX_SIZE = 5
+MAX_SIZE: Optional[int] = None # Max entries per category
+MAX_BYTES = 32 * 1024 * 1024 # Max estimated size per category
+REVALIDATE_INTERVAL = 0.5 # Seconds between checking if a cached file was modified
+
+# views: Objects built from `contents` by loaders. Key: Loader
+CachedContent = recordclass("CachedContent", "contents content_type modified checked views")
+
+_MISSING = object()
+T = TypeVar("T")
+
+
+def estimate_size(obj: Any) -> int:
+    """Estimates the memory used by an object and everything it contains.
+    Only follows built-in containers, other objects count as their own size."""
+    seen = set()
+    size = 0
+    stack = [obj]
+    while stack:
+        o = stack.pop()
+        if id(o) in seen:
+            continue
+        seen.add(id(o))
+        size += sys.getsizeof(o)
+        if isinstance(o, dict):
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple, set, frozenset)):
+            stack.extend(o)
+        elif hasattr(o, "_asdict"): # Namedtuples, recordclasses
+            stack.extend(o._asdict().values())
+    return size
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    expirations: int = 0
+    revalidations: int = 0 # Times a cached file was checked for modification
+    reloads: int = 0 # Times a modified file was read again
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+@dataclass
+class _Entry:
+    value: Any
+    size: int
+    expires: Optional[float] = None
+    frequency: int = 1
+
+
+class Cache:
+    """A bounded key-value cache.
+
+    Parameters
+    ----------
+    policy : `Policy`, optional
+        Eviction policy, by default `Policy.LRU`
+    max_items : `Optional[int]`, optional
+        Max number of entries, by default unlimited
+    max_bytes : `Optional[int]`, optional
+        Max estimated size of all entries, by default unlimited.
+        An entry that is larger than this by itself is not cached.
+    ttl : `Optional[float]`, optional
+        Seconds until an entry expires. Required for `Policy.TTL`.
+    sizeof : `Callable[[Any], int]`, optional
+        Estimates the size of a value, by default `estimate_size`.
+        Only called if `max_bytes` is set.
+    """
+
+    def __init__(self,
+                 policy: Union[Policy, str]=Policy.LRU,
+                 *,
+                 max_items: Optional[int]=None,
+                 max_bytes: Optional[int]=None,
+                 ttl: Optional[float]=None,
+                 sizeof: Callable[[Any], int]=estimate_size
+                 ) -> None:
+        self.policy = Policy(policy)
+        if self.policy == Policy.TTL and not ttl:
+            raise CacheError("TTL caches require a ttl")
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sizeof = sizeof
+        self.stats = CacheStats()
+        self.nbytes = 0
+
+        self._entries: Dict[Hashable, _Entry] = {}
+        # Eviction order. LRU/TTL: Recency. LFU: Recency within each frequency.
+        self._order: "OrderedDict[Hashable, None]" = OrderedDict()
+        self._frequencies: Dict[int, "OrderedDict[Hashable, None]"] = {}
+        self._min_frequency = 0
+        self._lock = threading.RLock() # Caches may be shared with executor threads
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and not self._expired(entry)
+
+    def __iter__(self) -> Iterator[Hashable]:
+        return iter(list(self._entries))
+
+    def get(self, key: Hashable, default: Any=None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry):
+                self._remove(key)
+                self.stats.expirations += 1
+                entry = None
+            if entry is None:
+                self.stats.misses += 1
+                return default
+            self.stats.hits += 1
+            self._touch(key, entry)
+            return entry.value
+
+    def peek(self, key: Hashable, default: Any=None) -> Any:
+        """Gets a value without counting it as a use."""
+        entry = self._entries.get(key)
+        if entry is None or self._expired(entry):
+            return default
+        return entry.value
+
+    def set(self, key: Hashable, value: Any, *, size: Optional[int]=None) -> None:
+        """Adds or replaces an entry, evicting others if the cache is full."""
+        if size is None:
+            size = self.sizeof(value) if self.max_bytes is not None else 0
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            expires = time.monotonic() + self.ttl if self.ttl else None
+            self._entries[key] = _Entry(value, size, expires)
+            self.nbytes += size
+            if self.policy == Policy.LFU:
+                self._frequencies.setdefault(1, OrderedDict())[key] = None
+                self._min_frequency = 1
+            else:
+                self._order[key] = None
+            self._evict()
+
+    def pop(self, key: Hashable, default: Any=None) -> Any:
+        with self._lock:
+            if key not in self._entries:
+                return default
+            return self._remove(key).value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._order.clear()
+            self._frequencies.clear()
+            self.nbytes = 0
+
+    def _expired(self, entry: _Entry) -> bool:
+        return entry.expires is not None and entry.expires <= time.monotonic()
+
+    def _touch(self, key: Hashable, entry: _Entry) -> None:
+        if self.policy != Policy.LFU:
+            self._order.move_to_end(key)
+            return
+        bucket = self._frequencies[entry.frequency]
+        del bucket[key]
+        if not bucket:
+            del self._frequencies[entry.frequency]
+            if self._min_frequency == entry.frequency:
+                self._min_frequency += 1
+        entry.frequency += 1
+        self._frequencies.setdefault(entry.frequency, OrderedDict())[key] = None
+
+    def _remove(self, key: Hashable) -> _Entry:
+        entry = self._entries.pop(key)
+        self.nbytes -= entry.size
+        if self.policy == Policy.LFU:
+            bucket = self._frequencies[entry.frequency]
+            del bucket[key]
+            if not bucket:
+                del self._frequencies[entry.frequency]
+        else:
+            del self._order[key]
+        return entry
+
+    def _victim(self) -> Hashable:
+        if self.policy != Policy.LFU:
+            return next(iter(self._order))
+        if self._min_frequency not in self._frequencies:
+            self._min_frequency = min(self._frequencies)
+        return next(iter(self._frequencies[self._min_frequency]))
+
+    def _full(self) -> bool:
+        return (
+            (self.max_items is not None and len(self._entries) > self.max_items)
+            or (self.max_bytes is not None and self.nbytes > self.max_bytes)
+        )
+
+    def _evict(self) -> None:
+        # Expired entries go first
+        if self.ttl and self._full():
+            for key in [k for k, e in self._entries.items() if self._expired(e)]:
+                self._remove(key)
+                self.stats.expirations += 1
+        while self._entries and self._full():
+            self._remove(self._victim())
+            self.stats.evictions += 1
+
+
+@dataclass
+class CategoryConfig:
+    policy: Policy = Policy.LRU
+    max_items: Optional[int] = None
+    max_bytes: Optional[int] = None
+    ttl: Optional[float] = None
+    revalidate: float = REVALIDATE_INTERVAL
+    sizeof: Callable[[Any], int] = field(default=estimate_size)
+
+
+CACHE: Optional[Dict[str, Cache]] = None
+_CONFIGS: Dict[str, CategoryConfig] = {}
+_CONFIGURED: Dict[str, Cache] = {} # Caches of configured categories, kept across flushes
+_cache_lock = threading.Lock()
+
 
-CACHE = None
-CachedContent = recordclass("CachedContent", "contents content_type modified")
+def configure(category: str,
+              policy: Union[Policy, str]=Policy.LRU,
+              *,
+              max_items: Optional[int]=None,
+              max_bytes: Optional[int]=MAX_BYTES,
+              ttl: Optional[float]=None,
+              revalidate: float=REVALIDATE_INTERVAL,
+              sizeof: Callable[[Any], int]=estimate_size
+              ) -> Cache:
+    """Sets the policy and limits of a category. Replaces the category's
+    cache if it already exists, discarding its contents.
 
-def get_cached(path: str, category: str=None) -> Union[str, dict, list]:
-    """Get contents of a file. 
+    Parameters
+    ----------
+    category : `str`
+        Name of the category
+    policy : `Union[Policy, str]`, optional
+        Eviction policy, by default `Policy.LRU`
+    max_items : `Optional[int]`, optional
+        Max number of entries, by default unlimited
+    max_bytes : `Optional[int]`, optional
+        Max estimated size of entries, by default `MAX_BYTES`
+    ttl : `Optional[float]`, optional
+        Seconds until an entry expires, by default never
+        (required for `Policy.TTL`)
+    revalidate : `float`, optional
+        Min seconds between checking if a file cached by `get_cached()`
+        has been modified, by default `REVALIDATE_INTERVAL`
+    sizeof : `Callable[[Any], int]`, optional
+        Size estimator, by default `estimate_size`
+
+    Returns
+    -------
+    `Cache`
+        Cache of the category
+    """
+    config = CategoryConfig(Policy(policy), max_items, max_bytes, ttl, revalidate, sizeof)
+    _CONFIGS[category] = config
+    with _cache_lock:
+        if not CACHE:
+            _do_create_cache()
+        CACHE[category] = _CONFIGURED[category] = _make_cache(config)
+        return CACHE[category]
+
+
+def _make_cache(config: CategoryConfig) -> Cache:
+    return Cache(
+        config.policy,
+        max_items=config.max_items,
+        max_bytes=config.max_bytes,
+        ttl=config.ttl,
+        sizeof=config.sizeof
+    )
+
+
+def get_cache(category: str=None) -> Cache:
+    """Gets the cache of a category, creating it with the
+    default configuration if it doesn't exist."""
+    category = category or DEFAULT_CATEGORY
+    cache = CACHE.get(category) if CACHE else None
+    if cache is not None:
+        return cache
+    with _cache_lock:
+        if not CACHE:
+            _do_create_cache()
+        if category not in CACHE:
+            config = _CONFIGS.get(category) or CategoryConfig(max_items=MAX_SIZE, max_bytes=MAX_BYTES)
+            CACHE[category] = _make_cache(config)
+        return CACHE[category]
+
+
+def get_stats() -> Dict[str, CacheStats]:
+    """Hit/miss/eviction counters of every category."""
+    return {category: cache.stats for category, cache in (CACHE or {}).items()}
+
+
+def get_cached(path: str, category: str=None, loader: Callable[[Any], T]=None) -> Union[str, dict, list, T]:
+    """Get contents of a file.
     The file contents are cached in memory, and all subsequent calls
     to `get_cached()` with identical `path` & `category` arguments
     return cached contents rather than reading the file on disk.
 
     Should the file be modified between calls, `get_cached()` loads new
     version of file into the cache, overwriting the previous version.
-    
+    The modification time is checked at most once per the category's
+    `revalidate` interval.
+
     Parameters
     ----------
     path : `str`
@@ -37,91 +377,182 @@ def get_cached(path: str, category: str=None) -> Union[str, dict, list]:
         Uses default category if None is passed in.
         The default category "default" can be overridden
         by calling `setup(default=<your category here>)`.
-    
+    loader : `Callable[[Any], T]`, optional
+        Function that builds objects from the file contents, by default None.
+        Only called once per version of the file, see `cached_loader()`.
+
     Returns
     -------
-    `Union[str, dict, list]`
+    `Union[str, dict, list, T]`
         Contents of the file, as list or dict if filetype is .json,
-        otherwise str.
+        otherwise str. Return value of `loader` if passed in.
     """
-    # Setup cache if none exists
-    if not CACHE:
-        _do_create_cache()
+    category = category or DEFAULT_CATEGORY
+    cache = get_cache(category)
+    config = _CONFIGS.get(category)
+    revalidate = config.revalidate if config else REVALIDATE_INTERVAL
 
-    # Fall back on default category
-    if not category:
-        category = DEFAULT_CATEGORY
+    cached: Optional[CachedContent] = cache.get(path)
+    now = time.monotonic()
+    if cached is not None and now - cached.checked >= revalidate:
+        cache.stats.revalidations += 1
+        if os.path.getmtime(path) == cached.modified:
+            cached.checked = now
+        else:
+            cache.stats.reloads += 1
+            cached = None
 
-    # Attempt to get cached version of file
-    cached = _get_from_cache(path, category)
+    if cached is None:
+        is_json = os.path.splitext(path)[1] == ".json"
+        cached = _get_file_contents(path, is_json)
+        cache.set(path, cached, size=cache.sizeof(cached.contents) if cache.max_bytes is not None else 0)
 
-    # Get modification time of cached content if it exists
-    if cached:
-        last_modified = cached.modified
+    if loader is None:
+        return cached.contents
+    view = cached.views.get(loader, _MISSING)
+    if view is _MISSING:
+        view = cached.views[loader] = loader(cached.contents)
+    return view
 
-    # Get current modification time of file
-    modified = os.path.getmtime(path)
 
-    # Get file contents on disk if cached file differs or does not exist
-    if not cached or last_modified != modified:
-        extension = os.path.splitext(path)[1]
-        is_json = extension == ".json"
-        cache_data = _get_file_contents(path, category, is_json)
-        _add_to_cache(path, category, cache_data)
-        contents = cache_data.contents
+def cached_loader(path: str, category: str=None) -> Callable[[Callable[[Any], T]], Callable[[], T]]:
+    """Decorator that registers a function as the loader of a file.
 
-    # Otherwise return cached content
-    else:
-        contents = cached.contents
+    The decorated function receives the parsed contents of the file and
+    returns the objects built from them. Calling it (without arguments)
+    returns those objects, which are only built again after the file changes.
+
+    Parameters
+    ----------
+    path : `str`
+        Path + filename
+    category : `str`, optional
+        Category to cache file under, see `get_cached()`
+
+    Example
+    -------
+    >>> @cached_loader("db/users.json", "users")
+    ... def load_users(raw: dict) -> Mapping[str, User]:
+    ...     return MappingProxyType({k: User(**v) for k, v in raw.items()})
+    >>> load_users()["123"]
+    """
+    def decorator(func: Callable[[Any], T]) -> Callable[[], T]:
+        @functools.wraps(func)
+        def wrapper() -> T:
+            return get_cached(path, category, loader=func)
+        wrapper.path = path
+        wrapper.category = category
+        wrapper.build = func
+        return wrapper
+    return decorator
 
-    return contents
 
+def invalidate(path: str, category: str=None) -> None:
+    """Removes a file from the cache, or from every category if `category` is None.
+    Should be called after writing to a file, so the next read isn't stale."""
+    if not CACHE:
+        return
+    categories = [category] if category else list(CACHE)
+    for c in categories:
+        cache = CACHE.get(c)
+        if cache is not None:
+            cache.pop(path)
 
-def _get_file_contents(path: str, category: str, is_json: bool) -> CachedContent:
+
+def _get_file_contents(path: str, is_json: bool) -> CachedContent:
     """Retrieves content of a file and returns `CachedContent` object."""
-    with open(path, "r") as f:
+    modified = os.path.getmtime(path)
+    with open(path, "r", encoding="utf-8") as f:
         if is_json:
             contents = json.load(f)
         else:
             contents = f.read()
-    modified = os.path.getmtime(path)
     content_type = "json" if is_json else "text"
-    return CachedContent(contents, content_type, modified)
+    return CachedContent(contents, content_type, modified, time.monotonic(), {})
+
+
+def _make_key(args: Tuple[Any, ...], kwargs: Dict[str, Any]) -> Hashable:
+    if not kwargs:
+        return args if len(args) != 1 else args[0]
+    return (args, tuple(sorted(kwargs.items())))
 
 
-def _add_to_cache(path: str, category: str, contents: CachedContent) -> None:
-    """Adds contents of a file to the cache."""
-    try:
-        del CACHE[category][path]
-    except KeyError:
-        pass
-    if len(CACHE[category]) == MAX_SIZE:
-        CACHE[category].popitem(last=False) # Pop oldest item
-    CACHE[category][path] = contents
+def memoize(category: str=None,
+            policy: Union[Policy, str]=Policy.LRU,
+            *,
+            max_items: Optional[int]=128,
+            max_bytes: Optional[int]=None,
+            ttl: Optional[float]=None,
+            sizeof: Callable[[Any], int]=estimate_size
+            ) -> Callable[[Callable[..., T]], Callable[..., T]]:
+    """Caches the results of a pure function (or coroutine function) by its
+    arguments, which must be hashable.
 
+    Parameters
+    ----------
+    category : `str`, optional
+        Category to cache results under, by default the function's qualified name.
+        Functions sharing a category share its limits.
+    policy, max_items, max_bytes, ttl, sizeof
+        See `configure()`. By default at most 128 results are cached.
 
-def _get_from_cache(path: str, category: str) -> CachedContent:
-    """Attempts to retrieve cached contents of a specific filepath + category"""
-    try:
-        return CACHE[category][path]
-    except KeyError:
-        pass
+    Example
+    -------
+    >>> @memoize(max_items=1000)
+    ... def expensive(n: int) -> int:
+    ...     ...
+    >>> expensive.cache.stats.hits
+    """
+    def decorator(func: Callable[..., T]) -> Callable[..., T]:
+        name = category or f"memoize:{func.__module__}.{func.__qualname__}"
+        cache = configure(
+            name, policy, max_items=max_items, max_bytes=max_bytes, ttl=ttl, sizeof=sizeof
+        ) if name not in _CONFIGS else get_cache(name)
 
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                key = (func, _make_key(args, kwargs))
+                result = cache.get(key, _MISSING)
+                if result is _MISSING:
+                    result = await func(*args, **kwargs)
+                    cache.set(key, result)
+                return result
+            wrapper = async_wrapper
+        else:
+            @functools.wraps(func)
+            def sync_wrapper(*args, **kwargs):
+                key = (func, _make_key(args, kwargs))
+                result = cache.get(key, _MISSING)
+                if result is _MISSING:
+                    result = func(*args, **kwargs)
+                    cache.set(key, result)
+                return result
+            wrapper = sync_wrapper
 
-def setup(size: int=MAX_SIZE, default: str=None) -> None:
-    """Creates cache with custom size and default category key"""
+        wrapper.cache = cache
+        wrapper.cache_clear = cache.clear
+        return wrapper
+    return decorator
+
+
+def setup(size: Optional[int]=MAX_SIZE, default: str=None, max_bytes: Optional[int]=MAX_BYTES) -> None:
+    """Sets default limits of categories that are not configured with
+    `configure()`, and the default category key."""
     global DEFAULT_CATEGORY
     global MAX_SIZE
+    global MAX_BYTES
 
-    if CACHE:
+    if CACHE and any(len(cache) for cache in CACHE.values()):
         raise CacheError("Cache already contains data! "
             "Flush cache before attempting to make changes.")
 
-    if size:
+    if size is not None:
         if not isinstance(size, int):
             raise TypeError("Category size must be an integer!")
         if size > 0:
             MAX_SIZE = size
+    MAX_BYTES = max_bytes
 
     if default:
         try:
@@ -129,14 +560,19 @@ def setup(size: int=MAX_SIZE, default: str=None) -> None:
         except TypeError:
             raise TypeError("Default category key must be hashable")
         DEFAULT_CATEGORY = default
-    
+
     flush_cache()
 
 def flush_cache() -> None:
     """Flushes cache and creates new cache using default category
-    and size settings."""
+    and size settings. Categories set up with `configure()` (and
+    `memoize()`) keep their settings, but are emptied."""
+    if CACHE:
+        for cache in CACHE.values():
+            cache.clear()
     _do_create_cache()
+    CACHE.update(_CONFIGURED)
 
 def _do_create_cache() -> None:
     global CACHE
-    CACHE = defaultdict(OrderedDict)
+    CACHE = {}
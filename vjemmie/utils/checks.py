@@ -1,21 +1,8 @@
-import json
-
 from discord.ext import commands
 
-from ..config import (BLACKLIST_PATH, DGVGK_SERVER_ID, DOWNLOADS_ALLOWED,
-                      OWNER_ID, PFM_SERVER_ID, TEST_SERVER_ID)
-from .access_control import get_trusted_members
-from .caching import get_cached
-from .json import dump_json_blocking
-
-
-# Blacklist serialization functions
-def load_blacklist() -> list:
-    return get_cached(BLACKLIST_PATH, "blacklist")
-
-
-def save_blacklist(blacklist: list) -> None:
-    dump_json_blocking(BLACKLIST_PATH, blacklist)
+from ..config import (DGVGK_SERVER_ID, DOWNLOADS_ALLOWED, OWNER_ID,
+                      PFM_SERVER_ID, TEST_SERVER_ID)
+from .access_control import ACCESS
 
 
 # Decorator check
@@ -38,7 +25,7 @@ def owners_only():
 
 def is_not_blacklisted():
     def predicate(ctx):
-        return ctx.message.author.id not in load_blacklist()
+        return not ACCESS.is_blacklisted(ctx.message.author.id)
     return commands.check(predicate)
 
 
@@ -87,6 +74,6 @@ def trusted():
     """Adds check that allows trusted users only."""
     def predicate(ctx):
         if ctx.guild:
-            return ctx.message.author.id in get_trusted_members(ctx.guild.id)
+            return ACCESS.is_trusted(ctx.guild.id, ctx.message.author.id)
         return False
     return commands.check(predicate)
@@ -1,41 +1,223 @@
-from functools import partial
-from asyncio import coroutine
-from typing import Optional, List, Callable
+"""
+Commands that are created at runtime, such as one command per subreddit.
+
+A `CommandRegistry` owns every dynamic command made from a single callback.
+Definitions are indexed by name and alias, so lookups don't have to scan the
+bot's commands, and reloading only touches definitions that have changed.
+"""
+import asyncio
+import functools
+import inspect
+import typing
+from dataclasses import dataclass, field
+from typing import (Any, Awaitable, Callable, Dict, Iterable, Iterator, List,
+                    Optional, Tuple)
 
 from discord.ext import commands
 
 
-def add_command(cog: commands.Cog, 
-                coro: Callable, 
-                name: str,
-                aliases: Optional[List[str]]=None,
-                help: Optional[str]=None,
-                hidden: bool=False,
-                group: Optional[commands.Group]=None,
-                checks: Optional[List[Callable]] = None,
-                **kwargs
-               ) -> None:
-    _cmd = coroutine(partial(coro, **kwargs)) # Create partial coro from passed in coro
-    
-    # These checks seem to be mandatory from Python 3.8 and onwards
-    if not hasattr(_cmd, "__module__"):
-        _cmd.__module__ = _cmd.func.__module__
-    if not hasattr(_cmd, "__globals__"):
-        _cmd.__globals__ = _cmd.func.__globals__
-    
-    if not aliases:
-        aliases = []
-    if not checks:
-        checks = []
-
-    if not help:
-        help = ""
-
-    cmd_func = group.command if group else commands.command
-    cmd = cmd_func(name=name, aliases=aliases, cog=cog, help=help)(_cmd)
-    cmd.cog = cog
-    cmd.hidden = hidden
-    cmd.checks.extend(checks)
-    for param in kwargs: # Remove params from command after passing them in
-        cmd.params.pop(param)
-    cog.bot.add_command(cmd)
\ No newline at end of file
+def bind_kwargs(coro: Callable[..., Awaitable[Any]], **kwargs) -> Callable[..., Awaitable[Any]]:
+    """Binds keyword arguments to a command callback.
+
+    Works like `functools.partial`, but returns a coroutine function whose
+    signature no longer includes the bound arguments, so discord.py doesn't
+    treat them as command parameters.
+    """
+    sig = inspect.signature(coro)
+    # String annotations are resolved in the namespace of the wrapped function,
+    # since discord.py would resolve them in the namespace of this module
+    hints: Dict[str, Any] = {}
+    if any(isinstance(param.annotation, str) for param in sig.parameters.values()):
+        hints = typing.get_type_hints(coro)
+    params = []
+    for param in sig.parameters.values():
+        if param.name in kwargs:
+            continue
+        if isinstance(param.annotation, str):
+            param = param.replace(annotation=hints[param.name])
+        params.append(param)
+
+    @functools.wraps(coro)
+    async def callback(*args, **kw) -> Any:
+        return await coro(*args, **kw, **kwargs)
+
+    callback.__signature__ = sig.replace(parameters=params)
+    return callback
+
+
+@dataclass
+class CommandDef:
+    """Definition of a dynamic command."""
+    name: str
+    aliases: List[str] = field(default_factory=list)
+    help: str = ""
+    hidden: bool = False
+    kwargs: Dict[str, Any] = field(default_factory=dict) # Bound to the callback
+
+    @property
+    def names(self) -> List[str]:
+        return [self.name, *self.aliases]
+
+
+class CommandRegistry:
+    """Dynamic commands of a cog that share a callback.
+
+    Parameters
+    ----------
+    cog : `commands.Cog`
+        Cog the commands belong to
+    coro : `Callable[..., Awaitable[Any]]`
+        Callback of every command. Receives the cog, the context, the
+        command's arguments and the keyword arguments of its definition.
+    group : `Optional[commands.Group]`, optional
+        Group commands are added to, by default None (top-level commands)
+    checks : `Optional[List[Callable]]`, optional
+        Checks added to every command, by default None
+    save : `Optional[Callable[[], Awaitable[None]]]`, optional
+        Coroutine function that persists the definitions, by default None.
+        Called at most once per `save_delay` seconds, no matter how many
+        definitions change in between.
+    save_delay : `float`, optional
+        Seconds to wait for more changes before saving, by default 5.0
+    """
+
+    def __init__(self,
+                 cog: commands.Cog,
+                 coro: Callable[..., Awaitable[Any]],
+                 *,
+                 group: Optional[commands.Group]=None,
+                 checks: Optional[List[Callable]]=None,
+                 save: Optional[Callable[[], Awaitable[None]]]=None,
+                 save_delay: float=5.0
+                 ) -> None:
+        self.cog = cog
+        self.coro = coro
+        self.group = group
+        self.checks = checks or []
+        self.save_delay = save_delay
+        self._save = save
+        self._save_task: Optional[asyncio.Task] = None
+        self._dirty = False
+        self.defs: Dict[str, CommandDef] = {}
+        self.index: Dict[str, str] = {} # Key: Name or alias, Value: Name of definition
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.index
+
+    def __len__(self) -> int:
+        return len(self.defs)
+
+    def __iter__(self) -> Iterator[CommandDef]:
+        return iter(self.defs.values())
+
+    @property
+    def parent(self) -> commands.GroupMixin:
+        return self.group or self.cog.bot
+
+    def get(self, name: str) -> Optional[CommandDef]:
+        """Looks up a definition by name or alias."""
+        key = self.index.get(name)
+        return self.defs[key] if key else None
+
+    def add(self, d: CommandDef, *, persist: bool=True) -> None:
+        """Adds a command.
+
+        Raises
+        ------
+        `discord.ClientException`
+            Raised if the name or an alias is already taken by another command
+        """
+        self.parent.add_command(self._make_command(d))
+        self.defs[d.name] = d
+        for name in d.names:
+            self.index[name] = d.name
+        if persist:
+            self._mark_dirty()
+
+    def remove(self, name: str, *, persist: bool=True) -> CommandDef:
+        """Removes a command by name or alias.
+
+        Raises
+        ------
+        `KeyError`
+            Raised if no command has this name or alias
+        """
+        d = self.defs.pop(self.index[name])
+        self.parent.remove_command(d.name)
+        for n in d.names:
+            self.index.pop(n, None)
+        if persist:
+            self._mark_dirty()
+        return d
+
+    def update(self, d: CommandDef, *, persist: bool=True) -> bool:
+        """Replaces the command with the same name, if its definition has changed.
+        If the new definition can't be added, the old one is restored.
+
+        Returns
+        -------
+        `bool`
+            True if the command was replaced
+        """
+        old = self.defs.get(d.name)
+        if old == d:
+            return False
+        if old:
+            self.remove(d.name, persist=False)
+        try:
+            self.add(d, persist=persist)
+        except Exception:
+            if old:
+                self.add(old, persist=False)
+            raise
+        return True
+
+    def sync(self, defs: Iterable[CommandDef], *, persist: bool=False) -> Tuple[List[str], List[str], List[str]]:
+        """Makes the registered commands match `defs`. Commands whose
+        definition is unchanged are left alone.
+
+        Returns
+        -------
+        `Tuple[List[str], List[str], List[str]]`
+            Names of added, removed and changed commands
+        """
+        new = {d.name: d for d in defs}
+        removed = [name for name in self.defs if name not in new]
+        for name in removed:
+            self.remove(name, persist=persist)
+
+        added, changed = [], []
+        for name, d in new.items():
+            exists = name in self.defs
+            if self.update(d, persist=persist):
+                (changed if exists else added).append(name)
+        return added, removed, changed
+
+    async def flush(self) -> None:
+        """Saves pending changes right away."""
+        if self._dirty and self._save:
+            self._dirty = False
+            await self._save()
+
+    def _mark_dirty(self) -> None:
+        if not self._save:
+            return
+        self._dirty = True
+        if not self._save_task or self._save_task.done():
+            self._save_task = asyncio.get_event_loop().create_task(self._save_later())
+
+    async def _save_later(self) -> None:
+        await asyncio.sleep(self.save_delay)
+        await self.flush()
+
+    def _make_command(self, d: CommandDef) -> commands.Command:
+        cmd = commands.command(
+            name=d.name,
+            aliases=list(d.aliases),
+            help=d.help,
+            hidden=d.hidden,
+            parent=self.group
+        )(bind_kwargs(self.coro, **d.kwargs))
+        cmd.cog = self.cog
+        cmd.checks.extend(self.checks)
+        return cmd
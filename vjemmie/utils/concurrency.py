@@ -0,0 +1,112 @@
+import asyncio
+import time
+from collections import deque
+from typing import Any, Awaitable, Deque, Iterable, List
+
+
+async def gather_bounded(aws: Iterable[Awaitable[Any]], limit: int=8) -> List[Any]:
+    """Like `asyncio.gather()`, but runs at most `limit` awaitables
+    concurrently. Results are returned in the order of `aws`.
+
+    Parameters
+    ----------
+    aws : `Iterable[Awaitable[Any]]`
+        Coroutines or futures to await
+    limit : `int`, optional
+        Maximum number of awaitables running at the same time, by default 8
+
+    Returns
+    -------
+    `List[Any]`
+        Results of each awaitable
+    """
+    if limit < 1:
+        raise ValueError("Limit must be a positive integer!")
+
+    sem = asyncio.Semaphore(limit)
+
+    async def run(aw: Awaitable[Any]) -> Any:
+        async with sem:
+            return await aw
+
+    return await asyncio.gather(*[run(aw) for aw in aws])
+
+
+class RateLimiter:
+    """Token bucket rate limiter. Allows bursts of up to `burst` calls,
+    and `rate` calls per second on average.
+
+    Usage:
+
+        limiter = RateLimiter(rate=2, burst=5)
+        async with limiter:
+            await do_request()
+    """
+
+    def __init__(self, rate: float, burst: int=1) -> None:
+        if rate <= 0 or burst < 1:
+            raise ValueError("Rate and burst must be positive!")
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        """Waits until a call is allowed."""
+        # Waiters are served in order, since they queue on the lock
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    async def __aenter__(self) -> "RateLimiter":
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        pass
+
+
+class WindowLimiter:
+    """Sliding window rate limiter. Allows at most `limit` calls in any
+    `period` seconds, which is how Discord counts its rate limits.
+
+    Usage:
+
+        limiter = WindowLimiter(limit=5, period=5.0)
+        async with limiter:
+            await channel.send(...)
+    """
+
+    def __init__(self, limit: int, period: float) -> None:
+        if limit < 1 or period <= 0:
+            raise ValueError("Limit and period must be positive!")
+        self.limit = limit
+        self.period = period
+        self._calls: Deque[float] = deque() # Times of the most recent calls
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        """Waits until a call is allowed."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                while self._calls and self._calls[0] <= now - self.period:
+                    self._calls.popleft()
+                if len(self._calls) < self.limit:
+                    self._calls.append(now)
+                    return
+                await asyncio.sleep(self._calls[0] + self.period - now)
+
+    async def __aenter__(self) -> "WindowLimiter":
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        pass
@@ -0,0 +1,121 @@
+"""
+Random access to entries of delimited text files, such as GPT-2 sample dumps.
+
+Instead of reading a whole file into memory, we build an index of the byte
+offsets of each entry once, and persist it next to the file. Entries are read
+from a memory map, so picking k random entries is O(k) regardless of file size.
+
+All methods are blocking, and should be run in an executor when called
+from a coroutine.
+"""
+import mmap
+import os
+import random
+from array import array
+from pathlib import Path
+from typing import List, Optional, Union
+
+GPT_DELIMITER = "===================="
+INDEX_SUFFIX = ".idx"
+
+
+class GPTFile:
+    """A delimited text file with a persisted offset index.
+
+    The index is stored as `<path>.idx`, and is rebuilt whenever the
+    modification time or size of the file changes.
+    """
+
+    def __init__(self,
+                 path: Union[str, Path],
+                 delimiter: str=GPT_DELIMITER,
+                 encoding: str="utf-8"
+                 ) -> None:
+        self.path = Path(path)
+        self.index_path = self.path.with_name(self.path.name + INDEX_SUFFIX)
+        self.delimiter = delimiter.encode(encoding)
+        self.encoding = encoding
+        self._starts = array("q")
+        self._ends = array("q")
+        self._stamp: Optional[tuple] = None # (mtime_ns, size) of indexed file
+
+    def __len__(self) -> int:
+        self._ensure_index()
+        return len(self._starts)
+
+    def sample(self, k: int) -> List[str]:
+        """Returns `k` random entries. Entries are only repeated if the
+        file has fewer than `k` entries."""
+        self._ensure_index()
+        n = len(self._starts)
+        if not n:
+            raise ValueError(f"{self.path} has no entries")
+        idx = random.sample(range(n), k) if k <= n else random.choices(range(n), k=k)
+
+        with open(self.path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return [
+                mm[self._starts[i]:self._ends[i]].decode(self.encoding, errors="replace")
+                for i in idx
+            ]
+
+    def random(self) -> str:
+        return self.sample(1)[0]
+
+    def _get_stamp(self) -> tuple:
+        st = os.stat(self.path)
+        return (st.st_mtime_ns, st.st_size)
+
+    def _ensure_index(self) -> None:
+        stamp = self._get_stamp()
+        if stamp == self._stamp:
+            return
+        if not self._load_index(stamp):
+            self._build_index()
+            self._save_index(stamp)
+        self._stamp = stamp
+
+    def _load_index(self, stamp: tuple) -> bool:
+        """Loads a persisted index if it matches the current file."""
+        try:
+            with open(self.index_path, "rb") as f:
+                header = array("q")
+                header.fromfile(f, 3)
+                if tuple(header[:2]) != stamp:
+                    return False
+                n = header[2]
+                starts, ends = array("q"), array("q")
+                starts.fromfile(f, n)
+                ends.fromfile(f, n)
+        except (OSError, EOFError):
+            return False
+        self._starts, self._ends = starts, ends
+        return True
+
+    def _build_index(self) -> None:
+        starts, ends = array("q"), array("q")
+        size = self.path.stat().st_size
+        if size:
+            with open(self.path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                pos = 0
+                while pos <= size:
+                    end = mm.find(self.delimiter, pos)
+                    if end == -1:
+                        end = size
+                    # Skip empty entries, e.g. after a trailing delimiter
+                    if mm[pos:end].strip():
+                        starts.append(pos)
+                        ends.append(end)
+                    pos = end + len(self.delimiter)
+        self._starts, self._ends = starts, ends
+
+    def _save_index(self, stamp: tuple) -> None:
+        header = array("q", [*stamp, len(self._starts)])
+        tmp = self.index_path.with_name(self.index_path.name + ".tmp")
+        try:
+            with open(tmp, "wb") as f:
+                header.tofile(f)
+                self._starts.tofile(f)
+                self._ends.tofile(f)
+            os.replace(tmp, self.index_path)
+        except OSError:
+            pass # Read-only directory. Index is rebuilt next time the bot starts
@@ -0,0 +1,186 @@
+"""
+Precomputed command listings for the help commands.
+
+Listing lines of every cog are formatted once, and only reformatted when a
+command of the cog is added or removed. At request time the only work left is
+running the checks of each command, and the result of those is cached per
+(guild, user, roles) for a short while, so repeated help requests don't run
+thousands of checks again.
+"""
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple
+
+from discord.ext import commands
+
+from .patching.commands import add_command_listener, remove_command_listener
+
+# Key: (guild ID, user ID, role IDs, cog name)
+MaskKey = Tuple[Optional[int], int, FrozenSet[int], str]
+
+
+@dataclass(frozen=True)
+class ListingEntry:
+    """Listing lines of a top-level command (and its subcommands)."""
+    command: commands.Command
+    basic: str
+    advanced: str
+
+
+class HelpIndex:
+    """Formatted command listings of every cog.
+
+    Parameters
+    ----------
+    bot : `commands.Bot`
+        Bot whose commands are listed
+    fill_char : `str`, optional
+        Character used to pad command names, by default a non-breaking space
+    mask_size : `int`, optional
+        Max number of cached visibility masks, by default 1024
+    mask_ttl : `float`, optional
+        Seconds a visibility mask is reused, by default 60.0.
+        Checks that depend on something other than the guild, user and roles
+        (such as a role's permissions) are picked up after at most this long,
+        unless `invalidate_masks` is called.
+    """
+
+    def __init__(self,
+                 bot: commands.Bot,
+                 *,
+                 fill_char: str="\xa0",
+                 mask_size: int=1024,
+                 mask_ttl: float=60.0
+                 ) -> None:
+        self.bot = bot
+        self.fill_char = fill_char
+        self.mask_size = mask_size
+        self.mask_ttl = mask_ttl
+
+        self._listings: Dict[str, List[ListingEntry]] = {} # Key: Cog name
+        self._generations: Dict[str, int] = {} # Bumped every time a cog's listing changes
+        self._stale: Set[str] = set()
+        self._all_stale = True # Nothing has been built yet
+
+        # Value: (cog listing generation, expiry time, visible entries)
+        self._masks: "OrderedDict[MaskKey, Tuple[int, float, List[ListingEntry]]]" = OrderedDict()
+
+        add_command_listener(self._on_command_change)
+
+    def close(self) -> None:
+        remove_command_listener(self._on_command_change)
+
+    def _on_command_change(self, command: commands.Command, added: bool) -> None:
+        cog = command.cog
+        if cog is not None:
+            self._stale.add(cog.qualified_name)
+
+    def invalidate(self) -> None:
+        """Marks every listing as stale."""
+        self._all_stale = True
+
+    def invalidate_masks(self) -> None:
+        """Discards all cached visibility masks, such as when the outcome
+        of a check has changed."""
+        self._masks.clear()
+
+    def build(self) -> None:
+        """Formats listings of cogs whose commands have changed, in a single
+        pass over the bot's commands."""
+        if not self._all_stale and not self._stale:
+            return
+        rebuild = None if self._all_stale else set(self._stale)
+        self._all_stale = False
+        self._stale.clear()
+
+        cog_commands: Dict[str, List[commands.Command]] = {}
+        for command in self.bot.commands:
+            if command.cog is None or command.hidden:
+                continue
+            name = command.cog.qualified_name
+            if rebuild is None or name in rebuild:
+                cog_commands.setdefault(name, []).append(command)
+
+        for name in (rebuild if rebuild is not None else set(self._listings) | set(cog_commands)):
+            cmds = sorted(cog_commands.get(name, []), key=lambda cmd: cmd.name)
+            self._listings[name] = [self._format_entry(cmd) for cmd in cmds]
+            self._generations[name] = self._generations.get(name, 0) + 1
+
+    def listing(self, cog: commands.Cog) -> List[ListingEntry]:
+        """Listing entries of a cog, regardless of checks."""
+        self.build()
+        return self._listings.get(cog.qualified_name, [])
+
+    async def visible(self, ctx: commands.Context, cog: commands.Cog) -> List[ListingEntry]:
+        """Listing entries of a cog whose commands can be run in this context."""
+        entries = self.listing(cog)
+        name = cog.qualified_name
+        generation = self._generations.get(name, 0)
+        key = self._mask_key(ctx, name)
+
+        cached = self._masks.get(key)
+        if cached and cached[0] == generation and cached[1] > time.monotonic():
+            self._masks.move_to_end(key)
+            return cached[2]
+
+        visible = [entry for entry in entries if await self._can_run(ctx, entry.command)]
+        self._masks[key] = (generation, time.monotonic() + self.mask_ttl, visible)
+        self._masks.move_to_end(key)
+        if len(self._masks) > self.mask_size:
+            self._masks.popitem(last=False)
+        return visible
+
+    async def render(self, ctx: commands.Context, cog: commands.Cog, advanced: bool=False) -> str:
+        """Listing of a cog's commands that can be run in this context,
+        one line per command."""
+        entries = await self.visible(ctx, cog)
+        return "\n".join(entry.advanced if advanced else entry.basic for entry in entries)
+
+    @staticmethod
+    def _mask_key(ctx: commands.Context, cog_name: str) -> MaskKey:
+        author = ctx.author
+        roles = frozenset(role.id for role in getattr(author, "roles", []))
+        return (ctx.guild.id if ctx.guild else None, author.id, roles, cog_name)
+
+    @staticmethod
+    async def _can_run(ctx: commands.Context, command: commands.Command) -> bool:
+        if not command.enabled:
+            return False
+        try:
+            return await command.can_run(ctx)
+        except commands.CommandError:
+            return False
+
+    def _format_entry(self, command: commands.Command) -> ListingEntry:
+        if isinstance(command, commands.Group):
+            cmds = sorted(command.commands, key=lambda k: k.name)
+            cmds.insert(0, command)
+            group = True
+        else:
+            cmds = [command]
+            group = False
+
+        basic, advanced = [], []
+        for cmd in cmds:
+            # Show bot command prefix if command is not a subcommand
+            subcommand = group and type(cmd) == commands.Command
+            prefix = f"{self.bot.command_prefix}" if not subcommand else ""
+
+            # Add indent to subcommands, and right side padding if no indent
+            indent = f"-{self.fill_char*2}" if subcommand else ""
+            padding = "\xa0"*2 if not indent else ""
+
+            # Add docstring prefix from check
+            doc = cmd.short_doc
+            for check in cmd.checks:
+                if hasattr(check, "doc_prefix"):
+                    doc = f"{check.doc_prefix} {cmd.short_doc}"
+                    break
+
+            name = cmd.name.ljust(20, "\xa0")
+            signature = f"{cmd.name} {cmd.signature}".ljust(35, "\xa0")
+            basic.append(f"`{indent}{prefix}{name}{padding}:` {doc}")
+            advanced.append(f"`{indent}{prefix}{signature}{padding}:` {doc}")
+
+        return ListingEntry(command, "\n".join(basic), "\n".join(advanced))
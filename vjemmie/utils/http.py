@@ -4,20 +4,39 @@ Module intended to abstract away the underlying networking library that is used.
 If, in the future, a better alternative to httpx becomes available, only the
 functions defined in this module have to be modified, as opposed to modifying
 every single call to httpx in every cog.
+
+Every request goes through a single bot-wide `httpx.AsyncClient`, so
+connections are pooled and reused instead of being set up for each request.
 """
-from typing import Any
+from typing import Any, Optional
 
 import httpx
 from httpx import Response
 
+_client: Optional[httpx.AsyncClient] = None
+
+
+def get_client() -> httpx.AsyncClient:
+    """Returns the shared client, creating it on first use."""
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient()
+    return _client
+
+
+async def close_client() -> None:
+    """Closes the shared client. A new one is created on next use."""
+    global _client
+    if _client is not None:
+        client, _client = _client, None
+        await client.aclose()
+
 
 async def get(url, *args, **kwargs) -> Response:
     """Wrapper around the async httpx.get() function"""
-    async with httpx.AsyncClient() as client:
-        return await client.get(url, *args, **kwargs)
+    return await get_client().get(url, *args, **kwargs)
 
 
 async def post(url, *args, **kwargs) -> Response:
-    """Wrapper around the async httpx.get() function"""
-    async with httpx.AsyncClient() as client:
-        return await client.post(url, *args, **kwargs)
\ No newline at end of file
+    """Wrapper around the async httpx.post() function"""
+    return await get_client().post(url, *args, **kwargs)
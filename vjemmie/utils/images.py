@@ -0,0 +1,391 @@
+"""
+Helpers for fitting images within pixel and byte budgets.
+
+All functions in this module are blocking, and should be run in an executor
+when called from a coroutine.
+"""
+import io
+import math
+import time
+from collections import defaultdict, deque
+from dataclasses import dataclass
+from typing import BinaryIO, Callable, Deque, Dict, List, Optional, Sequence, Tuple, Union
+
+from PIL import Image
+
+
+# Encoder stages, in order of preference
+PNG = "png"
+PNG_OPTIMIZED = "png-optimized"
+WEBP = "webp"
+JPEG = "jpeg"
+ENCODER_CHAIN = (PNG, PNG_OPTIMIZED, WEBP, JPEG)
+
+EXTENSIONS = {
+    PNG: "png",
+    PNG_OPTIMIZED: "png",
+    WEBP: "webp",
+    JPEG: "jpg",
+}
+
+# Encoding time (seconds) of the most recent encodes, per encoder stage
+ENCODE_TIMES: Dict[str, Deque[float]] = defaultdict(lambda: deque(maxlen=100))
+
+# Optimizing a PNG rarely shrinks it by more than this factor
+PNG_OPTIMIZE_RATIO = 1.5
+
+
+@dataclass
+class EncodedImage:
+    """An encoded image and the encoder settings that produced it."""
+    data: io.BytesIO
+    stage: str # One of ENCODER_CHAIN
+    quality: Optional[int] # Only set for lossy stages
+    elapsed: float # Seconds spent encoding
+
+    @property
+    def extension(self) -> str:
+        return EXTENSIONS[self.stage]
+
+    @property
+    def size(self) -> int:
+        return self.data.getbuffer().nbytes
+
+    def filename(self, name: str) -> str:
+        return f"{name}.{self.extension}"
+
+
+def scale_to_pixels(width: int,
+                    height: int,
+                    max_pixels: int,
+                    *,
+                    upscale: bool=False
+                    ) -> Tuple[int, int]:
+    """Computes the largest dimensions with the same aspect ratio as
+    `width` x `height` whose area does not exceed `max_pixels`.
+
+    Parameters
+    ----------
+    width : `int`
+        Original width
+    height : `int`
+        Original height
+    max_pixels : `int`
+        Maximum number of pixels (width * height) of the new dimensions
+    upscale : `bool`, optional
+        Scale up dimensions that are smaller than the pixel budget,
+        by default False
+
+    Returns
+    -------
+    `Tuple[int, int]`
+        New width and height
+    """
+    if width < 1 or height < 1:
+        raise ValueError("Width and height must be positive integers!")
+    if max_pixels < 1:
+        raise ValueError("Pixel budget must be a positive integer!")
+
+    area = width * height
+    if area <= max_pixels and not upscale:
+        return width, height
+
+    # Both sides are scaled by the square root of the area ratio
+    factor = math.sqrt(max_pixels / area)
+
+    # Round the width down, and derive the height from it to keep the aspect ratio
+    new_w = max(1, math.floor(width * factor))
+    new_h = max(1, round(new_w * height / width))
+
+    # Rounding the height up can push us above the budget
+    if new_w * new_h > max_pixels:
+        new_h = max(1, max_pixels // new_w)
+
+    return new_w, new_h
+
+
+def resize_to_pixels(image: Image.Image,
+                     max_pixels: int,
+                     *,
+                     upscale: bool=False,
+                     resample: int=Image.BICUBIC
+                     ) -> Image.Image:
+    """Resizes an image to fit within a pixel budget. See `scale_to_pixels()`."""
+    size = scale_to_pixels(*image.size, max_pixels, upscale=upscale)
+    if size == image.size:
+        return image
+    return image.resize(size, resample=resample)
+
+
+def draft_resize(image: Image.Image,
+                 size: Tuple[int, int],
+                 *,
+                 mode: Optional[str]=None,
+                 resample: int=Image.BICUBIC
+                 ) -> Image.Image:
+    """Resizes an image that has not been loaded yet.
+
+    JPEGs are scaled down by a power of two while decoding (see
+    `Image.draft()`), so the full resolution image is never held in memory.
+    The remaining scaling is done by a regular resize.
+
+    Parameters
+    ----------
+    image : `Image.Image`
+        Image returned by `Image.open()`
+    size : `Tuple[int, int]`
+        New width and height
+    mode : `Optional[str]`, optional
+        Mode to convert the image to, by default None
+    resample : `int`, optional
+        Resampling filter, by default Image.BICUBIC
+
+    Returns
+    -------
+    `Image.Image`
+        Resized image
+    """
+    w, h = size
+    if image.format == "JPEG" and w < image.width and h < image.height:
+        # Decoder picks the smallest scale that is still >= size
+        image.draft(mode or image.mode, size)
+    if mode and image.mode != mode:
+        image = image.convert(mode)
+    if image.size != size:
+        image = image.resize(size, resample=resample)
+    return image
+
+
+def open_downscaled(fp: Union[str, BinaryIO],
+                    max_pixels: int,
+                    *,
+                    mode: Optional[str]=None
+                    ) -> Image.Image:
+    """Opens an image, downscaling it to fit within a pixel budget.
+    JPEGs are downscaled during decoding. See `draft_resize()`."""
+    image = Image.open(fp)
+    size = scale_to_pixels(*image.size, max_pixels)
+    return draft_resize(image, size, mode=mode)
+
+
+def split_rows(height: int, tile_height: int, overlap: int) -> List[Tuple[int, int]]:
+    """Splits an image height into overlapping horizontal bands.
+
+    Parameters
+    ----------
+    height : `int`
+        Height of image
+    tile_height : `int`
+        Height of each band
+    overlap : `int`
+        Number of rows shared by consecutive bands
+
+    Returns
+    -------
+    `List[Tuple[int, int]]`
+        Top and bottom (exclusive) row of each band
+    """
+    if overlap >= tile_height:
+        raise ValueError("Overlap must be smaller than tile height!")
+    if height <= tile_height:
+        return [(0, height)]
+
+    step = tile_height - overlap
+    bands = []
+    for top in range(0, height - overlap, step):
+        bottom = min(top + tile_height, height)
+        bands.append((top, bottom))
+        if bottom == height:
+            break
+    return bands
+
+
+def _encode(image: Image.Image, fmt: str, **params) -> io.BytesIO:
+    buf = io.BytesIO()
+    image.save(buf, format=fmt, **params)
+    buf.seek(0)
+    return buf
+
+
+def bisect_quality(encode: Callable[[int], io.BytesIO],
+                   max_bytes: int,
+                   min_quality: int,
+                   max_quality: int
+                   ) -> Tuple[Optional[io.BytesIO], int]:
+    """Finds the highest quality setting whose encoded output fits within
+    `max_bytes`. Returns `(None, min_quality)` if not even `min_quality` fits.
+
+    Encoded size is assumed to grow monotonically with quality, which lets
+    us find the best setting in O(log n) encodes instead of trying every one.
+
+    Parameters
+    ----------
+    encode : `Callable[[int], io.BytesIO]`
+        Function that encodes an image at a given quality
+    max_bytes : `int`
+        Byte budget
+    min_quality : `int`
+        Lowest acceptable quality
+    max_quality : `int`
+        Highest quality to try
+
+    Returns
+    -------
+    `Tuple[Optional[io.BytesIO], int]`
+        Encoded image and the quality it was encoded at
+    """
+    best, best_quality = None, min_quality
+    lo, hi = min_quality, max_quality
+    while lo <= hi:
+        mid = (lo + hi) // 2
+        buf = encode(mid)
+        if buf.getbuffer().nbytes <= max_bytes:
+            best, best_quality = buf, mid
+            lo = mid + 1
+        else:
+            hi = mid - 1
+    return best, best_quality
+
+
+def _fit_lossy(image: Image.Image,
+               max_bytes: int,
+               fmt: str,
+               min_quality: int,
+               max_quality: int,
+               max_attempts: int
+               ) -> Tuple[io.BytesIO, int]:
+    if fmt == "JPEG" and image.mode != "RGB":
+        image = image.convert("RGB")
+
+    for _ in range(max_attempts):
+        encode = lambda q: _encode(image, fmt, quality=q, optimize=True)
+        buf, quality = bisect_quality(encode, max_bytes, min_quality, max_quality)
+        if buf:
+            return buf, quality
+
+        # Shrink image proportionally to how far we are above the budget.
+        # Encoded size roughly scales with area, with some margin for error.
+        size = encode(min_quality).getbuffer().nbytes
+        w, h = image.size
+        target_pixels = int(w * h * (max_bytes / size) * 0.9)
+        if target_pixels < 1:
+            break
+        image = resize_to_pixels(image, target_pixels)
+
+    raise ValueError(f"Unable to fit image within {max_bytes} bytes!")
+
+
+def fit_to_byte_budget(image: Image.Image,
+                       max_bytes: int,
+                       *,
+                       max_pixels: Optional[int]=None,
+                       min_quality: int=20,
+                       max_quality: int=95,
+                       max_attempts: int=5
+                       ) -> io.BytesIO:
+    """Encodes an image as a JPEG no larger than `max_bytes`.
+
+    The highest JPEG quality that fits is found by bisection. If the image
+    doesn't fit even at `min_quality`, it is downscaled by the square root of
+    the ratio between the budget and the encoded size, and the search is repeated.
+
+    Parameters
+    ----------
+    image : `Image.Image`
+        Image to encode
+    max_bytes : `int`
+        Byte budget
+    max_pixels : `Optional[int]`, optional
+        Pixel budget applied before encoding, by default None
+    min_quality : `int`, optional
+        Lowest acceptable JPEG quality, by default 20
+    max_quality : `int`, optional
+        Highest JPEG quality, by default 95
+    max_attempts : `int`, optional
+        Maximum number of times to downscale the image, by default 5
+
+    Raises
+    ------
+    `ValueError`
+        Raised if image cannot be made to fit within the budget
+
+    Returns
+    -------
+    `io.BytesIO`
+        JPEG-encoded image
+    """
+    if max_pixels:
+        image = resize_to_pixels(image, max_pixels)
+    buf, _ = _fit_lossy(image, max_bytes, "JPEG", min_quality, max_quality, max_attempts)
+    return buf
+
+
+def encode_image(image: Image.Image,
+                 max_bytes: int,
+                 *,
+                 chain: Sequence[str]=ENCODER_CHAIN,
+                 min_quality: int=20,
+                 max_quality: int=95
+                 ) -> EncodedImage:
+    """Encodes an image using the first stage of the encoder chain whose
+    output fits within `max_bytes`.
+
+    The default chain tries PNG, optimized PNG, WebP and JPEG, in that order.
+    Lossy stages bisect their quality setting, and the final stage
+    downscales the image if it doesn't fit at `min_quality`.
+
+    Parameters
+    ----------
+    image : `Image.Image`
+        Image to encode
+    max_bytes : `int`
+        Byte budget, e.g. Discord's attachment size limit
+    chain : `Sequence[str]`, optional
+        Encoder stages to try, by default ENCODER_CHAIN
+    min_quality : `int`, optional
+        Lowest acceptable quality for lossy stages, by default 20
+    max_quality : `int`, optional
+        Highest quality for lossy stages, by default 95
+
+    Raises
+    ------
+    `ValueError`
+        Raised if no stage can fit the image within the budget
+
+    Returns
+    -------
+    `EncodedImage`
+        The encoded image
+    """
+    if not chain:
+        raise ValueError("Encoder chain cannot be empty!")
+
+    start = time.perf_counter()
+    png_size = None
+    for stage in chain:
+        buf, quality = None, None
+        if stage == PNG:
+            buf = _encode(image, "PNG")
+            png_size = buf.getbuffer().nbytes
+        elif stage == PNG_OPTIMIZED:
+            # Don't bother optimizing if the unoptimized PNG is way too big
+            if png_size and png_size > max_bytes * PNG_OPTIMIZE_RATIO:
+                continue
+            buf = _encode(image, "PNG", optimize=True)
+        elif stage in (WEBP, JPEG):
+            fmt = "WEBP" if stage == WEBP else "JPEG"
+            if stage == chain[-1]:
+                # Last resort, downscale image until it fits
+                buf, quality = _fit_lossy(image, max_bytes, fmt, min_quality, max_quality, 5)
+            else:
+                encode = lambda q: _encode(image, fmt, quality=q)
+                buf, quality = bisect_quality(encode, max_bytes, min_quality, max_quality)
+        else:
+            raise ValueError(f"Unknown encoder stage '{stage}'")
+
+        if buf and buf.getbuffer().nbytes <= max_bytes:
+            elapsed = time.perf_counter() - start
+            ENCODE_TIMES[stage].append(elapsed)
+            return EncodedImage(data=buf, stage=stage, quality=quality, elapsed=elapsed)
+
+    raise ValueError(f"Unable to fit image within {max_bytes} bytes!")
@@ -1,28 +1,216 @@
+"""
+Writing JSON files without blocking the event loop.
+
+Writes go through a `JSONWriter`, which serializes and writes files in a
+worker thread. Writes are atomic (temporary file, fsync, then rename), so a
+crash mid-write never leaves a truncated file behind. Writes to the same file
+are coalesced: while one is in progress, further writes only replace the
+object that is written next, and everyone waiting for them is done once it is.
+
+Encodes with orjson if it is installed, otherwise with the standard library.
+Output is compact, not indented.
+
+Call `flush()` (or `flush_blocking()` once the event loop has stopped)
+before shutting down, so deferred writes aren't lost.
+"""
+import asyncio
 import json
-from typing import Any, Union
-from pathlib import Path
+import os
+import tempfile
+import threading
+from contextlib import suppress
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from . import caching
+from .printing import eprint
+
+orjson = None
+with suppress(ImportError):
+    import orjson # poetry run pip install orjson
+
+DEFER_DELAY = 2.0 # Seconds deferred writes wait for further changes before writing
+
+
+def encode(obj: Any, default: Optional[Callable[[Any], Any]]=None) -> bytes:
+    """Serializes an object to compact UTF-8 encoded JSON."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, default=default, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            pass # orjson doesn't serialize some types (such as namedtuples)
+    return json.dumps(obj, default=default, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def write_atomic(path: str, data: bytes) -> None:
+    """Replaces the contents of a file, never leaving it partially written."""
+    directory, filename = os.path.split(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(prefix=f".{filename}.", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        # mkstemp creates files only readable by us
+        try:
+            os.chmod(tmp, os.stat(path).st_mode)
+        except FileNotFoundError:
+            os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        with suppress(OSError):
+            os.remove(tmp)
+        raise
+
+
+@dataclass
+class _PendingWrite:
+    obj: Any
+    default: Optional[Callable[[Any], Any]]
+    version: int
+    waiters: List[asyncio.Future] = field(default_factory=list)
+    urgent: asyncio.Event = field(default_factory=asyncio.Event) # Set when someone waits for the write
+
+
+class JSONWriter:
+    """Writes JSON files in a worker thread, coalescing writes per file.
+
+    Each write gets an increasing version number, and a file is never
+    overwritten by an older version than the one it contains. Blocking and
+    asynchronous writes to the same file can therefore be mixed freely.
+    """
 
-from aiofile import AIOFile
+    def __init__(self) -> None:
+        self._pending: Dict[str, _PendingWrite] = {} # Key: Path
+        self._tasks: Dict[str, asyncio.Task] = {} # Key: Path
+        self._written: Dict[str, int] = {} # Key: Path, Value: Version on disk
+        self._locks: Dict[str, threading.Lock] = {} # Key: Path
+        self._version = 0
+        self._version_lock = threading.Lock()
 
-from .wsl import in_wsl
+    def _next_version(self) -> int:
+        with self._version_lock:
+            self._version += 1
+            return self._version
+
+    def _commit(self, path: str, version: int, data: bytes) -> None:
+        with self._locks.setdefault(path, threading.Lock()):
+            if self._written.get(path, 0) > version:
+                return # Superseded by a newer version
+            write_atomic(path, data)
+            self._written[path] = version
+        caching.invalidate(path)
+
+    def _encode_and_commit(self, path: str, pending: _PendingWrite) -> None:
+        self._commit(path, pending.version, encode(pending.obj, pending.default))
+
+    def _enqueue(self, path: str, obj: Any, default: Optional[Callable], delay: float) -> _PendingWrite:
+        version = self._next_version()
+        pending = self._pending.get(path)
+        if pending:
+            pending.obj, pending.default, pending.version = obj, default, version
+        else:
+            pending = self._pending[path] = _PendingWrite(obj, default, version)
+        if path not in self._tasks:
+            self._tasks[path] = asyncio.get_event_loop().create_task(self._run(path, delay))
+        return pending
+
+    async def _run(self, path: str, delay: float) -> None:
+        loop = asyncio.get_event_loop()
+        try:
+            while path in self._pending:
+                pending = self._pending[path]
+                if delay and not pending.waiters:
+                    # Cut the delay short if someone starts waiting for the write
+                    with suppress(asyncio.TimeoutError):
+                        await asyncio.wait_for(pending.urgent.wait(), delay)
+                pending = self._pending.pop(path)
+                try:
+                    try:
+                        await loop.run_in_executor(None, self._encode_and_commit, path, pending)
+                    except RuntimeError:
+                        # Object was modified while it was being encoded,
+                        # encode it here where nothing else can touch it.
+                        data = encode(pending.obj, pending.default)
+                        await loop.run_in_executor(None, self._commit, path, pending.version, data)
+                except Exception as e:
+                    if not pending.waiters:
+                        eprint(f"Failed to write {path}: {e}")
+                    for waiter in pending.waiters:
+                        if not waiter.done():
+                            waiter.set_exception(e)
+                else:
+                    for waiter in pending.waiters:
+                        if not waiter.done():
+                            waiter.set_result(None)
+        finally:
+            del self._tasks[path]
+
+    async def write(self, path: str, obj: Any, default: Optional[Callable[[Any], Any]]=None) -> None:
+        """Writes an object to a file, returning once it (or a
+        newer object written to the same file) is on disk.
+        A deferred write to the same file is written right away."""
+        waiter = asyncio.get_event_loop().create_future()
+        pending = self._enqueue(path, obj, default, 0)
+        pending.waiters.append(waiter)
+        pending.urgent.set()
+        await waiter
+
+    def write_later(self,
+                    path: str,
+                    obj: Any,
+                    default: Optional[Callable[[Any], Any]]=None,
+                    delay: float=DEFER_DELAY
+                    ) -> None:
+        """Schedules a write, without waiting for it. Writes made to the same
+        file in the following `delay` seconds are combined into one.
+        Writes right away if no event loop is running."""
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return self.write_blocking(path, obj, default)
+        self._enqueue(path, obj, default, delay)
+
+    def write_blocking(self, path: str, obj: Any, default: Optional[Callable[[Any], Any]]=None) -> None:
+        """Writes an object to a file in the current thread."""
+        self._commit(path, self._next_version(), encode(obj, default))
+
+    async def flush(self) -> None:
+        """Waits until every scheduled write is on disk."""
+        while self._tasks:
+            await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+    def flush_blocking(self) -> None:
+        """Writes every scheduled write in the current thread.
+        Used on shutdown, after the event loop has stopped."""
+        for path in list(self._pending):
+            pending = self._pending.pop(path)
+            try:
+                self._encode_and_commit(path, pending)
+            except Exception as e:
+                eprint(f"Failed to write {path}: {e}")
+
+
+WRITER = JSONWriter()
 
 
 async def dump_json(fp: str, obj: Any, default: Any=None) -> None:
-    d = json.dumps(obj, indent=4, default=default)
-    async with AIOFile(fp, "w") as f:
-        await f.write(d)
+    await WRITER.write(fp, obj, default)
+
+
+def dump_json_later(fp: str, obj: Any, default: Any=None, delay: float=DEFER_DELAY) -> None:
+    """Non-blocking, non-async write for code that doesn't need to wait for it."""
+    WRITER.write_later(fp, obj, default, delay)
 
 
 def dump_json_blocking(fp: str, obj: Any, default: Any=None) -> None:
     """Blocking fallback."""
-    d = json.dumps(obj, indent=4, default=default)
-    with open(fp, "w") as f:
-        f.write(d)
+    WRITER.write_blocking(fp, obj, default)
+
+
+async def flush() -> None:
+    await WRITER.flush()
 
 
-if in_wsl():
-    # AIOFile doesn't seem to work on Microsoft's 4.4.0-18362 Linux kernel
-    # Warning received on startup: <frozen importlib._bootstrap>:219: RuntimeWarning: Linux supports fsync/fdsync with io_submit since 4.18 but current kernel 4.4.0-18362-Microsoft doesn't support it. Related calls will have no effect.
-    async def blocking_dump(fp: str, obj: Any, default: Any=None) -> None:
-        return dump_json_blocking(fp, obj, default)
-    dump_json = blocking_dump
+def flush_blocking() -> None:
+    WRITER.flush_blocking()
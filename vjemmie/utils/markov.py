@@ -0,0 +1,352 @@
+"""
+On-disk store for markovify text models.
+
+Models are saved in markovify's JSON form, together with the IDs of the
+texts they were trained on. This lets us load models on startup instead of
+rebuilding them, and train existing models on new texts only.
+"""
+import asyncio
+import itertools
+import json
+import os
+import re
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import (Callable, Deque, Dict, Iterable, Iterator, List, Mapping,
+                    Optional, Set, Tuple, Union)
+
+import markovify
+from markovify import NewlineText
+
+from ..config import (MARKOV_DIR, MARKOV_POOL_BATCH, MARKOV_POOL_INTERVAL,
+                      MARKOV_POOL_SIZE)
+from .printing import eprint
+
+# Bump when changing the layout of saved models. Models saved with a
+# different version (or markovify version) are discarded and rebuilt.
+MODEL_VERSION = 1
+
+# Keys are used as file names, so they are limited to subreddit/Twitter username characters
+KEY_PATTERN = re.compile(r"[A-Za-z0-9_]+")
+
+
+class StreamingNewlineText(NewlineText):
+    """NewlineText that splits an iterable of texts into sentences lazily.
+
+    Markovify collects the sentences of every text in a list before building
+    the chain. Combined with `retain_original=False`, this builds the chain
+    while the texts are being consumed, without holding all of them in memory.
+    """
+
+    def generate_corpus(self, text: Union[str, Iterable[str]]) -> Iterator[List[str]]:
+        if isinstance(text, str):
+            return super().generate_corpus(text)
+        sentences = (sentence for line in text for sentence in self.sentence_split(line))
+        return map(self.word_split, filter(self.test_sentence_input, sentences))
+
+
+@dataclass
+class StoredModel:
+    model: NewlineText
+    sources: Set[str] = field(default_factory=set) # IDs of texts the model is trained on
+    created: float = field(default_factory=time.time)
+    updated: float = field(default_factory=time.time)
+
+    @property
+    def age(self) -> float:
+        """Seconds since model was last updated."""
+        return time.time() - self.updated
+
+
+class MarkovStore:
+    """Text models of a single namespace, e.g. `"twitter"`, kept in memory
+    and persisted to `MARKOV_DIR/<namespace>/<key>.json`.
+
+    All methods that touch the disk or train models run in an executor.
+
+    If `retain_original` is False, models don't keep a copy of the texts
+    they are trained on. They use a lot less memory, but generated sentences
+    are no longer checked for overlap with the original texts.
+    """
+
+    def __init__(self, namespace: str, state_size: int=2, retain_original: bool=True) -> None:
+        self.path = Path(MARKOV_DIR) / namespace
+        self.state_size = state_size
+        self.retain_original = retain_original
+        self.models: Dict[str, StoredModel] = {}
+        self._locks: Dict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.models
+
+    @staticmethod
+    def is_valid_key(key: str) -> bool:
+        return KEY_PATTERN.fullmatch(key) is not None
+
+    def get(self, key: str) -> Optional[StoredModel]:
+        """Returns a model if it is loaded. Does not touch the disk."""
+        return self.models.get(key)
+
+    async def load(self, key: str) -> Optional[StoredModel]:
+        """Returns a model, loading it from disk if necessary.
+        Returns None if no valid model is saved.
+
+        Raises `ValueError` if `key` is not a valid model name."""
+        self._get_file(key)
+        async with self._locks[key]:
+            if key not in self.models:
+                loop = asyncio.get_event_loop()
+                stored = await loop.run_in_executor(None, self._load_file, key)
+                if stored:
+                    self.models[key] = stored
+            return self.models.get(key)
+
+    async def load_all(self) -> None:
+        """Loads every saved model that is not already loaded.
+        Meant to be run as a background task on startup."""
+        if not self.path.exists():
+            return
+        for p in self.path.iterdir():
+            if p.suffix == ".json" and self.is_valid_key(p.stem):
+                await self.load(p.stem)
+
+    async def update(self, key: str, texts: Union[Mapping[str, str], Iterable[Tuple[str, str]]]) -> StoredModel:
+        """Trains a model on texts it has not seen before, and saves it.
+        The model is created if it doesn't exist.
+
+        Parameters
+        ----------
+        key : `str`
+            Name of model
+        texts : `Union[Mapping[str, str], Iterable[Tuple[str, str]]]`
+            Texts to train on, keyed by a unique ID (tweet URL, post ID, etc.)
+            Can be a lazy iterable of (ID, text) pairs, which is consumed
+            in an executor while the model is being built.
+
+        Raises
+        ------
+        `ValueError`
+            Raised if `key` is not a valid model name, or if the model
+            doesn't exist and there are no texts to create it from
+
+        Returns
+        -------
+        `StoredModel`
+            The updated model
+        """
+        await self.load(key)
+        async with self._locks[key]:
+            loop = asyncio.get_event_loop()
+            stored = self.models.get(key)
+            stored = await loop.run_in_executor(None, self._train, stored, texts)
+            if not stored:
+                raise ValueError("No text to create a model from")
+            self.models[key] = stored
+            await loop.run_in_executor(None, self._save_file, key, stored)
+        return stored
+
+    def _train(self,
+               stored: Optional[StoredModel],
+               texts: Union[Mapping[str, str], Iterable[Tuple[str, str]]]
+               ) -> Optional[StoredModel]:
+        if isinstance(texts, Mapping):
+            texts = texts.items()
+        seen = stored.sources if stored else set()
+        new: Set[str] = set()
+
+        def new_texts() -> Iterator[str]:
+            for _id, text in texts:
+                if text and _id not in seen and _id not in new:
+                    new.add(_id)
+                    yield text
+
+        # Markovify can't build a chain from an empty corpus
+        corpus = new_texts()
+        first = next(corpus, None)
+        if first is None:
+            if stored:
+                stored.updated = time.time()
+            return stored
+
+        # Texts are fed to the chain one by one, instead of being joined
+        # into a single string first
+        model = StreamingNewlineText(
+            itertools.chain([first], corpus),
+            state_size=self.state_size,
+            retain_original=self.retain_original
+        )
+        if not stored:
+            return StoredModel(model, new)
+
+        # Combining sums the transition counts of both chains, which gives
+        # the same model as a full rebuild without re-parsing old texts.
+        return StoredModel(
+            markovify.combine([stored.model, model]),
+            seen | new,
+            created=stored.created
+        )
+
+    def _get_file(self, key: str) -> Path:
+        if not self.is_valid_key(key):
+            raise ValueError(f"Invalid model name: {key!r}")
+        return self.path / f"{key}.json"
+
+    def _load_file(self, key: str) -> Optional[StoredModel]:
+        p = self._get_file(key)
+        try:
+            with open(p, "r", encoding="utf-8") as f:
+                d = json.load(f)
+        except FileNotFoundError:
+            return None
+        except json.JSONDecodeError:
+            print(f"Discarding corrupt markov model {p}")
+            return None
+
+        if (
+            d.get("version") != MODEL_VERSION
+            or d.get("markovify") != markovify.__version__
+            or d.get("state_size") != self.state_size
+            or d.get("retain_original", True) != self.retain_original
+        ):
+            return None # Stale model, rebuilt on next update
+
+        return StoredModel(
+            model=NewlineText.from_dict(d["model"]),
+            sources=set(d["sources"]),
+            created=d["created"],
+            updated=d["updated"]
+        )
+
+    def _save_file(self, key: str, stored: StoredModel) -> None:
+        self.path.mkdir(parents=True, exist_ok=True)
+        d = {
+            "version": MODEL_VERSION,
+            "markovify": markovify.__version__,
+            "state_size": self.state_size,
+            "retain_original": self.retain_original,
+            "created": stored.created,
+            "updated": stored.updated,
+            "sources": sorted(stored.sources),
+            "model": stored.model.to_dict(),
+        }
+        # Write to temp file first so a crash never leaves a half-written model
+        p = self._get_file(key)
+        tmp = p.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(d, f)
+        os.replace(tmp, p)
+
+
+@dataclass
+class PoolStats:
+    hits: int = 0
+    underruns: int = 0 # Requests made while the pool was empty
+    generated: int = 0
+    failed: int = 0 # Generation attempts that returned no sentence or raised
+
+
+class SentencePool:
+    """Pre-generated sentences for the models of a `MarkovStore`.
+
+    A background task tops up the pool of every model that has been
+    requested at least once, so commands can pop a ready sentence instead of
+    generating one on demand. Generation runs in a single dedicated thread,
+    so refilling never competes with commands for the default executor.
+    """
+
+    def __init__(self,
+                 store: MarkovStore,
+                 generate: Callable[[NewlineText], Optional[str]],
+                 *,
+                 size: int=MARKOV_POOL_SIZE,
+                 batch: int=MARKOV_POOL_BATCH,
+                 interval: float=MARKOV_POOL_INTERVAL
+                 ) -> None:
+        """
+        Parameters
+        ----------
+        store : `MarkovStore`
+            Store whose models sentences are generated from
+        generate : `Callable[[NewlineText], Optional[str]]`
+            Function that generates a sentence from a model
+        size : `int`, optional
+            Number of sentences kept per model, by default MARKOV_POOL_SIZE
+        batch : `int`, optional
+            Max sentences generated per model per refill, by default MARKOV_POOL_BATCH
+        interval : `float`, optional
+            Seconds between refills, by default MARKOV_POOL_INTERVAL
+        """
+        self.store = store
+        self.generate = generate
+        self.size = size
+        self.batch = batch
+        self.interval = interval
+        self.pools: Dict[str, Deque[str]] = defaultdict(deque)
+        self.stats: Dict[str, PoolStats] = defaultdict(PoolStats)
+        self._generations: Dict[str, int] = defaultdict(int) # Bumped by clear()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._task: Optional[asyncio.Task] = None
+
+    def pop(self, key: str) -> Optional[str]:
+        """Returns a pre-generated sentence, or None if the pool is empty.
+        Marks the model as active, so its pool is topped up from now on."""
+        pool = self.pools[key]
+        if not pool:
+            self.stats[key].underruns += 1
+            return None
+        self.stats[key].hits += 1
+        return pool.popleft()
+
+    def clear(self, key: str) -> None:
+        """Discards sentences of a model, e.g. after it has been retrained.
+        Sentences still being generated from the old model are discarded too."""
+        self._generations[key] += 1
+        if key in self.pools:
+            self.pools[key].clear()
+
+    def start(self) -> None:
+        if not self._task or self._task.done():
+            self._task = asyncio.get_event_loop().create_task(self._refill_loop())
+
+    def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+        self._executor.shutdown(wait=False)
+
+    async def _refill_loop(self) -> None:
+        while True:
+            try:
+                await self.refill()
+            except Exception as e:
+                eprint(f"Failed to refill sentence pools: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def refill(self) -> None:
+        loop = asyncio.get_event_loop()
+        for key, pool in list(self.pools.items()):
+            stored = self.store.get(key)
+            if not stored:
+                continue
+            n = min(self.batch, self.size - len(pool))
+            if n < 1:
+                continue
+            generation = self._generations[key]
+            try:
+                sentences = await loop.run_in_executor(self._executor, self._generate_many, stored.model, n)
+            except Exception as e:
+                # Keep refilling the other pools (and this one next time)
+                self.stats[key].failed += n
+                eprint(f"Failed to generate sentences for {key}: {e}")
+                continue
+            if self._generations[key] != generation:
+                continue # Model was replaced while generating
+            pool.extend(sentences)
+            self.stats[key].generated += len(sentences)
+            self.stats[key].failed += n - len(sentences)
+
+    def _generate_many(self, model: NewlineText, n: int) -> List[str]:
+        sentences = (self.generate(model) for _ in range(n))
+        return [s for s in sentences if s]
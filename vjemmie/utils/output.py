@@ -0,0 +1,185 @@
+"""
+Sending long outputs to Discord in as few messages as possible.
+
+Text is split at line boundaries, embeds are packed up to 10 per message
+(within Discord's 6000 character total per message), and messages to
+each channel are sent one output at a time, paced by a sliding window that
+stays under Discord's per-channel rate limit instead of running into it.
+"""
+import asyncio
+from dataclasses import dataclass, field
+from typing import Iterable, List, Optional, Sequence, Union
+
+import discord
+from discord.ext import commands
+from discord.http import Route
+
+from .caching import Cache
+from .concurrency import WindowLimiter
+
+MAX_EMBEDS = 10 # Max embeds per message
+MAX_EMBED_TOTAL = 6000 # Max characters of all embeds in a message combined
+
+# Discord allows 5 messages per 5 seconds per channel
+CHANNEL_LIMIT = 5
+CHANNEL_PERIOD = 5.0
+
+
+def split_chunks(text: str, limit: int) -> List[str]:
+    """Splits a string into `limit` long chunks."""
+    return [text[i:i+limit] for i in range(0, len(text), limit)]
+
+
+def split_lines(text: str, limit: int, strict: bool=False) -> List[str]:
+    """Splits a string into chunks of at most `limit` characters,
+    only between lines if possible.
+
+    Each chunk is a single slice of `text`, found in one pass over it.
+
+    Parameters
+    ----------
+    text : `str`
+        String to split
+    limit : `int`
+        Max length of a chunk
+    strict : `bool`, optional
+        Raise an exception if a line is longer than `limit`,
+        instead of splitting the line, by default False
+
+    Returns
+    -------
+    `List[str]`
+        Chunks of `text`. Their concatenation is `text`.
+    """
+    if len(text) <= limit:
+        return [text]
+
+    chunks = []
+    start = 0 # Start of current chunk
+    line_start = 0
+    while line_start < len(text):
+        line_end = text.find("\n", line_start) + 1 or len(text)
+
+        if line_end - line_start > limit:
+            if strict:
+                raise discord.DiscordException("Unable to split string. Line length exceeds limit!")
+            if start < line_start:
+                chunks.append(text[start:line_start])
+            # Long line gets chunks of its own, the last one is continued
+            pieces = split_chunks(text[line_start:line_end], limit)
+            chunks.extend(pieces[:-1])
+            start = line_end - len(pieces[-1])
+        elif line_end - start > limit:
+            chunks.append(text[start:line_start])
+            start = line_start
+        line_start = line_end
+
+    if start < len(text):
+        chunks.append(text[start:])
+    return chunks
+
+
+def pack_embeds(embeds: Iterable[discord.Embed]) -> List[List[discord.Embed]]:
+    """Groups embeds, in order, into as few messages as possible."""
+    messages: List[List[discord.Embed]] = []
+    total = 0
+    for embed in embeds:
+        size = len(embed)
+        if not messages or len(messages[-1]) == MAX_EMBEDS or total + size > MAX_EMBED_TOTAL:
+            messages.append([])
+            total = 0
+        messages[-1].append(embed)
+        total += size
+    return messages
+
+
+@dataclass
+class _ChannelQueue:
+    limiter: WindowLimiter
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock) # Held while an output is being sent
+
+
+class Sender:
+    """Sends messages in order, paced per channel.
+
+    Parameters
+    ----------
+    max_channels : `int`, optional
+        Max number of channels whose pacing state is kept, by default 1000
+    limit : `int`, optional
+        Max messages per channel in any `period` seconds, by default `CHANNEL_LIMIT`
+    period : `float`, optional
+        Length of the rate limit window in seconds, by default `CHANNEL_PERIOD`
+    """
+
+    def __init__(self, max_channels: int=1000, limit: int=CHANNEL_LIMIT, period: float=CHANNEL_PERIOD) -> None:
+        self.limit = limit
+        self.period = period
+        self._queues = Cache(max_items=max_channels) # Key: Channel ID
+
+    async def _get_queue(self, channel: discord.abc.Messageable) -> _ChannelQueue:
+        # NOTE: Messageable._get_channel() resolves contexts and users to their channel
+        key = (await channel._get_channel()).id
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = _ChannelQueue(WindowLimiter(self.limit, self.period))
+            self._queues.set(key, queue)
+        return queue
+
+    async def send_text(self, channel: discord.abc.Messageable, chunks: Sequence[str]) -> List[discord.Message]:
+        """Sends each chunk as a message."""
+        queue = await self._get_queue(channel)
+        messages = []
+        async with queue.lock:
+            for chunk in chunks:
+                await queue.limiter.acquire()
+                messages.append(await channel.send(chunk))
+        return messages
+
+    async def send_embeds(self,
+                          channel: discord.abc.Messageable,
+                          embeds: Sequence[discord.Embed],
+                          content: Optional[str]=None
+                          ) -> List[discord.Message]:
+        """Sends embeds in as few messages as possible.
+        `content` is added to the first message."""
+        queue = await self._get_queue(channel)
+        messages = []
+        async with queue.lock:
+            for i, group in enumerate(pack_embeds(embeds)):
+                await queue.limiter.acquire()
+                messages.append(await _send_embeds(channel, group, content if i == 0 else None))
+        return messages
+
+
+async def _send_embeds(channel: discord.abc.Messageable,
+                       embeds: List[discord.Embed],
+                       content: Optional[str]=None
+                       ) -> discord.Message:
+    if len(embeds) == 1:
+        return await channel.send(content=content, embed=embeds[0])
+
+    # NOTE: Messageable.send() only takes a single embed in discord.py 1.x,
+    # so the request is made the same way, with a list of embeds.
+    channel = await channel._get_channel()
+    state = channel._state
+    payload = {"embeds": [embed.to_dict() for embed in embeds]}
+    if content is not None:
+        payload["content"] = str(content)
+    route = Route("POST", "/channels/{channel_id}/messages", channel_id=channel.id)
+    data = await state.http.request(route, json=payload)
+    return state.create_message(channel=channel, data=data)
+
+
+SENDER = Sender()
+
+
+async def send_text(channel: Union[discord.abc.Messageable, commands.Context], chunks: Sequence[str]) -> List[discord.Message]:
+    return await SENDER.send_text(channel, chunks)
+
+
+async def send_embeds(channel: Union[discord.abc.Messageable, commands.Context],
+                      embeds: Sequence[discord.Embed],
+                      content: Optional[str]=None
+                      ) -> List[discord.Message]:
+    return await SENDER.send_embeds(channel, embeds, content)
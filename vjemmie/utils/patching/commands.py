@@ -1,5 +1,11 @@
+from typing import Callable, List, Type
+
 from discord.ext.commands import converter as converters
-from discord.ext.commands import Command
+from discord.ext.commands import Command, GroupMixin
+
+# Called with (command, added) whenever a command is added or removed
+CommandListener = Callable[[Command, bool], None]
+_COMMAND_LISTENERS: List[CommandListener] = []
 
 @property
 def signature(self):
@@ -52,3 +58,38 @@ def patch_command_signature(cmd: Command) -> Command:
 def help_doc(instance) -> str:
     # Only show up to method param list if it exists
     return instance.help.split("\nParameters")[0] if instance.help else ""
+
+
+def add_command_listener(listener: CommandListener) -> None:
+    """Registers a function that is called whenever a command is added to or
+    removed from the bot or a group. Requires `patch_command_listeners`."""
+    _COMMAND_LISTENERS.append(listener)
+
+
+def remove_command_listener(listener: CommandListener) -> None:
+    _COMMAND_LISTENERS.remove(listener)
+
+
+def _notify(command: Command, added: bool) -> None:
+    for listener in _COMMAND_LISTENERS:
+        listener(command, added)
+
+
+def patch_command_listeners(mixin: Type[GroupMixin]) -> None:
+    """Patches `add_command` and `remove_command` of `discord.ext.commands.GroupMixin`
+    (the bot and command groups) to notify listeners added with `add_command_listener`."""
+    add_command = mixin.add_command
+    remove_command = mixin.remove_command
+
+    def _add_command(self, command):
+        add_command(self, command)
+        _notify(command, True)
+
+    def _remove_command(self, name):
+        command = remove_command(self, name)
+        if command is not None:
+            _notify(command, False)
+        return command
+
+    mixin.add_command = _add_command
+    mixin.remove_command = _remove_command
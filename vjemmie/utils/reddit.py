@@ -0,0 +1,715 @@
+"""
+Shared, persistent cache of subreddit listings.
+
+Listings are keyed by (subreddit, sorting, time) and shared by every guild,
+so each listing is only fetched once no matter how many guilds request it.
+Posts are stored as slim `Post` records instead of raw API responses, which
+keeps memory usage down and lets us save the cache to disk.
+
+Which posts have already been shown is tracked per guild, separately from the
+listings themselves.
+
+Listings that are requested often are refreshed ahead of time in the
+background, so users rarely have to wait for a fetch.
+
+Listings are fetched with `RedditClient`, which talks to reddit's API directly
+on the event loop, so fetches don't occupy executor threads.
+"""
+import asyncio
+import itertools
+import json
+import os
+import random
+import time
+from collections import defaultdict, deque
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import (Any, Awaitable, Callable, Deque, Dict, Iterator, List,
+                    Optional, Set, Tuple)
+
+import httpx
+
+from ..config import REDDIT_API_URL, REDDIT_AUTH_URL
+from .concurrency import RateLimiter
+from .http import get_client
+
+# Bump when changing the layout of saved listings
+CACHE_VERSION = 1
+
+IMAGE_EXTENSIONS = (".jpeg", ".jpg", ".png", ".gif", ".webp")
+
+# Post kinds
+IMAGE = "image"
+TEXT = "text"
+VIDEO = "video"
+
+# Seconds before a listing is refetched, per time filter. "hot" listings change the fastest.
+LISTING_TTL = {
+    "hot": 3600,
+    "day": 2 * 3600,
+    "week": 12 * 3600,
+    "month": 86400,
+    "year": 86400,
+    "all": 86400,
+}
+DEFAULT_TTL = 86400
+
+# Listings that have been expired for this long are not saved to disk
+MAX_STALE_AGE = 7 * 86400
+
+# Refresh-ahead settings
+POPULARITY_WINDOW = 3600 # Seconds requests are counted over
+POPULAR_REQUESTS = 3 # Requests within window before a listing is refreshed ahead of time
+REFRESH_AHEAD = 0.8 # Refresh listings after this fraction of their TTL
+REFRESH_WATERMARK = 10 # Refresh listings when a guild has fewer unseen posts than this
+MIN_REFRESH_AGE = 600 # But never refresh listings younger than this (seconds)
+PREFETCH_CONCURRENCY = 2 # Max background refreshes at the same time
+FETCH_RATE = 0.5 # Max listing fetches per second, foreground and background combined
+
+# (subreddit, sorting, time)
+ListingKey = Tuple[str, str, str]
+
+
+def make_key(subreddit: str, sorting: str, time: str) -> ListingKey:
+    # Time filter has no effect on "hot" listings
+    return (subreddit.lower(), sorting, "" if sorting == "hot" else time)
+
+
+def _key_to_str(key: ListingKey) -> str:
+    return "/".join(key)
+
+
+def _str_to_key(s: str) -> ListingKey:
+    subreddit, sorting, time = s.split("/")
+    return subreddit, sorting, time
+
+
+@dataclass
+class Post:
+    """The parts of a reddit submission that we actually use."""
+    id: str
+    title: str
+    url: str
+    selftext: str
+    video_url: Optional[str] # Fallback URL of reddit-hosted video
+    has_media: bool # Post has embedded media (reddit video, youtube, etc.)
+    over_18: bool
+    kind: Optional[str] = field(init=False) # IMAGE, TEXT, VIDEO or None if unsupported
+
+    def __post_init__(self) -> None:
+        # Classify once, so picking a post of a given kind doesn't have to inspect every post
+        if self.video_url:
+            self.kind = VIDEO
+        elif self.has_media:
+            self.kind = None # Embedded media other than reddit videos
+        elif self.is_image:
+            self.kind = IMAGE
+        else:
+            self.kind = TEXT
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "Post":
+        """Creates a Post from the `data` object of a listing child."""
+        media = data.get("media") or {}
+        video = media.get("reddit_video") or {}
+        return cls(
+            id=data["id"],
+            title=data["title"],
+            url=data.get("url", ""),
+            selftext=data.get("selftext", ""),
+            video_url=video.get("fallback_url"),
+            has_media=bool(data.get("media")),
+            over_18=data.get("over_18", False),
+        )
+
+    @property
+    def is_image(self) -> bool:
+        return bool(self.url) and self.url.endswith(IMAGE_EXTENSIONS)
+
+    def to_list(self) -> list:
+        return [self.id, self.title, self.url, self.selftext, self.video_url, self.has_media, self.over_18]
+
+
+@dataclass
+class Listing:
+    posts: List[Post]
+    fetched_at: float = field(default_factory=time.time)
+    ttl: float = DEFAULT_TTL
+    extra: int = 0 # Number of posts at the end added by `RedditSubmissions.extend`
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.fetched_at
+
+    @property
+    def expired(self) -> bool:
+        return self.age > self.ttl
+
+
+class PostPool:
+    """Unseen posts of a listing for a single guild, partitioned by kind."""
+
+    def __init__(self, posts: List[Post]) -> None:
+        self.posts: Dict[str, List[Post]] = defaultdict(list)
+        for post in posts:
+            if post.kind:
+                self.posts[post.kind].append(post)
+
+    def __len__(self) -> int:
+        return sum(len(posts) for posts in self.posts.values())
+
+    def pop(self, kinds: Tuple[str, ...], allow_nsfw: bool=True) -> Optional[Post]:
+        """Removes and returns a random post of one of the given kinds.
+        Every matching post is equally likely to be picked.
+        NSFW posts are left in the pool if `allow_nsfw` is False."""
+        skipped = []
+        try:
+            while True:
+                post = self._pop_random(kinds)
+                if post is None or allow_nsfw or not post.over_18:
+                    return post
+                skipped.append(post)
+        finally:
+            for post in skipped:
+                self.posts[post.kind].append(post)
+
+    def _pop_random(self, kinds: Tuple[str, ...]) -> Optional[Post]:
+        pools = [self.posts[kind] for kind in kinds]
+        total = sum(len(pool) for pool in pools)
+        if not total:
+            return None
+
+        i = random.randrange(total)
+        for pool in pools:
+            if i < len(pool):
+                # Swap with last element, so removal is O(1)
+                pool[i], pool[-1] = pool[-1], pool[i]
+                return pool.pop()
+            i -= len(pool)
+
+
+class RedditSubmissions:
+    """Caches subreddit listings for all guilds.
+
+    Parameters
+    ----------
+    fetch : `Callable[[ListingKey], Awaitable[List[Post]]]`
+        Coroutine function that fetches the posts of a listing
+    listings_path : `str`
+        JSON file listings are persisted to
+    seen_path : `str`
+        JSON file the per-guild seen post IDs are persisted to
+    """
+
+    def __init__(self,
+                 fetch: Callable[[ListingKey], Awaitable[List[Post]]],
+                 listings_path: str,
+                 seen_path: str
+                 ) -> None:
+        self.fetch = fetch
+        self.listings_path = Path(listings_path)
+        self.seen_path = Path(seen_path)
+        self.listings: Dict[ListingKey, Listing] = {}
+        # Key: (Guild ID, ListingKey), Value: IDs of posts shown in guild
+        self.seen: Dict[Tuple[int, ListingKey], Set[str]] = defaultdict(set)
+        # Key: (Guild ID, ListingKey), Value: Unseen posts. Built from listing and seen IDs on demand
+        self._pools: Dict[Tuple[int, ListingKey], PostPool] = {}
+        # Key: ListingKey, Value: Timestamps of recent requests
+        self.requests: Dict[ListingKey, Deque[float]] = defaultdict(deque)
+        self.limiter = RateLimiter(FETCH_RATE, burst=2)
+        self._prefetch_sem = asyncio.Semaphore(PREFETCH_CONCURRENCY)
+        self._inflight: Dict[ListingKey, asyncio.Future] = {}
+        self._extending: Dict[ListingKey, asyncio.Future] = {}
+        self._scheduled: Set[ListingKey] = set() # Keys with a pending background refresh
+        self._dirty = False
+
+    async def get(self, key: ListingKey, *, force: bool=False) -> Listing:
+        """Returns a listing, fetching it if it is missing or expired, or
+        if `force` is True. Concurrent calls for the same key share a single fetch.
+
+        If fetching fails, an expired listing is returned if we have one.
+        """
+        listing = self.listings.get(key)
+        if listing and not listing.expired and not force:
+            return listing
+        if key in self._inflight:
+            return await asyncio.shield(self._inflight[key])
+
+        fut = asyncio.get_event_loop().create_future()
+        self._inflight[key] = fut
+        try:
+            async with self.limiter:
+                posts = await self.fetch(key)
+        except Exception as e:
+            if listing:
+                fut.set_result(listing)
+                return listing
+            fut.set_exception(e)
+            fut.exception() # Don't log the exception if nobody else is waiting
+            raise
+        else:
+            new = self.add(key, posts)
+            fut.set_result(new)
+            return new
+        finally:
+            del self._inflight[key]
+
+    async def extend(self,
+                     key: ListingKey,
+                     n_posts: int,
+                     fetch: Callable[[Listing, int], Awaitable[List[Post]]]
+                     ) -> Listing:
+        """Makes sure a listing has at least `n_posts` posts, by adding posts
+        that continue it to its end, such as further pages of a top listing.
+
+        Shares the fetch rate limit with `get()`, and concurrent calls for the
+        same key share a single fetch. Added posts are kept when the listing
+        is refreshed, so they are only fetched once.
+
+        Parameters
+        ----------
+        key : `ListingKey`
+            Listing to extend. Fetched with `get()` first if needed.
+        n_posts : `int`
+            Number of posts the listing should have
+        fetch : `Callable[[Listing, int], Awaitable[List[Post]]]`
+            Coroutine function that fetches up to N posts following a listing
+
+        Returns
+        -------
+        `Listing`
+            The extended listing. Has fewer than `n_posts` posts if
+            there are no more posts to fetch.
+        """
+        listing = await self.get(key)
+        if not listing.posts or len(listing.posts) >= n_posts:
+            return listing
+        if key in self._extending:
+            return await asyncio.shield(self._extending[key])
+
+        fut = asyncio.get_event_loop().create_future()
+        self._extending[key] = fut
+        try:
+            async with self.limiter:
+                posts = await fetch(listing, n_posts - len(listing.posts))
+        except Exception as e:
+            fut.set_exception(e)
+            fut.exception() # Don't log the exception if nobody else is waiting
+            raise
+        else:
+            # Listing might have been replaced by a refresh in the meantime
+            if self.listings.get(key) is listing:
+                ids = {post.id for post in listing.posts}
+                posts = [post for post in posts if post.id not in ids]
+                listing.posts.extend(posts)
+                listing.extra += len(posts)
+                self._dirty = True
+                for pool_key in [pk for pk in self._pools if pk[1] == key]:
+                    del self._pools[pool_key]
+            fut.set_result(listing)
+            return listing
+        finally:
+            del self._extending[key]
+
+    def add(self, key: ListingKey, posts: List[Post]) -> Listing:
+        # Keep posts a previous version of the listing was extended with
+        old = self.listings.get(key)
+        extra: List[Post] = []
+        if old and old.extra:
+            ids = {post.id for post in posts}
+            extra = [post for post in old.posts[-old.extra:] if post.id not in ids]
+            posts = [*posts, *extra]
+
+        listing = Listing(posts, ttl=LISTING_TTL.get(key[2] or key[1], DEFAULT_TTL), extra=len(extra))
+        self.listings[key] = listing
+        self._dirty = True
+
+        # Forget seen posts that are no longer in the listing
+        ids = {post.id for post in posts}
+        for (guild_id, k), seen in self.seen.items():
+            if k == key:
+                seen &= ids
+        for pool_key in [pk for pk in self._pools if pk[1] == key]:
+            del self._pools[pool_key]
+        return listing
+
+    def record_request(self, key: ListingKey) -> None:
+        now = time.time()
+        requests = self.requests[key]
+        requests.append(now)
+        while requests[0] < now - POPULARITY_WINDOW:
+            requests.popleft()
+
+    def is_popular(self, key: ListingKey) -> bool:
+        requests = self.requests.get(key)
+        if not requests:
+            return False
+        recent = sum(1 for t in requests if t > time.time() - POPULARITY_WINDOW)
+        return recent >= POPULAR_REQUESTS
+
+    def should_refresh(self, key: ListingKey, guild_id: Optional[int]=None) -> bool:
+        """Determines if a popular listing should be refreshed ahead of time,
+        because its TTL is nearly up or a guild is running out of unseen posts."""
+        listing = self.listings.get(key)
+        if not listing or key in self._inflight or key in self._scheduled or not self.is_popular(key):
+            return False
+        if listing.age > listing.ttl * REFRESH_AHEAD:
+            return True
+        return (
+            guild_id is not None
+            and listing.age > MIN_REFRESH_AGE
+            and len(self._get_pool(guild_id, key)) < REFRESH_WATERMARK
+        )
+
+    def refresh_ahead(self, key: ListingKey) -> None:
+        """Schedules a background refresh of a listing."""
+        if key not in self._inflight and key not in self._scheduled:
+            self._scheduled.add(key)
+            asyncio.get_event_loop().create_task(self._prefetch(key))
+
+    def refresh_popular(self) -> None:
+        """Schedules background refreshes of popular listings that are about to expire."""
+        for key in list(self.listings):
+            if self.should_refresh(key):
+                self.refresh_ahead(key)
+
+    async def _prefetch(self, key: ListingKey) -> None:
+        try:
+            async with self._prefetch_sem:
+                await self.get(key, force=True)
+        except Exception as e:
+            print(f"Failed to refresh r/{key[0]} ahead of time: {e}")
+        finally:
+            self._scheduled.discard(key)
+
+    def iter_posts(self, subreddit: str) -> Iterator[Post]:
+        """Returns an iterator over posts of every cached listing of a subreddit.
+        Posts that appear in several listings are included more than once.
+
+        The listings are picked right away, so the iterator can safely be
+        consumed in another thread.
+        """
+        listings = [listing for key, listing in self.listings.items() if key[0] == subreddit.lower()]
+        return itertools.chain.from_iterable(listing.posts for listing in listings)
+
+    def unseen(self, guild_id: int, key: ListingKey) -> List[Post]:
+        """Returns posts of a listing that have not been shown in a guild."""
+        listing = self.listings.get(key)
+        if not listing:
+            return []
+        seen = self.seen.get((guild_id, key), ())
+        return [post for post in listing.posts if post.id not in seen]
+
+    def _get_pool(self, guild_id: int, key: ListingKey) -> PostPool:
+        pool = self._pools.get((guild_id, key))
+        if pool is None:
+            pool = self._pools[(guild_id, key)] = PostPool(self.unseen(guild_id, key))
+        return pool
+
+    def pop_unseen(self,
+                   guild_id: int,
+                   key: ListingKey,
+                   kinds: Tuple[str, ...],
+                   allow_nsfw: bool=True
+                   ) -> Optional[Post]:
+        """Picks a random unseen post of one of the given kinds, and marks it
+        as seen in the guild. Posts of other kinds (and NSFW posts if
+        `allow_nsfw` is False) are left for other requests."""
+        post = self._get_pool(guild_id, key).pop(kinds, allow_nsfw)
+        if post:
+            self.seen[(guild_id, key)].add(post.id)
+            self._dirty = True
+        return post
+
+    def reset_seen(self, guild_id: int, key: ListingKey, kinds: Optional[Tuple[str, ...]]=None) -> bool:
+        """Makes posts of a listing available to a guild again.
+
+        Parameters
+        ----------
+        guild_id : `int`
+            Discord guild ID
+        key : `ListingKey`
+            Listing to reset
+        kinds : `Optional[Tuple[str, ...]]`, optional
+            Only reset posts of these kinds, by default every post.
+            Seen posts of other kinds stay seen.
+
+        Returns
+        -------
+        `bool`
+            False if the listing has no posts of the given kinds, in which
+            case nothing is reset.
+        """
+        if kinds is None:
+            self.seen.pop((guild_id, key), None)
+            self._pools.pop((guild_id, key), None)
+            self._dirty = True
+            return True
+
+        listing = self.listings.get(key)
+        posts = [post for post in listing.posts if post.kind in kinds] if listing else []
+        if not posts:
+            return False
+
+        seen = self.seen.get((guild_id, key))
+        if seen:
+            seen.difference_update(post.id for post in posts)
+        pool = self._pools.get((guild_id, key))
+        if pool is not None:
+            for kind in kinds:
+                pool.posts[kind] = [post for post in posts if post.kind == kind]
+        self._dirty = True
+        return True
+
+    def clear(self) -> None:
+        """Clears all listings and seen posts for all guilds."""
+        self.listings.clear()
+        self.seen.clear()
+        self._pools.clear()
+        self._dirty = True
+
+    def load(self) -> None:
+        """Loads listings and seen posts from disk. NOTE: Blocking!"""
+        try:
+            with open(self.listings_path, "r", encoding="utf-8") as f:
+                d = json.load(f)
+            if d.get("version") == CACHE_VERSION:
+                for k, listing in d["listings"].items():
+                    self.listings[_str_to_key(k)] = Listing(
+                        posts=[Post(*post) for post in listing["posts"]],
+                        fetched_at=listing["fetched_at"],
+                        ttl=listing["ttl"],
+                        extra=listing.get("extra", 0),
+                    )
+        except (OSError, ValueError, KeyError, TypeError):
+            self.listings.clear() # Missing or outdated file. Listings are refetched on demand
+
+        try:
+            with open(self.seen_path, "r", encoding="utf-8") as f:
+                d = json.load(f)
+            for guild_id, keys in d.items():
+                for k, ids in keys.items():
+                    self.seen[(int(guild_id), _str_to_key(k))] = set(ids)
+        except (OSError, ValueError):
+            self.seen.clear()
+
+    async def save(self, force: bool=False) -> None:
+        """Saves listings and seen posts to disk if anything has changed."""
+        if not self._dirty and not force:
+            return
+        self._dirty = False
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, self.save_blocking)
+
+    def save_blocking(self) -> None:
+        """NOTE: Blocking!"""
+        listings = {
+            _key_to_str(key): {
+                "fetched_at": listing.fetched_at,
+                "ttl": listing.ttl,
+                "extra": listing.extra,
+                "posts": [post.to_list() for post in listing.posts],
+            }
+            for key, listing in list(self.listings.items())
+            if listing.age < listing.ttl + MAX_STALE_AGE
+        }
+        seen: Dict[str, Dict[str, List[str]]] = defaultdict(dict)
+        for (guild_id, key), ids in list(self.seen.items()):
+            if ids:
+                seen[str(guild_id)][_key_to_str(key)] = list(ids)
+
+        for path, obj in [(self.listings_path, {"version": CACHE_VERSION, "listings": listings}),
+                          (self.seen_path, seen)]:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(obj, f)
+            os.replace(tmp, path)
+
+
+class RedditAPIError(Exception):
+    """Raised when reddit refuses a request."""
+
+
+class Forbidden(RedditAPIError):
+    """Subreddit is private, quarantined or banned."""
+
+
+class NotFound(RedditAPIError):
+    """Subreddit does not exist."""
+
+
+class RedditClient:
+    """Async client for subreddit listings, using application-only OAuth.
+
+    Requests are paced according to the `X-Ratelimit-*` headers of reddit's
+    responses, which are shared by every listing fetched by the client.
+
+    Parameters
+    ----------
+    client_id : `str`
+        ID of reddit app
+    client_secret : `str`
+        Secret of reddit app
+    user_agent : `str`
+        User agent sent with every request
+    api_url : `str`, optional
+        URL of reddit's API or a fake server, by default REDDIT_API_URL
+    auth_url : `str`, optional
+        URL access tokens are requested from, by default REDDIT_AUTH_URL
+    http : `Optional[httpx.AsyncClient]`, optional
+        Client used for requests, by default the bot-wide client of `utils.http`
+    """
+
+    PAGE_SIZE = 100 # Max posts per page allowed by reddit
+    TOKEN_MARGIN = 60 # Seconds before expiry an access token is renewed
+
+    def __init__(self,
+                 client_id: str,
+                 client_secret: str,
+                 user_agent: str,
+                 *,
+                 api_url: str=REDDIT_API_URL,
+                 auth_url: str=REDDIT_AUTH_URL,
+                 http: Optional[httpx.AsyncClient]=None
+                 ) -> None:
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.user_agent = user_agent
+        self.api_url = api_url.rstrip("/")
+        self.auth_url = auth_url
+        self._http = http
+        self._token: Optional[str] = None
+        self._token_expires = 0.0
+        self._token_lock = asyncio.Lock()
+        # Requests left in the current rate limit window, and when it resets (monotonic time)
+        self._remaining: Optional[float] = None
+        self._reset_at = 0.0
+
+    @property
+    def http(self) -> httpx.AsyncClient:
+        return self._http or get_client()
+
+    async def listing(self,
+                      subreddit: str,
+                      sorting: str,
+                      time: str="all",
+                      limit: int=PAGE_SIZE,
+                      after: Optional[str]=None
+                      ) -> List[Post]:
+        """Fetches up to `limit` posts of a subreddit listing.
+
+        Parameters
+        ----------
+        subreddit : `str`
+            Name of subreddit
+        sorting : `str`
+            "hot" or "top"
+        time : `str`, optional
+            Time filter of "top" listings, by default "all"
+        limit : `int`, optional
+            Max number of posts, by default PAGE_SIZE
+        after : `Optional[str]`, optional
+            ID of a post. If given, the listing continues after this post.
+
+        Raises
+        ------
+        `Forbidden`
+            Raised if subreddit is private, quarantined or banned
+        `NotFound`
+            Raised if subreddit does not exist
+        """
+        params = {"raw_json": 1}
+        if sorting == "top":
+            params["t"] = time
+        if after:
+            params["after"] = f"t3_{after}" # Fullname of post
+
+        # Each page is requested with the ID of the last post of the previous
+        # page, so pages of a single listing can't be fetched concurrently
+        posts: List[Post] = []
+        while len(posts) < limit:
+            params["limit"] = min(self.PAGE_SIZE, limit - len(posts))
+            data = (await self._request(f"/r/{subreddit}/{sorting}", params))["data"]
+            children = data.get("children", [])
+            posts.extend(Post.from_json(child["data"]) for child in children if child.get("kind") == "t3")
+            if not children or not data.get("after"):
+                break
+            params["after"] = data["after"]
+        return posts
+
+    async def _request(self, path: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        for retry in (True, False):
+            await self._wait_for_quota()
+            r = await self.http.get(
+                self.api_url + path,
+                params=params,
+                headers={
+                    "Authorization": f"bearer {await self._get_token()}",
+                    "User-Agent": self.user_agent,
+                },
+                allow_redirects=False
+            )
+            self._update_quota(r)
+            if r.status_code == 401 and retry:
+                self._token = None # Token was revoked or expired early
+            elif r.status_code == 429 and retry:
+                continue # _wait_for_quota() sleeps until the window resets
+            else:
+                break
+
+        # Reddit redirects to a subreddit search if the subreddit doesn't exist
+        if r.status_code in (301, 302, 404):
+            raise NotFound(f"r/{path.split('/')[2]} does not exist")
+        if r.status_code == 403:
+            raise Forbidden(f"r/{path.split('/')[2]} is private or quarantined")
+        if r.status_code != 200:
+            raise RedditAPIError(f"Reddit responded with status {r.status_code}")
+        return r.json()
+
+    async def _get_token(self) -> str:
+        async with self._token_lock:
+            if self._token and time.monotonic() < self._token_expires:
+                return self._token
+            r = await self.http.post(
+                self.auth_url,
+                auth=(self.client_id, self.client_secret),
+                data={"grant_type": "client_credentials"},
+                headers={"User-Agent": self.user_agent}
+            )
+            if r.status_code != 200:
+                raise RedditAPIError(f"Reddit authentication failed with status {r.status_code}")
+            d = r.json()
+            self._token = d["access_token"]
+            self._token_expires = time.monotonic() + d.get("expires_in", 3600) - self.TOKEN_MARGIN
+            return self._token
+
+    async def _wait_for_quota(self) -> None:
+        if self._remaining is None:
+            return
+        if self._remaining >= 1:
+            # Count the request now, so concurrent fetches don't overshoot
+            # the quota before the next response tells us where we are
+            self._remaining -= 1
+            return
+        delay = self._reset_at - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        self._remaining = None # Unknown until next response
+
+    def _update_quota(self, r: httpx.Response) -> None:
+        try:
+            remaining = float(r.headers["X-Ratelimit-Remaining"])
+            reset = float(r.headers["X-Ratelimit-Reset"])
+        except (KeyError, ValueError):
+            if r.status_code != 429:
+                return
+            remaining = 0
+            try:
+                reset = float(r.headers.get("Retry-After", 1))
+            except ValueError:
+                reset = 1
+        if r.status_code == 429:
+            remaining = 0
+        self._remaining = remaining
+        self._reset_at = time.monotonic() + reset
@@ -0,0 +1,187 @@
+"""
+Async fetcher for user timelines, based on the legacy timeline endpoint
+used by https://github.com/kennethreitz/twitter-scraper.
+
+Each user has a `TimelineCursor` that remembers the newest and oldest tweet
+we have stored. Fetching starts at the top of the timeline and stops as soon
+as it reaches a stored tweet. Remaining pages are spent continuing from the
+oldest stored tweet, until the end of the timeline is reached.
+"""
+import asyncio
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple, Union
+
+import httpx
+from requests_html import HTML
+
+from ..config import TWITTER_BASE_URL, TWITTER_MAX_CONCURRENT, TWITTER_RATE_LIMIT
+from .concurrency import RateLimiter, gather_bounded
+from .http import get_client
+
+TIMELINE_PATH = "/i/profiles/show/{user}/timeline/tweets"
+TIMELINE_PARAMS = {
+    "include_available_features": 1,
+    "include_entities": 1,
+    "include_new_items_bar": "true",
+}
+HEADERS = {
+    "Accept": "application/json, text/javascript, */*; q=0.01",
+    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_12_6) AppleWebKit/603.3.8 (KHTML, like Gecko) Version/10.1.2 Safari/603.3.8",
+    "X-Twitter-Active-User": "yes",
+    "X-Requested-With": "XMLHttpRequest",
+}
+
+# (status ID, URL, text)
+TweetRow = Tuple[int, str, str]
+
+
+@dataclass
+class TimelineCursor:
+    newest: Optional[int] = None # ID of newest stored tweet
+    oldest: Optional[int] = None # ID of oldest stored tweet
+    exhausted: bool = False # Oldest stored tweet is the first tweet of the timeline
+
+
+@dataclass
+class FetchResult:
+    user: str
+    cursor: TimelineCursor
+    tweets: List[TweetRow] = field(default_factory=list) # Tweets that were not already stored
+
+
+def parse_timeline_page(user: str, items_html: str, base_url: str=TWITTER_BASE_URL) -> List[TweetRow]:
+    """Parses tweets from the HTML of a timeline page."""
+    html = HTML(html=items_html, url="bunk", default_encoding="utf-8")
+    tweets = []
+    for item in html.find(".stream-item"):
+        try:
+            tweet_id = int(item.attrs["data-item-id"])
+            text = item.find(".tweet-text")[0].full_text
+        except (KeyError, IndexError, ValueError):
+            continue # Not a tweet
+        # Strip trailing links to images and other tweets
+        text = text.split("pic.twitter.com")[0].split("https://")[0]
+        tweets.append((tweet_id, f"{base_url}/{user}/status/{tweet_id}", text))
+    return tweets
+
+
+class TimelineFetcher:
+    """Fetches new tweets for one or more users.
+
+    Parameters
+    ----------
+    base_url : `str`, optional
+        URL of Twitter or a fake timeline server, by default TWITTER_BASE_URL
+    pages : `int`, optional
+        Max pages fetched per user per call, by default 20
+    limiter : `Optional[RateLimiter]`, optional
+        Rate limiter shared by every request, by default TWITTER_RATE_LIMIT requests/s
+    concurrency : `int`, optional
+        Max users fetched at the same time, by default TWITTER_MAX_CONCURRENT
+    http : `Optional[httpx.AsyncClient]`, optional
+        Client used for requests, by default the bot-wide client of `utils.http`
+    """
+
+    def __init__(self,
+                 base_url: str=TWITTER_BASE_URL,
+                 *,
+                 pages: int=20,
+                 limiter: Optional[RateLimiter]=None,
+                 concurrency: int=TWITTER_MAX_CONCURRENT,
+                 http: Optional[httpx.AsyncClient]=None
+                 ) -> None:
+        self.base_url = base_url.rstrip("/")
+        self.pages = pages
+        self.limiter = limiter or RateLimiter(TWITTER_RATE_LIMIT)
+        self.concurrency = concurrency
+        self._http = http
+
+    @property
+    def http(self) -> httpx.AsyncClient:
+        return self._http or get_client()
+
+    async def fetch(self, user: str, cursor: Optional[TimelineCursor]=None) -> FetchResult:
+        """Fetches tweets of a user that are not covered by `cursor`.
+
+        Raises
+        ------
+        `ValueError`
+            Raised if user does not exist or is private
+        """
+        cursor = cursor or TimelineCursor()
+        result = FetchResult(user, TimelineCursor(cursor.newest, cursor.oldest, cursor.exhausted))
+        pages = self.pages
+
+        # New tweets, from the top of the timeline until we reach a stored tweet
+        position = None
+        caught_up = False
+        while pages > 0:
+            tweets, has_more = await self._get_page(user, position)
+            pages -= 1
+            new = [t for t in tweets if not cursor.newest or t[0] > cursor.newest]
+            result.tweets.extend(new)
+            if not has_more and not cursor.newest:
+                result.cursor.exhausted = True # Fetched whole timeline of a new user
+            if not has_more or len(new) < len(tweets):
+                caught_up = True
+                break
+            position = tweets[-1][0]
+
+        # Only move the newest position if there is no gap between the
+        # fetched tweets and the stored ones. Otherwise the next fetch
+        # starts from the top again and fills the gap.
+        if result.tweets and (caught_up or not cursor.newest):
+            result.cursor.newest = max(t[0] for t in result.tweets)
+
+        # Older tweets, continuing from the oldest stored tweet
+        position = cursor.oldest
+        while pages > 0 and position and not result.cursor.exhausted:
+            tweets, has_more = await self._get_page(user, position)
+            pages -= 1
+            result.tweets.extend(t for t in tweets if t[0] < cursor.oldest)
+            if not has_more:
+                result.cursor.exhausted = True
+                break
+            position = tweets[-1][0]
+
+        if result.tweets:
+            result.cursor.oldest = min([t[0] for t in result.tweets] + [cursor.oldest or result.cursor.newest])
+        return result
+
+    async def fetch_many(self,
+                         cursors: Dict[str, Optional[TimelineCursor]]
+                         ) -> Dict[str, Union[FetchResult, Exception]]:
+        """Fetches several users concurrently. Errors are returned
+        instead of raised, so one failing user doesn't affect the others."""
+        async def fetch(user: str) -> Union[FetchResult, Exception]:
+            try:
+                return await self.fetch(user, cursors[user])
+            except (ValueError, httpx.HTTPError) as e:
+                return e
+
+        users = list(cursors)
+        results = await gather_bounded((fetch(user) for user in users), limit=self.concurrency)
+        return dict(zip(users, results))
+
+    async def _get_page(self, user: str, max_position: Optional[int]) -> Tuple[List[TweetRow], bool]:
+        params = dict(TIMELINE_PARAMS)
+        if max_position:
+            params["max_position"] = max_position
+
+        async with self.limiter:
+            r = await self.http.get(
+                self.base_url + TIMELINE_PATH.format(user=user),
+                params=params,
+                headers={**HEADERS, "Referer": f"{self.base_url}/{user}"}
+            )
+        try:
+            page = r.json()
+            items_html = page["items_html"]
+        except (ValueError, KeyError, TypeError):
+            raise ValueError(f'Oops! Either "{user}" does not exist or is private.')
+
+        # Parsing is CPU-bound, don't block the event loop
+        loop = asyncio.get_event_loop()
+        tweets = await loop.run_in_executor(None, parse_timeline_page, user, items_html, self.base_url)
+        has_more = bool(tweets) and page.get("has_more_items", True)
+        return tweets, has_more